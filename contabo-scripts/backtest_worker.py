@@ -8,6 +8,8 @@ import sys
 import time
 import json
 import signal
+import socket
+import threading
 import psycopg2
 import requests
 from datetime import datetime
@@ -16,6 +18,39 @@ from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeou
 # Backtest timeout in seconds (2 hours)
 BACKTEST_TIMEOUT = 2 * 60 * 60
 
+# Pass-1 state of running jobs is saved here, so a job interrupted by a
+# worker restart picks up where it was when it runs again
+CHECKPOINT_DIR = '/opt/algotcha/checkpoints'
+
+# A job that uses up its time budget is queued again to resume from its
+# checkpoint, at most this many runs in all before it fails
+MAX_ATTEMPTS = 12
+
+# Jobs are claimed under this id, stable across restarts so a restarted
+# worker finds the jobs it was running; give each worker on a host its own
+WORKER_ID = os.getenv('BACKTEST_WORKER_ID') or socket.gethostname()
+
+# A running job's heartbeat is refreshed with its progress every few
+# seconds; a processing job silent for this long lost its worker
+HEARTBEAT_STALE = 5 * 60
+
+# Checkpoints untouched for this long belong to jobs that will not resume
+# (deleted from the app, or lost); they are swept at startup
+CHECKPOINT_MAX_AGE = 7 * 24 * 60 * 60
+
+# Queue progress (%) over each phase run_backtest reports; simulate moves
+# across its range with the share of bars read, the others start at theirs
+PROGRESS_PHASES = {
+    'load': (0, 5),
+    'simulate': (5, 85),
+    'replay': (85, 95),
+    'metrics': (95, 99),
+}
+
+# Monte Carlo robustness check run on every crypto result unless the job's
+# payload sets its own monte_carlo (false turns it off)
+MONTE_CARLO = True
+
 # Add script directory to path for imports
 sys.path.insert(0, '/opt/algotcha/scripts')
 import backtest2
@@ -49,6 +84,25 @@ def log(msg):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"[{timestamp}] {msg}", flush=True)
 
+def checkpoint_path(queue_id):
+    return os.path.join(CHECKPOINT_DIR, f"backtest_{queue_id}.pkl")
+
+def remove_checkpoints(queue_id):
+    """Delete a job's checkpoint and the per-pair checkpoints next to it"""
+    prefix = os.path.basename(checkpoint_path(queue_id))
+    for name in os.listdir(CHECKPOINT_DIR):
+        if name.startswith(prefix):
+            os.remove(os.path.join(CHECKPOINT_DIR, name))
+
+def sweep_checkpoints():
+    """Delete checkpoints older than CHECKPOINT_MAX_AGE"""
+    now = time.time()
+    for name in os.listdir(CHECKPOINT_DIR):
+        path = os.path.join(CHECKPOINT_DIR, name)
+        if now - os.path.getmtime(path) > CHECKPOINT_MAX_AGE:
+            os.remove(path)
+            log(f"🧹 Removed stale checkpoint {name}")
+
 def get_db_connection():
     """Connect to PostgreSQL database"""
     try:
@@ -178,32 +232,6 @@ def notify_user(notify_via, email, telegram_id, strategy_name, metrics, status,
     if notify_via in ['email', 'both'] and email:
         send_email(email, email_subject, email_html)
 
-def estimate_backtest_duration(payload):
-    """Estimate how long a backtest will take based on parameters"""
-    num_pairs = len(payload.get('pairs', []))
-    
-    # Calculate date range in days
-    try:
-        start = datetime.strptime(payload.get('start_date', '2025-06-01'), '%Y-%m-%d')
-        end = datetime.strptime(payload.get('end_date', '2025-12-01'), '%Y-%m-%d')
-        days = (end - start).days
-    except:
-        days = 180
-    
-    # Count conditions
-    entry_conditions = len(payload.get('entry_conditions', []))
-    exit_conditions = len(payload.get('exit_conditions', []))
-    total_conditions = entry_conditions + exit_conditions + 1
-    
-    # Base time: ~3 seconds per pair per 30 days, scaled by conditions
-    base_seconds_per_pair = 3 * (days / 30) * (total_conditions / 2)
-    estimated_seconds = base_seconds_per_pair * num_pairs
-    
-    # Add overhead and clamp to reasonable range
-    estimated_seconds = max(10, min(estimated_seconds * 1.2, 600))  # 10s to 10min
-    
-    return int(estimated_seconds)
-
 def process_backtest(queue_item, conn):
     """Process a single backtest from the queue"""
     queue_id = queue_item[0]
@@ -213,10 +241,11 @@ def process_backtest(queue_item, conn):
     notify_via = queue_item[4]
     notify_email = queue_item[5]
     notify_telegram = queue_item[6]
+    attempts = queue_item[7]
     
     log(f"🚀 Processing backtest #{queue_id}: {strategy_name}")
     
-    # Parse payload first to estimate duration
+    # Parse payload first to validate it
     payload = json.loads(payload_json)
     
     # ========== VALIDATION ==========
@@ -279,34 +308,33 @@ def process_backtest(queue_item, conn):
         conn.commit()
         return
     
-    estimated_duration = estimate_backtest_duration(payload)
-    log(f"📊 Estimated duration: {estimated_duration}s")
-    
-    # Update status to processing
-    cursor.execute("""
-        UPDATE "BacktestQueue" 
-        SET status = 'processing', "startedAt" = NOW(), progress = 0
-        WHERE id = %s
-    """, (queue_id,))
-    conn.commit()
-    
-    # Progress updater that runs in background
+    # The engine reports its phase and bars read through on_progress; the
+    # updater writes that to the queue every few seconds and sets cancel once
+    # the job is cancelled from the app, which stops the engine at its next
+    # window
+    progress_state = {'phase': 'load', 'done': 0, 'total': 0}
+    cancel = threading.Event()
     progress_stop = [False]
+    def on_progress(phase, done, total):
+        progress_state.update(phase=phase, done=done, total=total)
     def update_progress():
+        progress_cursor = conn.cursor()
         while not progress_stop[0]:
             try:
-                elapsed = time.time() - start_time
-                # Calculate progress based on elapsed vs estimated time
-                # Use logarithmic curve to slow down as we approach 100%
-                raw_progress = min(elapsed / estimated_duration, 0.99)
-                # Smoother curve: accelerate early, slow near end
-                progress = int(raw_progress * 95)  # Cap at 95% until actually done
+                phase, done, total = progress_state['phase'], progress_state['done'], progress_state['total']
+                low, high = PROGRESS_PHASES[phase]
+                fraction = min(done / total, 1.0) if phase == 'simulate' and total else 0.0
+                progress = int(low + (high - low) * fraction)
                 
-                cursor.execute("""
-                    UPDATE "BacktestQueue" SET progress = %s WHERE id = %s
+                progress_cursor.execute("""
+                    UPDATE "BacktestQueue" SET progress = %s, "heartbeatAt" = NOW() WHERE id = %s
+                    RETURNING status
                 """, (progress, queue_id))
+                row = progress_cursor.fetchone()
                 conn.commit()
-                log(f"   Progress: {progress}% ({int(elapsed)}s / ~{estimated_duration}s)")
+                if row and row[0] == 'cancelled':
+                    cancel.set()
+                log(f"   Progress: {progress}% ({phase}, {done:,}/{total:,} bars, {int(time.time() - start_time)}s)")
             except Exception as e:
                 log(f"   Progress update error: {e}")
             time.sleep(5)  # Update every 5 seconds
@@ -317,7 +345,6 @@ def process_backtest(queue_item, conn):
         start_time = time.time()
         
         # Start progress updater in background thread
-        import threading
         progress_thread = threading.Thread(target=update_progress, daemon=True)
         progress_thread.start()
         
@@ -334,17 +361,44 @@ def process_backtest(queue_item, conn):
         
         # Use ThreadPoolExecutor with timeout
         with ThreadPoolExecutor(max_workers=1) as executor:
-            future = executor.submit(backtest_module.run_backtest, payload)
+            run_payload = dict(payload)
+            run_payload.setdefault('monte_carlo', MONTE_CARLO)
+            run_payload['checkpoint'] = checkpoint_path(queue_id)
+            # Stop a minute early with the progress saved rather than be cut off
+            run_payload['time_budget'] = BACKTEST_TIMEOUT - 60
+            # The stocks engine has no progress or cancel hooks
+            run_kwargs = {'progress': on_progress, 'cancel': cancel} if backtest_module is backtest2 else {}
+            future = executor.submit(backtest_module.run_backtest, run_payload, **run_kwargs)
             try:
                 result = future.result(timeout=BACKTEST_TIMEOUT)
             except FuturesTimeoutError:
                 log(f"⚠️ Backtest timed out after {BACKTEST_TIMEOUT//60} minutes")
+                # Stop the engine so leaving the executor frees the CPU
+                cancel.set()
                 raise Exception(f"Backtest timed out after {BACKTEST_TIMEOUT//60} minutes")
+            finally:
+                # Stop progress updater
+                progress_stop[0] = True
         
-        # Stop progress updater
-        progress_stop[0] = True
         elapsed = time.time() - start_time
         
+        if result.get('status') == 'cancelled':
+            # The app already marked the job cancelled; its saved state is of no use
+            log(f"🛑 Backtest #{queue_id} cancelled after {elapsed:.1f}s")
+            remove_checkpoints(queue_id)
+            return False
+        
+        if result.get('status') == 'suspended' and attempts < MAX_ATTEMPTS:
+            # Out of time with pass 1 saved: back to the queue, behind jobs
+            # that have not run yet, to carry on from the checkpoint
+            log(f"⏸️ Backtest #{queue_id} suspended after {elapsed:.1f}s (run {attempts}/{MAX_ATTEMPTS}), re-queued")
+            cursor.execute("""
+                UPDATE "BacktestQueue" SET status = 'queued', "workerId" = NULL
+                WHERE id = %s AND status = 'processing'
+            """, (queue_id,))
+            conn.commit()
+            return False
+        
         if result.get('status') == 'success':
             metrics = result.get('metrics', {})
             
@@ -357,6 +411,15 @@ def process_backtest(queue_item, conn):
             log(f"   Win Rate: {metrics.get('win_rate', 0)*100:.2f}%")
             log(f"   Total Trades: {metrics.get('total_trades', 0)}")
             
+            # Monte Carlo percentiles are stored with the chart data
+            chart_data = result_converted.get('chartData', {})
+            monte_carlo = result_converted.get('monte_carlo')
+            if monte_carlo:
+                chart_data['monteCarlo'] = monte_carlo
+                drawdowns = ', '.join(f"{k} {v*100:.2f}%" for k, v in monte_carlo['max_drawdown'].items())
+                log(f"   Monte Carlo ({monte_carlo['paths']} paths): max drawdown {drawdowns}, "
+                    f"P(loss) {monte_carlo['probability_of_loss']*100:.1f}%")
+            
             # Extract ALL trades from df_out (both BUY and SELL)
             trades = []
             df_out = result_converted.get('df_out', [])
@@ -406,7 +469,7 @@ def process_backtest(queue_item, conn):
                 int(metrics.get('total_trades', 0)),
                 float(metrics.get('profit_factor', 0)) if metrics.get('profit_factor') != 'Infinity' else 999.0,
                 float(metrics.get('yearly_return', 0)),
-                json.dumps(result_converted.get('chartData', {})),
+                json.dumps(chart_data),
                 json.dumps(trades),
                 user_id
             ))
@@ -427,7 +490,10 @@ def process_backtest(queue_item, conn):
             return True
         else:
             error_msg = result.get('message', 'Unknown error')
+            if result.get('status') == 'suspended':
+                error_msg = f"Backtest did not finish in {MAX_ATTEMPTS} runs of {BACKTEST_TIMEOUT//60} minutes"
             log(f"❌ Backtest failed: {error_msg}")
+            remove_checkpoints(queue_id)
             
             cursor.execute("""
                 UPDATE "BacktestQueue" 
@@ -443,6 +509,7 @@ def process_backtest(queue_item, conn):
     except Exception as e:
         error_msg = str(e)
         log(f"❌ Exception: {error_msg}")
+        remove_checkpoints(queue_id)
         
         cursor.execute("""
             UPDATE "BacktestQueue" 
@@ -467,23 +534,49 @@ def main():
         return
     
     log("✅ Connected to database")
+    os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+    sweep_checkpoints()
+    
+    # Jobs this worker was running were cut off by its restart, and jobs
+    # whose heartbeat went stale lost theirs; queue them again so they resume
+    # from their checkpoints. Jobs other workers are running are left alone.
+    cursor = conn.cursor()
+    cursor.execute("""
+        UPDATE "BacktestQueue" SET status = 'queued', "workerId" = NULL
+        WHERE status = 'processing'
+          AND ("workerId" = %s
+               OR COALESCE("heartbeatAt", "startedAt") < NOW() - make_interval(secs => %s))
+        RETURNING id
+    """, (WORKER_ID, HEARTBEAT_STALE))
+    requeued = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+    if requeued:
+        log(f"🔁 Re-queued interrupted backtests: {requeued}")
     log("⏳ Waiting for backtest jobs...")
     
     while True:
         try:
             cursor = conn.cursor()
             
-            # Get next queued item
+            # Claim the next queued item; SKIP LOCKED keeps two workers from
+            # claiming the same one
             cursor.execute("""
-                SELECT id, "userId", "strategyName", payload, "notifyVia", 
-                       "notifyEmail", "notifyTelegram"
-                FROM "BacktestQueue"
-                WHERE status = 'queued'
-                ORDER BY "createdAt" ASC
-                LIMIT 1
-            """)
+                UPDATE "BacktestQueue"
+                SET status = 'processing', "startedAt" = NOW(), progress = 0, attempts = attempts + 1,
+                    "workerId" = %s, "heartbeatAt" = NOW()
+                WHERE id = (
+                    SELECT id FROM "BacktestQueue"
+                    WHERE status = 'queued'
+                    ORDER BY attempts ASC, "createdAt" ASC
+                    LIMIT 1
+                    FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, "userId", "strategyName", payload, "notifyVia", 
+                          "notifyEmail", "notifyTelegram", attempts
+            """, (WORKER_ID,))
             
             queue_item = cursor.fetchone()
+            conn.commit()
             
             if queue_item:
                 process_backtest(queue_item, conn)
@@ -413,32 +413,12 @@ def run_preset_backtest(strategy_id):
     
     preset = PRESET_STRATEGIES[strategy_id]
     
-    # Get date range to determine memory constraints
     start_date = body.get('start_date', '2024-01-01')
     end_date = body.get('end_date', '2025-04-01')
     
-    # Calculate period length in years
-    from datetime import datetime
-    try:
-        start_dt = datetime.strptime(start_date, '%Y-%m-%d')
-        end_dt = datetime.strptime(end_date, '%Y-%m-%d')
-        period_years = (end_dt - start_dt).days / 365.0
-    except:
-        period_years = 1.0
-    
-    # Limit pairs based on period length (memory constraints)
-    # - Long periods (>3 years): max 2 pairs
-    # - Medium periods (1-3 years): max 5 pairs
-    # - Short periods (<1 year): max 5 pairs
-    if period_years > 3:
-        max_pairs = 2
-    else:
-        max_pairs = 5
-    
-    # Apply user-requested pairs with limit
-    requested_pairs = body.get('pairs', preset['pairs'][:max_pairs])
-    if len(requested_pairs) > max_pairs:
-        requested_pairs = requested_pairs[:max_pairs]
+    # The engine streams the date range a month at a time, so memory does not
+    # grow with the number of pairs or years and every preset pair can run.
+    requested_pairs = body.get('pairs', preset['pairs'])
     
     # Max active deals = number of pairs chosen (user constraint)
     num_pairs = len(requested_pairs)
@@ -488,6 +468,7 @@ def run_preset_backtest(strategy_id):
     
     try:
         import backtest2
+        import backtest_charts
         backtest2.DATA_DIR = DATA_DIR
         result = backtest2.run_backtest(payload)
         
@@ -520,10 +501,10 @@ def run_preset_backtest(strategy_id):
             if chart_data:
                 timestamps = chart_data.get('timestamps', [])
                 balances = chart_data.get('unrealized_balance', [])
-                # Sample to reduce size
-                step = max(1, len(timestamps) // 100)
-                for i in range(0, len(timestamps), step):
-                    if i < len(balances):
+                # Sample to reduce size, keeping the equity peaks and troughs
+                n_points = min(len(timestamps), len(balances))
+                if n_points:
+                    for i in backtest_charts.chart_indices([balances[:n_points]], max_points=100):
                         balance_history.append({
                             'date': timestamps[i][:10] if len(timestamps[i]) > 10 else timestamps[i],
                             'balance': balances[i]
@@ -10,9 +10,14 @@ import time
 from datetime import datetime, timezone, timedelta
 import ccxt
 import pandas as pd
+import pyarrow.parquet as pq
 import numpy as np
 import ta
 
+# backtest_data is deployed next to the backtest scripts
+sys.path.insert(0, '/opt/algotcha/scripts')
+import backtest_data
+
 DATA_DIR = '/opt/algotcha/data'
 LOG_FILE = '/opt/algotcha/logs/update.log'
 
@@ -165,7 +170,9 @@ def update_symbol(exchange, symbol):
         
         # Reset index and save
         merged.reset_index(inplace=True)
-        merged.to_parquet(filepath, index=False)
+        merged = backtest_data.add_daily_volume(merged)
+        # Record the timestamp order so the backtester can skip re-sorting
+        merged.to_parquet(filepath, index=False, sorting_columns=[pq.SortingColumn(0)])
         
         log(f"  ✅ {symbol}: Updated ({len(merged)} rows)")
         
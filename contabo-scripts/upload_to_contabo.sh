@@ -29,6 +29,16 @@ scp $BACKEND_DIR/hetzner-setup/algotcha-data.service $SERVER:/etc/systemd/system
 # Step 4: Upload backtest scripts
 echo "📤 Uploading backtest scripts..."
 scp $BACKEND_DIR/scripts/backtest2.py $SERVER:/opt/algotcha/scripts/ 2>/dev/null || echo "  (backtest2.py not found in scripts/, skipping)"
+scp $BACKEND_DIR/scripts/backtest_core.py $SERVER:/opt/algotcha/scripts/ 2>/dev/null || echo "  (backtest_core.py not found in scripts/, skipping)"
+scp $BACKEND_DIR/scripts/backtest_conditions.py $SERVER:/opt/algotcha/scripts/ 2>/dev/null || echo "  (backtest_conditions.py not found in scripts/, skipping)"
+scp $BACKEND_DIR/scripts/backtest_metrics.py $SERVER:/opt/algotcha/scripts/ 2>/dev/null || echo "  (backtest_metrics.py not found in scripts/, skipping)"
+scp $BACKEND_DIR/scripts/backtest_baseline.py $SERVER:/opt/algotcha/scripts/ 2>/dev/null || echo "  (backtest_baseline.py not found in scripts/, skipping)"
+scp $BACKEND_DIR/scripts/backtest_charts.py $SERVER:/opt/algotcha/scripts/ 2>/dev/null || echo "  (backtest_charts.py not found in scripts/, skipping)"
+scp $BACKEND_DIR/scripts/backtest_data.py $SERVER:/opt/algotcha/scripts/ 2>/dev/null || echo "  (backtest_data.py not found in scripts/, skipping)"
+scp $BACKEND_DIR/scripts/backtest_stops.py $SERVER:/opt/algotcha/scripts/ 2>/dev/null || echo "  (backtest_stops.py not found in scripts/, skipping)"
+scp $BACKEND_DIR/scripts/backtest_sweep.py $SERVER:/opt/algotcha/scripts/ 2>/dev/null || echo "  (backtest_sweep.py not found in scripts/, skipping)"
+scp $BACKEND_DIR/scripts/backtest_montecarlo.py $SERVER:/opt/algotcha/scripts/ 2>/dev/null || echo "  (backtest_montecarlo.py not found in scripts/, skipping)"
+scp $BACKEND_DIR/scripts/backtest_passes.py $SERVER:/opt/algotcha/scripts/ 2>/dev/null || echo "  (backtest_passes.py not found in scripts/, skipping)"
 
 # Step 5: Upload backtest results (small - ~6MB total)
 echo "📤 Uploading backtest results..."
@@ -0,0 +1,4 @@
+-- Count the runs of each queued backtest; a run that uses up its time budget
+-- is queued again and resumes from its checkpoint
+ALTER TABLE "BacktestQueue"
+ADD COLUMN IF NOT EXISTS "attempts" INTEGER NOT NULL DEFAULT 0;
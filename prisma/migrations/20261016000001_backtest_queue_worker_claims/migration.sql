@@ -0,0 +1,5 @@
+-- Record which worker runs a backtest and when it last reported, so a
+-- restarting worker re-queues only its own or abandoned jobs
+ALTER TABLE "BacktestQueue"
+ADD COLUMN IF NOT EXISTS "workerId" TEXT,
+ADD COLUMN IF NOT EXISTS "heartbeatAt" TIMESTAMP(3);
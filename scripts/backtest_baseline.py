@@ -0,0 +1,94 @@
+"""
+Buy-and-hold baseline for the crypto backtest charts.
+
+The benchmark's close series is read once per data version (file path, size
+and mtime) and kept as sorted int64 timestamps and closes. A run then slices it
+by binary search: the old resample("1min").ffill() grid is never built, the
+value at any minute being the last close at or before it. The chart gets the
+baseline at display resolution instead of one point per minute of history.
+"""
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+BENCHMARK_SYMBOL = "BTC/USDT"
+BASELINE_POINTS = 1000
+
+NS_PER_MINUTE = 60 * 1_000_000_000
+
+
+@lru_cache(maxsize=4)
+def _load_closes(file_path, size, mtime_ns):
+    df = pd.read_parquet(file_path, columns=["timestamp", "close"])
+    ts = pd.to_datetime(df["timestamp"]).to_numpy().astype("datetime64[ns]").view("int64")
+    close = df["close"].to_numpy(dtype=np.float64)
+    order = np.argsort(ts, kind="stable")
+    return ts[order], close[order]
+
+
+def load_benchmark(data_dir, symbol=BENCHMARK_SYMBOL):
+    """
+    Sorted (timestamps_ns, closes) for symbol, cached until its parquet file
+    changes. None when there is no file for symbol.
+    """
+    file_path = os.path.join(data_dir, f"{symbol.replace('/','_')}_all_tf_merged.parquet")
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return _load_closes(file_path, stat.st_size, stat.st_mtime_ns)
+
+
+def _close_at(ts, close, minutes):
+    """Close carried forward to each minute, NaN before the first bar."""
+    idx = np.searchsorted(ts, minutes, side="right") - 1
+    out = close[np.maximum(idx, 0)]
+    return np.where(idx >= 0, out, np.nan)
+
+
+def buy_and_hold(data_dir, symbol, ledger_timestamps, initial_balance, max_points=BASELINE_POINTS,
+                 span=None):
+    """
+    Value of initial_balance put into symbol at the first minute of the run.
+
+    The run covers the ledger timestamps, or the (first, last) timestamps given
+    as span (e.g. the equity curve, which can run past the last trade).
+    Returns (chart_timestamps, chart_balance, ledger_balance): the baseline at
+    no more than max_points evenly spaced minutes, and its value at each ledger
+    timestamp (NaN off the minute grid, like the old join). Returns None when
+    the benchmark has no data in the run's range, or no data file.
+    """
+    benchmark = load_benchmark(data_dir, symbol)
+    if benchmark is None:
+        return None
+    ts, close = benchmark
+    ledger_ns = pd.to_datetime(ledger_timestamps).to_numpy().astype("datetime64[ns]").view("int64")
+    if len(ts) == 0 or len(ledger_ns) == 0:
+        return None
+    if span is None:
+        first_ns, last_ns = ledger_ns.min(), ledger_ns.max()
+    else:
+        first_ns, last_ns = (pd.Timestamp(t).value for t in span)
+    grid_first = ts[0] // NS_PER_MINUTE * NS_PER_MINUTE
+    grid_last = ts[-1] // NS_PER_MINUTE * NS_PER_MINUTE
+    start = max(-(-first_ns // NS_PER_MINUTE) * NS_PER_MINUTE, grid_first)
+    end = min(last_ns // NS_PER_MINUTE * NS_PER_MINUTE, grid_last)
+    if start > end:
+        return None
+
+    coins_held = initial_balance / _close_at(ts, close, np.array([start]))[0]
+
+    n_minutes = (end - start) // NS_PER_MINUTE + 1
+    stride = max(1, -(-n_minutes // max_points))
+    minutes = np.arange(start, end + 1, stride * NS_PER_MINUTE, dtype=np.int64)
+    if minutes[-1] != end:
+        minutes = np.append(minutes, end)
+    chart_balance = _close_at(ts, close, minutes) * coins_held
+
+    on_grid = (ledger_ns % NS_PER_MINUTE == 0) & (ledger_ns >= start) & (ledger_ns <= end)
+    ledger_balance = np.where(on_grid, _close_at(ts, close, ledger_ns) * coins_held, np.nan)
+
+    chart_timestamps = pd.DatetimeIndex(minutes.view("datetime64[ns]")).astype(str).tolist()
+    return chart_timestamps, chart_balance.tolist(), ledger_balance
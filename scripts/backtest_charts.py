@@ -0,0 +1,31 @@
+"""
+Chart series thinning for backtest results.
+
+The ledger has one row per trade event, which for DCA strategies runs into
+hundreds of thousands of points that nobody can see on a chart. chart_indices()
+picks the rows to plot by splitting the ledger into equal buckets and keeping,
+for every series, the first minimum and maximum inside each bucket plus the
+first and last row. Peaks and troughs therefore survive (the global extremes
+always do), and series that share a time axis stay aligned.
+"""
+import numpy as np
+
+CHART_POINTS = 1000
+
+
+def chart_indices(series, max_points=CHART_POINTS):
+    """Sorted row indices, at most about max_points, preserving each series' extremes."""
+    n = len(series[0])
+    if n <= max_points:
+        return np.arange(n)
+    n_buckets = max(1, (max_points - 2) // (2 * len(series)))
+    starts = np.linspace(0, n, n_buckets + 1).astype(np.int64)[:-1]
+    bucket = np.repeat(np.arange(n_buckets), np.diff(np.append(starts, n)))
+    keep = [np.array([0, n - 1])]
+    for values in series:
+        y = np.asarray(values, dtype=np.float64)
+        for reduce in (np.fmin, np.fmax):
+            extreme = reduce.reduceat(y, starts)
+            hits = np.flatnonzero(y == extreme[bucket])
+            keep.append(hits[np.unique(bucket[hits], return_index=True)[1]])
+    return np.unique(np.concatenate(keep))
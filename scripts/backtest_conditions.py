@@ -0,0 +1,249 @@
+"""
+Vectorized condition compiler for the crypto backtest engine.
+
+compile_conditions() parses the entry/exit/safety condition JSON once and
+returns a function that evaluates the whole list over one symbol's frame,
+producing a boolean mask with the same result the engine's former row-by-row
+check_all_user_conditions() gave (kept in tests/legacy_backtest.py).
+Crossing operators compare against the previous row of the frame, so callers
+pass each symbol's rows in time order with rows the simulation never sees
+(e.g. below min_daily_volume) already removed. A frame
+that continues an earlier one (the next window of a streamed run) is passed
+together with the last row of that earlier frame.
+"""
+import numpy as np
+
+TV_SYNONYMS = {
+    "Buy": {"Buy", "Strong Buy"},
+    "Strong Buy": {"Strong Buy"},
+    "Sell": {"Sell", "Strong Sell"},
+    "Strong Sell": {"Strong Sell"},
+    "Neutral": {"Neutral"}
+}
+
+
+class _Columns:
+    """Per-frame column cache handing out current and previous-row arrays."""
+
+    def __init__(self, df, prev_row=None):
+        self.df = df
+        self.prev_row = prev_row
+        self.n = len(df)
+        self.cur = {}
+        self.prev = {}
+
+    def get(self, name):
+        if name not in self.cur:
+            self.cur[name] = self.df[name].to_numpy() if name in self.df.columns else None
+        return self.cur[name]
+
+    def shifted(self, name):
+        if name not in self.prev:
+            arr = self.get(name)
+            if arr is None:
+                self.prev[name] = None
+            else:
+                prev = np.empty(self.n, dtype=np.float64)
+                if self.n:
+                    prev[0] = np.nan
+                    if self.prev_row is not None and name in self.prev_row.columns and len(self.prev_row):
+                        prev[0] = self.prev_row[name].iloc[-1]
+                    prev[1:] = arr[:-1]
+                self.prev[name] = prev
+        return self.prev[name]
+
+    def false(self):
+        return np.zeros(self.n, dtype=np.bool_)
+
+    def true(self):
+        return np.ones(self.n, dtype=np.bool_)
+
+
+def _suffix(col, tf):
+    return col if tf == "1m" else f"{col}_{tf}"
+
+
+def _threshold(op, value):
+    """Less/Greater/Crossing against a constant value."""
+    def term(cols, col):
+        cur = cols.get(col)
+        if cur is None or value is None:
+            return cols.false()
+        if op == "Less Than":
+            return cur < value
+        if op == "Greater Than":
+            return cur > value
+        prev = cols.shifted(col)
+        if op == "Crossing Down":
+            return (prev >= value) & (cur < value)
+        if op == "Crossing Up":
+            return (prev <= value) & (cur > value)
+        return cols.false()
+    return term
+
+
+def _line_vs_line(op):
+    """Less/Greater/Crossing of one column against another."""
+    def term(cols, col_a, col_b):
+        a = cols.get(col_a)
+        b = cols.get(col_b)
+        if a is None or b is None:
+            return cols.false()
+        if op == "Less Than":
+            return a < b
+        if op == "Greater Than":
+            return a > b
+        prev_a = cols.shifted(col_a)
+        prev_b = cols.shifted(col_b)
+        if op == "Crossing Down":
+            return (prev_a >= prev_b) & (a < b)
+        if op == "Crossing Up":
+            return (prev_a <= prev_b) & (a > b)
+        return cols.false()
+    return term
+
+
+def _compile_one(cond, gate_columns):
+    indicator = cond.get("indicator", "")
+    subs = cond.get("subfields", {})
+    tf = subs.get("Timeframe", "1m")
+    gate_col = gate_columns[tf]
+    operator = subs.get("Condition", "")
+    value = subs.get("Signal Value", None)
+
+    if indicator == "RSI":
+        col = _suffix(f"RSI_{subs.get('RSI Length', 14)}", tf)
+        if operator in ("Less Than", "Greater Than", "Crossing Down", "Crossing Up"):
+            check = _threshold(operator, value)
+            body = lambda cols: check(cols, col)
+        elif isinstance(value, str):
+            def body(cols):
+                cur = cols.get(col)
+                if cur is None or cur.dtype != object:
+                    return cols.false()
+                return cur == value
+        else:
+            body = lambda cols: cols.false()
+
+    elif indicator == "TradingView":
+        col = _suffix("tv_tech_label", tf)
+        desired = [v for v in TV_SYNONYMS.get(value, {value}) if v is not None]
+
+        def body(cols):
+            cur = cols.get(col)
+            out = cols.false()
+            if cur is None or cur.dtype != object:
+                return out
+            for v in desired:
+                out |= cur == v
+            return out
+
+    elif indicator == "HeikenAshi":
+        col = _suffix("HA_Close", tf)
+        if operator in ("Greater Than", "Less Than"):
+            check = _threshold(operator, value)
+            body = lambda cols: check(cols, col)
+        else:
+            body = lambda cols: cols.true() if cols.get(col) is not None else cols.false()
+
+    elif indicator == "MA":
+        ma_type = subs.get("MA Type", "SMA")
+        col_fast = _suffix(f"{ma_type}_{subs.get('Fast MA', 14)}", tf)
+        col_slow = _suffix(f"{ma_type}_{subs.get('Slow MA', 28)}", tf)
+        check = _line_vs_line(operator)
+        body = lambda cols: check(cols, col_fast, col_slow)
+
+    elif indicator == "BollingerBands":
+        col = _suffix(f"BB_%B_{subs.get('BB% Period', 20)}_{subs.get('Deviation', 2)}", tf)
+        check = _threshold(operator, value)
+        body = lambda cols: check(cols, col)
+
+    elif indicator == "MACD":
+        fast_str, slow_str, sig_str = subs.get("MACD Preset", "12,26,9").split(',')
+        main_col = _suffix(f"MACD_{fast_str}_{slow_str}_{sig_str}", tf)
+        signal_col = _suffix(f"MACD_{fast_str}_{slow_str}_{sig_str}_Signal", tf)
+        macd_trigger = subs.get("MACD Trigger", "")
+        line_trigger = subs.get("Line Trigger", "")
+        cross = _line_vs_line(macd_trigger) if macd_trigger in ("Crossing Up", "Crossing Down") else None
+
+        def body(cols):
+            main = cols.get(main_col)
+            if main is None or cols.get(signal_col) is None:
+                return cols.false()
+            out = cross(cols, main_col, signal_col) if cross is not None else cols.true()
+            if line_trigger == "Less Than 0":
+                out &= ~(main >= 0)
+            elif line_trigger == "Greater Than 0":
+                out &= ~(main <= 0)
+            return out
+
+    elif indicator == "Stochastic":
+        k_str, ksmooth_str, dsmooth_str = subs.get("Stochastic Preset", "14,3,3").split(',')
+        k_col = _suffix(f"Stochastic_K_{k_str}_{ksmooth_str}", tf)
+        d_col = _suffix(f"Stochastic_D_{k_str}_{ksmooth_str}_{dsmooth_str}", tf)
+        k_cond = subs.get("K Condition", "")
+        k_check = _threshold(k_cond, subs.get("K Signal Value", None))
+        main_condition = subs.get("Condition", "")
+        kd_cross = {"K Crossing Up D": _line_vs_line("Crossing Up"),
+                    "K Crossing Down D": _line_vs_line("Crossing Down")}.get(main_condition)
+
+        def body(cols):
+            if cols.get(k_col) is None:
+                return cols.false()
+            out = cols.true()
+            if k_cond in ("Less Than", "Greater Than", "Crossing Down", "Crossing Up"):
+                out &= k_check(cols, k_col)
+            if kd_cross is not None:
+                out &= kd_cross(cols, k_col, d_col)
+            return out
+
+    elif indicator == "ParabolicSAR":
+        step_str, max_str = subs.get("PSAR Preset", "0.02,0.2").split(',')
+        col = _suffix(f"PSAR_AF_{step_str}_Max_{max_str}", tf)
+        if operator in ("Crossing (Long)", "Crossing (Short)"):
+            def body(cols):
+                sar = cols.get(col)
+                close = cols.get("close")
+                if sar is None or close is None:
+                    return cols.false()
+                prev_sar = cols.shifted(col)
+                prev_close = cols.shifted("close")
+                if operator == "Crossing (Long)":
+                    return (prev_close <= prev_sar) & (close > sar)
+                return (prev_close >= prev_sar) & (close < sar)
+        else:
+            check = _threshold(operator if operator in ("Less Than", "Greater Than") else "", value)
+            body = lambda cols: check(cols, col)
+
+    else:
+        body = lambda cols: cols.false()
+
+    def term(cols):
+        gate = cols.get(gate_col)
+        if gate is None:
+            raise KeyError(gate_col)
+        return gate.astype(np.bool_) & body(cols)
+    return term
+
+
+def compile_conditions(conditions, gate_columns):
+    """
+    Compile a condition list into mask(df, prev_row=None) -> bool ndarray, one
+    entry per row. prev_row is the frame holding the row just before df (only
+    its last row is read); without it the first row has no previous row.
+
+    gate_columns maps each timeframe to the column that must be truthy for a
+    condition on that timeframe to be evaluated (Bar_Close_* or close_*).
+    An empty list compiles to an all-True mask.
+    """
+    terms = [_compile_one(cond, gate_columns) for cond in conditions]
+
+    def mask(df, prev_row=None):
+        cols = _Columns(df, prev_row)
+        out = cols.true()
+        for term in terms:
+            out &= term(cols)
+            if not out.any():
+                break
+        return out
+    return mask
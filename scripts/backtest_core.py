@@ -0,0 +1,1483 @@
+"""
+Array-backed simulation core shared by backtest.py and backtest2.py.
+
+run_backtest() merges every pair into one time-ordered stream and feeds the
+columns the simulation needs (int64 timestamps, symbol codes, closes and the
+per-row condition results) to a SignalSimulator a window at a time. The
+pass-1 trade logic then runs over plain NumPy arrays with scalar state
+instead of pandas rows. When numba is importable the kernel is JIT-compiled,
+otherwise it runs as Python.
+"""
+import json
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+import backtest_data
+import backtest_stops
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional, the kernels also run as plain Python
+    njit = None
+
+
+def _jit(fn):
+    if njit is None:
+        return fn
+    return njit(cache=True, nogil=True)(fn)
+
+
+NO_TIME = -(2 ** 63)
+NS_PER_MINUTE = 60 * 1_000_000_000
+NS_PER_HOUR = 60 * NS_PER_MINUTE
+NS_PER_DAY = 24 * NS_PER_HOUR
+
+# Written by the data pipeline (backtest_data.add_daily_volume())
+DAILY_VOLUME_COLUMN = backtest_data.DAILY_VOLUME_COLUMN
+
+# payload["equity_sampling"]: how often an open deal is marked to market for
+# the equity curve. 0 samples at trade events only, None records no curve.
+EQUITY_SAMPLING = {
+    "none": None,
+    "trades": 0,
+    "1h": NS_PER_HOUR,
+    "4h": 4 * NS_PER_HOUR,
+    "1d": 24 * NS_PER_HOUR,
+}
+DEFAULT_EQUITY_SAMPLING = "1h"
+
+# Trade event actions
+ACT_BUY = 0
+ACT_SAFETY = 1
+ACT_SELL = 2
+ACT_STOP_LOSS = 3
+ACT_TIMEOUT = 4
+ACT_TAKE_PROFIT = 5
+ACT_MARK = 6
+
+ACTION_NAMES = {
+    ACT_BUY: "BUY",
+    ACT_SELL: "SELL",
+    ACT_STOP_LOSS: "Stop Loss EXIT",
+    ACT_TIMEOUT: "Timeout EXIT",
+    ACT_TAKE_PROFIT: "Take Profit EXIT",
+    ACT_MARK: "EQUITY MARK",
+}
+
+# Float parameters (pf)
+PF_BASE_ORDER = 0
+PF_SO_SIZE = 1
+PF_PRICE_DEV = 2
+PF_DEV_FRAC = 3
+PF_SL_FRAC = 4
+PF_TP_FRAC = 5
+PF_FEE = 6
+PF_RISK_REDUCTION = 7
+PF_REINVEST = 8
+PF_STEP_SCALE = 9
+PF_VOL_SCALE = 10
+PF_MIN_PROFIT = 11
+PF_DD_LIMIT = 12
+PF_INITIAL_BALANCE = 13
+N_PF = 14
+
+# Integer parameters (pi)
+PI_MAX_DEALS = 0
+PI_MAX_SO = 1
+PI_HAS_ENTRY = 2
+PI_HAS_EXIT = 3
+PI_HAS_SAFETY = 4
+PI_SO_TOGGLE = 5
+PI_SL_ON = 6
+PI_TP_ON = 7
+PI_PRICE_CHANGE = 8
+PI_MINPROF = 9
+PI_TP_TOTAL = 10
+PI_COOLDOWN_NS = 11
+PI_SL_TIMEOUT_NS = 12
+PI_DEAL_TIMEOUT_NS = 13
+PI_DD_STOP = 14
+PI_SKIP = 15
+PI_MARK_NS = 16
+N_PI = 17
+
+# Portfolio scalars (fs)
+FS_FREE_CASH = 0
+FS_REAL_BALANCE = 1
+FS_BALANCE = 2
+FS_MAX_BALANCE = 3
+FS_MAX_DD = 4
+FS_MAX_REAL = 5
+FS_MAX_REAL_DD = 6
+FS_POS_VALUE = 7
+N_FS = 8
+
+# Loop scalars (st)
+ST_ROW = 0
+ST_EVENTS = 1
+ST_TRADE_COUNTER = 2
+ST_ACTIVE_DEALS = 3
+ST_LAST_PROCESSED = 4
+ST_CANDIDATES = 5
+ST_STOP = 6
+ST_STOP_ROW = 7
+ST_DIRTY = 8
+N_ST = 9
+
+NO_GATE = 2 ** 63 - 1
+
+# _process_row results
+ROW_PASSED = 0
+ROW_EVALUATED = 1
+ROW_STOPPED = 2
+
+# Per-symbol float state (sf)
+SF_QTY = 0
+SF_ENTRY = 1
+SF_TOTAL = 2
+SF_LAST_SO_PRICE = 3
+SF_LAST_SO_SIZE = 4
+SF_SO_DEV = 5
+SF_NEXT_SO = 6
+SF_SL = 7
+SF_TP = 8
+SF_POSITION = 9
+SF_LAST_CLOSE = 10
+N_SF = 11
+
+# Per-symbol integer state (si)
+SI_ACTIVE = 0
+SI_TRADE_ID = 1
+SI_SO_COUNT = 2
+SI_OPENED = 3
+SI_CLOSED = 4
+SI_LAST_MARK = 5
+SI_TP_SET = 6
+# Due times (ns) of the time-based rules, set when a deal opens or closes so
+# no row has to work them out: entries wait until SI_COOLDOWN_END, the stop
+# loss is armed from SI_SL_ARMED and the deal times out at SI_TIMEOUT_AT
+# (NO_GATE: never).
+SI_COOLDOWN_END = 7
+SI_SL_ARMED = 8
+SI_TIMEOUT_AT = 9
+N_SI = 10
+
+# Event value columns (ev_val)
+EV_PRICE = 0
+EV_QTY = 1
+EV_AMOUNT = 2
+EV_TOTAL = 3
+EV_MOVE = 4
+EV_PROFIT_PCT = 5
+N_EV = 6
+
+
+@_jit
+def _record(ev_row, ev_act, ev_num, ev_val, ev_tid, st, row, act, num,
+            price, qty, amount, total, move, profit_pct, trade_id):
+    k = st[ST_EVENTS]
+    ev_row[k] = row
+    ev_act[k] = act
+    ev_num[k] = num
+    ev_val[k, EV_PRICE] = price
+    ev_val[k, EV_QTY] = qty
+    ev_val[k, EV_AMOUNT] = amount
+    ev_val[k, EV_TOTAL] = total
+    ev_val[k, EV_MOVE] = move
+    ev_val[k, EV_PROFIT_PCT] = profit_pct
+    ev_tid[k] = trade_id
+    st[ST_EVENTS] = k + 1
+
+
+@_jit
+def _mark_to_market(sf):
+    total = 0.0
+    for s in range(sf.shape[0]):
+        total += sf[s, SF_POSITION] * sf[s, SF_LAST_CLOSE]
+    return total
+
+
+@_jit
+def _open_candidates(t, sym, close, entry_px, pf, pi, fs, st, sf, si, cand,
+                     ev_row, ev_act, ev_num, ev_val, ev_tid):
+    n = st[ST_CANDIDATES]
+    # Stable insertion sort by close, same order as list.sort(key=close)
+    for a in range(1, n):
+        r = cand[a]
+        b = a - 1
+        while b >= 0 and close[cand[b]] > close[r]:
+            cand[b + 1] = cand[b]
+            b -= 1
+        cand[b + 1] = r
+    available = pi[PI_MAX_DEALS] - st[ST_ACTIVE_DEALS]
+    if available < 0:
+        available = 0
+    fee = pf[PF_FEE]
+    for a in range(min(n, available)):
+        r = cand[a]
+        s = sym[r]
+        px = entry_px[r]
+        st[ST_TRADE_COUNTER] += 1
+        qty = pf[PF_BASE_ORDER] / px if px > 1e-12 else 0.0
+        amount = px * qty
+        sf[s, SF_QTY] = qty
+        sf[s, SF_ENTRY] = px
+        sf[s, SF_TOTAL] = amount
+        sf[s, SF_LAST_SO_PRICE] = px
+        sf[s, SF_LAST_SO_SIZE] = pf[PF_SO_SIZE]
+        sf[s, SF_SO_DEV] = pf[PF_PRICE_DEV]
+        sf[s, SF_NEXT_SO] = px * (1.0 - pf[PF_DEV_FRAC])
+        sf[s, SF_SL] = px * (1.0 - pf[PF_SL_FRAC])
+        sf[s, SF_TP] = px * (1.0 + pf[PF_TP_FRAC])
+        si[s, SI_ACTIVE] = 1
+        si[s, SI_TRADE_ID] = st[ST_TRADE_COUNTER]
+        si[s, SI_SO_COUNT] = 0
+        si[s, SI_OPENED] = t
+        si[s, SI_SL_ARMED] = t + pi[PI_SL_TIMEOUT_NS]
+        si[s, SI_TIMEOUT_AT] = t + pi[PI_DEAL_TIMEOUT_NS] if pi[PI_DEAL_TIMEOUT_NS] > 0 else NO_GATE
+        si[s, SI_TP_SET] = pi[PI_TP_ON]
+        st[ST_ACTIVE_DEALS] += 1
+        _record(ev_row, ev_act, ev_num, ev_val, ev_tid, st, r, ACT_BUY, 0,
+                px, qty, amount, amount, 0.0, np.nan, st[ST_TRADE_COUNTER])
+        fs[FS_FREE_CASH] -= amount * (1 + fee)
+        sf[s, SF_POSITION] += qty
+    st[ST_CANDIDATES] = 0
+    fs[FS_POS_VALUE] = _mark_to_market(sf)
+
+
+@_jit
+def _close_deal(t, s, act, px, amount, move, pf, pi, fs, st, sf, si, row,
+                ev_row, ev_act, ev_num, ev_val, ev_tid):
+    qty = sf[s, SF_QTY]
+    total = sf[s, SF_TOTAL]
+    profit_pct = (amount - total) / total if total > 0 else 0.0
+    _record(ev_row, ev_act, ev_num, ev_val, ev_tid, st, row, act, 0,
+            px, qty, amount, total, move, profit_pct, si[s, SI_TRADE_ID])
+    fee = pf[PF_FEE]
+    si[s, SI_ACTIVE] = 0
+    st[ST_ACTIVE_DEALS] -= 1
+    si[s, SI_CLOSED] = t
+    si[s, SI_COOLDOWN_END] = t + pi[PI_COOLDOWN_NS]
+    profit_loss = amount * (1 - fee) - total
+    fs[FS_FREE_CASH] += amount * (1 - fee)
+    sf[s, SF_POSITION] -= qty
+    fs[FS_REAL_BALANCE] += profit_loss
+    if profit_loss < 0:
+        fs[FS_BALANCE] += profit_loss * (pf[PF_RISK_REDUCTION] / 100.0)
+    elif profit_loss > 0:
+        fs[FS_BALANCE] += profit_loss * (pf[PF_REINVEST] / 100.0)
+    fs[FS_POS_VALUE] = _mark_to_market(sf)
+
+
+@_jit
+def _process_row(i, ts, sym, close, entry_px, so_px, entry_ok, exit_ok, safety_ok,
+                 pf, pi, fs, st, sf, si, cand, ev_row, ev_act, ev_num, ev_val, ev_tid):
+    """Apply one row to the state. Returns ROW_PASSED, ROW_EVALUATED or ROW_STOPPED."""
+    fee = pf[PF_FEE]
+    max_so = pi[PI_MAX_SO]
+    t = ts[i]
+    s = sym[i]
+    px = close[i]
+
+    if t < si[s, SI_COOLDOWN_END]:
+        return ROW_PASSED
+
+    fs[FS_POS_VALUE] += sf[s, SF_POSITION] * (px - sf[s, SF_LAST_CLOSE])
+    sf[s, SF_LAST_CLOSE] = px
+    if fs[FS_POS_VALUE] != fs[FS_POS_VALUE]:
+        fs[FS_POS_VALUE] = _mark_to_market(sf)
+
+    if st[ST_LAST_PROCESSED] != NO_TIME and t != st[ST_LAST_PROCESSED]:
+        if st[ST_CANDIDATES] > 0:
+            _open_candidates(t, sym, close, entry_px, pf, pi, fs, st, sf, si, cand,
+                             ev_row, ev_act, ev_num, ev_val, ev_tid)
+        st[ST_LAST_PROCESSED] = t
+
+    if si[s, SI_ACTIVE] == 0:
+        if pi[PI_HAS_ENTRY] != 0 and entry_ok[i]:
+            cand[st[ST_CANDIDATES]] = i
+            st[ST_CANDIDATES] += 1
+    else:
+        entry = sf[s, SF_ENTRY]
+        move = (px - entry) / entry if entry > 1e-12 else 0.0
+
+        if pi[PI_SL_ON] != 0:
+            if t >= si[s, SI_SL_ARMED] and px <= sf[s, SF_SL]:
+                _close_deal(t, s, ACT_STOP_LOSS, px, px * sf[s, SF_QTY], move, pf, pi, fs, st, sf, si, i,
+                            ev_row, ev_act, ev_num, ev_val, ev_tid)
+                return ROW_PASSED
+
+        if t >= si[s, SI_TIMEOUT_AT]:
+            _close_deal(t, s, ACT_TIMEOUT, px, px * sf[s, SF_QTY], move, pf, pi, fs, st, sf, si, i,
+                        ev_row, ev_act, ev_num, ev_val, ev_tid)
+            return ROW_PASSED
+
+        if pi[PI_HAS_EXIT] != 0 and exit_ok[i]:
+            amount = px * sf[s, SF_QTY]
+            total = sf[s, SF_TOTAL]
+            profit_pct = (amount - total) / total if total > 0 else 0.0
+            if pi[PI_MINPROF] == 0 or profit_pct >= pf[PF_MIN_PROFIT]:
+                _close_deal(t, s, ACT_SELL, px, amount, move, pf, pi, fs, st, sf, si, i,
+                            ev_row, ev_act, ev_num, ev_val, ev_tid)
+                return ROW_PASSED
+
+        if pi[PI_MARK_NS] > 0:
+            if si[s, SI_LAST_MARK] == NO_TIME:
+                si[s, SI_LAST_MARK] = t
+            elif t - si[s, SI_LAST_MARK] >= pi[PI_MARK_NS]:
+                _record(ev_row, ev_act, ev_num, ev_val, ev_tid, st, i, ACT_MARK, 0,
+                        px, 0.0, 0.0, 0.0, 0.0, 0.0, 0)
+                si[s, SI_LAST_MARK] = t
+
+        if pi[PI_PRICE_CHANGE] != 0 and si[s, SI_TP_SET] != 0 and px >= sf[s, SF_TP]:
+            tp = sf[s, SF_TP]
+            _close_deal(t, s, ACT_TAKE_PROFIT, tp, tp * sf[s, SF_QTY], move, pf, pi, fs, st, sf, si, i,
+                        ev_row, ev_act, ev_num, ev_val, ev_tid)
+            return ROW_PASSED
+
+        if pi[PI_SO_TOGGLE] != 0 and si[s, SI_SO_COUNT] < max_so:
+            so_close = so_px[i]
+            if pi[PI_HAS_SAFETY] == 0 or safety_ok[i]:
+                price_deviation = pf[PF_PRICE_DEV]
+                step_scale = pf[PF_STEP_SCALE]
+                temp_next = sf[s, SF_NEXT_SO]
+                temp_dev = sf[s, SF_SO_DEV]
+                orders_to_trigger = 0
+                for _ in range(max_so - si[s, SI_SO_COUNT]):
+                    if so_close < temp_next:
+                        orders_to_trigger += 1
+                        temp_dev *= step_scale
+                        temp_next *= (1.0 - (price_deviation * temp_dev) / 100.0)
+                    else:
+                        break
+                if orders_to_trigger > 0:
+                    so_size = sf[s, SF_LAST_SO_SIZE]
+                    for _ in range(orders_to_trigger):
+                        so_qty = so_size / so_close if so_close > 1e-12 else 0.0
+                        si[s, SI_SO_COUNT] += 1
+                        sf[s, SF_QTY] += so_qty
+                        order_amount = so_close * so_qty
+                        sf[s, SF_TOTAL] += order_amount
+                        so_move = (so_close - entry) / entry if entry > 1e-12 else 0.0
+                        if pi[PI_TP_TOTAL] != 0 and sf[s, SF_QTY] > 0:
+                            avg_price = sf[s, SF_TOTAL] / sf[s, SF_QTY]
+                            sf[s, SF_TP] = avg_price * (1.0 + pf[PF_TP_FRAC])
+                            si[s, SI_TP_SET] = 1
+                        _record(ev_row, ev_act, ev_num, ev_val, ev_tid, st, i, ACT_SAFETY,
+                                si[s, SI_SO_COUNT], so_close, so_qty, order_amount,
+                                sf[s, SF_TOTAL], so_move, np.nan, si[s, SI_TRADE_ID])
+                        sf[s, SF_LAST_SO_PRICE] = so_close
+                        sf[s, SF_SO_DEV] *= step_scale
+                        sf[s, SF_NEXT_SO] = so_close * (1.0 - (price_deviation * sf[s, SF_SO_DEV]) / 100.0)
+                        so_size *= pf[PF_VOL_SCALE]
+                        fs[FS_FREE_CASH] -= order_amount * (1 + fee)
+                        sf[s, SF_POSITION] += so_qty
+                    sf[s, SF_LAST_SO_SIZE] = so_size
+                    fs[FS_POS_VALUE] = _mark_to_market(sf)
+
+    unrealized = fs[FS_FREE_CASH] + fs[FS_POS_VALUE] * (1 - fee)
+    if unrealized > fs[FS_MAX_BALANCE]:
+        fs[FS_MAX_BALANCE] = unrealized
+    drawdown = 0.0
+    if fs[FS_MAX_BALANCE] > 0:
+        drawdown = (fs[FS_MAX_BALANCE] - unrealized) / fs[FS_MAX_BALANCE]
+    if drawdown > fs[FS_MAX_DD]:
+        fs[FS_MAX_DD] = drawdown
+
+    real_balance = fs[FS_REAL_BALANCE]
+    if real_balance > fs[FS_MAX_REAL]:
+        fs[FS_MAX_REAL] = real_balance
+    real_dd = 0.0
+    if fs[FS_MAX_REAL] > 0:
+        real_dd = (fs[FS_MAX_REAL] - real_balance) / fs[FS_MAX_REAL]
+    if real_dd > fs[FS_MAX_REAL_DD]:
+        fs[FS_MAX_REAL_DD] = real_dd
+
+    if pi[PI_DD_STOP] != 0 and fs[FS_MAX_DD] >= pf[PF_DD_LIMIT]:
+        st[ST_STOP] = 1
+        return ROW_STOPPED
+
+    if st[ST_LAST_PROCESSED] == NO_TIME:
+        st[ST_LAST_PROCESSED] = t
+    return ROW_EVALUATED
+
+
+@_jit
+def _first_after(sym_rows, lo, hi, i):
+    """Position of the first entry of sym_rows[lo:hi] greater than row i."""
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if sym_rows[mid] <= i:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+@_jit
+def _first_at(ts, sym_rows, lo, hi, t):
+    """Position of the first entry of sym_rows[lo:hi] at or after time t."""
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if ts[sym_rows[mid]] < t:
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
+
+
+@_jit
+def _next_row(s, q, ts, close, so_px, exit_ok, safety_ok, pf, pi, sf, si,
+              sym_rows, sym_start, hot_next):
+    """
+    Next row of symbol s, starting at position q of sym_rows, whose processing
+    can change the ledger. Every row of s before it is a no-op given the
+    symbol's current state. Returns the number of rows when there is none.
+    """
+    n_rows = ts.shape[0]
+    end = sym_start[s + 1]
+    if q >= end:
+        return n_rows
+    # With a drawdown stop every price move of a held symbol counts, and a
+    # NaN close poisons the mark-to-market until the symbol trades again.
+    dense = pi[PI_DD_STOP] != 0 and (si[s, SI_ACTIVE] != 0 or sf[s, SF_LAST_CLOSE] != sf[s, SF_LAST_CLOSE])
+    if dense:
+        return sym_rows[q]
+    if si[s, SI_ACTIVE] == 0:
+        # Rows before the cooldown ends are no-ops, entry signals included
+        if si[s, SI_COOLDOWN_END] > ts[sym_rows[q]]:
+            q = _first_at(ts, sym_rows, q, end, si[s, SI_COOLDOWN_END])
+            if q >= end:
+                return n_rows
+        q = hot_next[q]
+        return sym_rows[q] if q < end else n_rows
+
+    until = NO_GATE
+    if pi[PI_MARK_NS] > 0:
+        if si[s, SI_LAST_MARK] == NO_TIME:
+            return sym_rows[q]
+        until = si[s, SI_LAST_MARK] + pi[PI_MARK_NS]
+    if si[s, SI_TIMEOUT_AT] < until:
+        until = si[s, SI_TIMEOUT_AT]
+    sl_from = si[s, SI_SL_ARMED]
+    qty = sf[s, SF_QTY]
+    total = sf[s, SF_TOTAL]
+    so_open = pi[PI_SO_TOGGLE] != 0 and si[s, SI_SO_COUNT] < pi[PI_MAX_SO]
+    tp_open = pi[PI_PRICE_CHANGE] != 0 and si[s, SI_TP_SET] != 0
+    for k in range(q, end):
+        r = sym_rows[k]
+        t = ts[r]
+        if t >= until:
+            return r
+        px = close[r]
+        if pi[PI_SL_ON] != 0 and t >= sl_from and px <= sf[s, SF_SL]:
+            return r
+        if pi[PI_HAS_EXIT] != 0 and exit_ok[r]:
+            if pi[PI_MINPROF] == 0:
+                return r
+            profit_pct = (px * qty - total) / total if total > 0 else 0.0
+            if profit_pct >= pf[PF_MIN_PROFIT]:
+                return r
+        if tp_open and px >= sf[s, SF_TP]:
+            return r
+        if so_open and (pi[PI_HAS_SAFETY] == 0 or safety_ok[r]) and so_px[r] < sf[s, SF_NEXT_SO]:
+            return r
+    return n_rows
+
+
+@_jit
+def _signal_kernel(ts, sym, close, entry_px, so_px, entry_ok, exit_ok, safety_ok,
+                   pf, pi, sym_rows, sym_start, local_pos, hot_next,
+                   fs, st, sf, si, nxt, cand, ev_row, ev_act, ev_num, ev_val, ev_tid):
+    n_rows = ts.shape[0]
+    n_syms = sf.shape[0]
+    cap = ev_row.shape[0]
+    max_so = pi[PI_MAX_SO]
+    # The drawdown stop is checked on the first evaluated row after anything
+    # changes, so those runs step row by row after every event.
+    track_events = pi[PI_DD_STOP] != 0
+    i = st[ST_ROW]
+    while i < n_rows:
+        # Worst case for one row: pending BUYs, an equity mark plus every
+        # safety order.
+        if cap - st[ST_EVENTS] < 2 * st[ST_CANDIDATES] + max_so + 3:
+            break
+        events = st[ST_EVENTS]
+        trades = st[ST_TRADE_COUNTER]
+        res = _process_row(i, ts, sym, close, entry_px, so_px, entry_ok, exit_ok, safety_ok,
+                           pf, pi, fs, st, sf, si, cand, ev_row, ev_act, ev_num, ev_val, ev_tid)
+        if res == ROW_STOPPED:
+            st[ST_STOP_ROW] = i
+            st[ST_ROW] = i
+            return
+        if pi[PI_SKIP] == 0:
+            i += 1
+            continue
+
+        if res == ROW_EVALUATED:
+            st[ST_DIRTY] = 0
+        elif track_events and st[ST_EVENTS] != events:
+            st[ST_DIRTY] = 1
+
+        if st[ST_TRADE_COUNTER] != trades:
+            for s in range(n_syms):
+                q = _first_after(sym_rows, sym_start[s], sym_start[s + 1], i)
+                nxt[s] = _next_row(s, q, ts, close, so_px, exit_ok, safety_ok, pf, pi, sf, si,
+                                   sym_rows, sym_start, hot_next)
+        else:
+            s = sym[i]
+            nxt[s] = _next_row(s, local_pos[i] + 1, ts, close, so_px, exit_ok, safety_ok, pf, pi, sf, si,
+                               sym_rows, sym_start, hot_next)
+
+        if st[ST_CANDIDATES] > 0 or st[ST_DIRTY] != 0:
+            i += 1
+            continue
+        j = n_rows
+        for s in range(n_syms):
+            if nxt[s] < j:
+                j = nxt[s]
+        i = j if j > i else i + 1
+
+    st[ST_ROW] = i
+
+
+def round_like_python(values, digits):
+    """
+    np.round that agrees with round() on every element. np.round scales by
+    10**digits first, so a value just below a .5 boundary can scale onto it
+    and round the wrong way; those exact ties are redone with round().
+    """
+    values = np.asarray(values, dtype=np.float64)
+    scaled = values * 10.0 ** digits
+    out = np.round(values, digits)
+    ties = np.flatnonzero(scaled - np.floor(scaled) == 0.5)
+    if len(ties):
+        out[ties] = [round(v, digits) for v in values[ties].tolist()]
+    return out
+
+
+def timestamps_ns(values):
+    """Return timestamps as int64 nanoseconds regardless of the stored resolution."""
+    return np.asarray(values).astype("datetime64[ns]").view("int64")
+
+
+def daily_volume_mask(df, min_daily_volume):
+    """
+    Rows of one symbol's frame whose day traded at least min_daily_volume USDT.
+    Reads the pipeline's DAILY_VOLUME_COLUMN; frames from files written before
+    it existed get the day sums from a bincount over day codes instead.
+    """
+    if DAILY_VOLUME_COLUMN in df.columns:
+        daily = df[DAILY_VOLUME_COLUMN].to_numpy(dtype=np.float64)
+    else:
+        day = timestamps_ns(df["timestamp"].to_numpy()) // NS_PER_DAY
+        _, day_code = np.unique(day, return_inverse=True)
+        volume = (df["volume"] * df["close"]).to_numpy(dtype=np.float64)
+        daily = np.bincount(day_code, weights=np.nan_to_num(volume))[day_code]
+    return ~(daily < min_daily_volume)
+
+
+def _build_params(payload, initial_balance, drawdown_limit):
+    safety_order_toggle = payload.get("safety_order_toggle", False)
+    price_deviation = payload.get("price_deviation", 1.0)
+    max_safety_orders = payload.get("max_safety_orders_count", 0)
+    stop_loss_toggle = payload.get("stop_loss_toggle", False)
+    stop_loss_value = payload.get("stop_loss_value", 0.0)
+    target_profit = payload.get("target_profit", 0.0)
+    close_deal_after_timeout = payload.get("close_deal_after_timeout", 0)
+
+    pf = np.zeros(N_PF, dtype=np.float64)
+    pf[PF_BASE_ORDER] = payload.get("base_order_size", 0.0)
+    pf[PF_SO_SIZE] = payload.get("safety_order_size", 0.0)
+    pf[PF_PRICE_DEV] = price_deviation
+    pf[PF_DEV_FRAC] = price_deviation / 100.0 if safety_order_toggle and max_safety_orders > 0 else 0
+    pf[PF_SL_FRAC] = stop_loss_value / 100.0 if stop_loss_toggle and stop_loss_value > 0 else 0
+    pf[PF_TP_FRAC] = target_profit / 100.0 if target_profit > 0 else 0
+    pf[PF_FEE] = payload.get("trading_fee", 0.0) / 100
+    pf[PF_RISK_REDUCTION] = payload.get("risk_reduction", 0.0)
+    pf[PF_REINVEST] = payload.get("reinvest_profit", 0.0)
+    pf[PF_STEP_SCALE] = payload.get("safety_order_step_scale", 1.0)
+    pf[PF_VOL_SCALE] = payload.get("safety_order_volume_scale", 1.0)
+    pf[PF_MIN_PROFIT] = payload.get("minimal_profit", 0) / 100
+    pf[PF_DD_LIMIT] = drawdown_limit if drawdown_limit is not None else np.inf
+    pf[PF_INITIAL_BALANCE] = initial_balance
+
+    pi = np.zeros(N_PI, dtype=np.int64)
+    pi[PI_MAX_DEALS] = payload.get("max_active_deals", 0)
+    pi[PI_MAX_SO] = max_safety_orders
+    pi[PI_HAS_ENTRY] = bool(payload.get("entry_conditions", []))
+    pi[PI_HAS_EXIT] = payload.get("conditions_active", False) and bool(payload.get("exit_conditions", []))
+    pi[PI_HAS_SAFETY] = safety_order_toggle and bool(payload.get("safety_conditions", []))
+    pi[PI_SO_TOGGLE] = bool(safety_order_toggle)
+    pi[PI_SL_ON] = bool(stop_loss_toggle and stop_loss_value > 0)
+    pi[PI_TP_ON] = target_profit > 0
+    pi[PI_PRICE_CHANGE] = bool(payload.get("price_change_active", False))
+    pi[PI_MINPROF] = bool(payload.get("minprof_toggle", False))
+    pi[PI_TP_TOTAL] = payload.get("take_profit_type", "percentage-total") == "percentage-total"
+    pi[PI_COOLDOWN_NS] = pd.Timedelta(minutes=payload.get("cooldown_between_deals", 0)).value
+    pi[PI_SL_TIMEOUT_NS] = pd.Timedelta(minutes=payload.get("stop_loss_timeout", 0)).value
+    pi[PI_DEAL_TIMEOUT_NS] = pd.Timedelta(minutes=close_deal_after_timeout).value if close_deal_after_timeout > 0 else 0
+    pi[PI_DD_STOP] = drawdown_limit is not None
+    pi[PI_MARK_NS] = equity_cadence(payload) or 0
+    return pf, pi
+
+
+# Payload keys pass 1 reads only for the balances its early stops watch. With
+# no checkpoints and no drawdown limit its events do not depend on them, so
+# variants differing only in these can share one EventLog and rerun pass 2.
+REPLAY_ONLY_KEYS = ("initial_balance", "trading_fee", "reinvest_profit", "risk_reduction")
+
+
+def signal_key(payload, stops=False):
+    """
+    String identifying the EventLog a SignalSimulator produces for payload
+    over a given set of rows: equal keys give equal logs. stops says whether
+    pass 1 runs with early stops, which read the balances.
+    """
+    skip = {"strategy_name", "benchmark_symbol", "monte_carlo", "checkpoint", "time_budget"}
+    if not stops:
+        skip.update(REPLAY_ONLY_KEYS)
+    return json.dumps({k: v for k, v in payload.items() if k not in skip}, sort_keys=True, default=str)
+
+
+def slot_independent(payload, n_pairs, signal_stops=False):
+    """
+    Whether pass 1 over n_pairs pairs splits into one run per pair: every pair
+    always finds a free deal slot, no early stop reads the shared balances and
+    no stop-loss or deal timeout depends on when a deal opened, which in a
+    joint run is the next row of any pair.
+    """
+    pf, pi = _build_params(payload, payload.get("initial_balance", 10000.0), None)
+    return (n_pairs > 1 and pi[PI_MAX_DEALS] >= n_pairs and not signal_stops
+            and not (pi[PI_SL_ON] and pi[PI_SL_TIMEOUT_NS] > 0) and pi[PI_DEAL_TIMEOUT_NS] == 0)
+
+
+def base_timeframe(payload, highest_timeframe, tf_minutes, gate_timeframes, drawdown_limit=None):
+    """
+    Coarsest bar size pass 1 can step on without changing a trade, for an
+    engine whose conditions only hold on their timeframe's bar-close rows.
+    gate_timeframes lists the bar sizes with a bar-close flag; the closes of
+    a larger one are a subset of a smaller one's. A condition list then fires
+    only on the closes of its highest timeframe (highest_timeframe(list)),
+    so the finest of those over the active lists is enough. Stop loss, take
+    profit, deal timeouts, safety orders without conditions and a pass-1
+    drawdown_limit act on any 1m bar and keep "1m"; equity marks cap the
+    size at the sampling cadence.
+    """
+    pf, pi = _build_params(payload, payload.get("initial_balance", 10000.0), drawdown_limit)
+    if pi[PI_SL_ON] or pi[PI_PRICE_CHANGE] or pi[PI_DEAL_TIMEOUT_NS] > 0 or pi[PI_DD_STOP]:
+        return "1m"
+    lists = []
+    if pi[PI_HAS_ENTRY]:
+        lists.append(payload.get("entry_conditions", []))
+    if pi[PI_HAS_EXIT]:
+        lists.append(payload.get("exit_conditions", []))
+    if pi[PI_SO_TOGGLE] and pi[PI_MAX_SO] > 0:
+        if not pi[PI_HAS_SAFETY]:
+            return "1m"
+        lists.append(payload.get("safety_conditions", []))
+    if not lists:
+        return "1m"
+    limit = min(tf_minutes.get(highest_timeframe(conditions), 1) for conditions in lists)
+    if pi[PI_MARK_NS] > 0:
+        limit = min(limit, pi[PI_MARK_NS] // NS_PER_MINUTE)
+    fits = [tf for tf in gate_timeframes if tf_minutes.get(tf, 1) <= limit]
+    return max(fits, key=lambda tf: tf_minutes.get(tf, 1), default="1m")
+
+
+def equity_cadence(payload):
+    """Mark interval in ns for payload["equity_sampling"] (see EQUITY_SAMPLING)."""
+    name = payload.get("equity_sampling") or DEFAULT_EQUITY_SAMPLING
+    if name not in EQUITY_SAMPLING:
+        raise ValueError(f"Unknown equity_sampling {name!r}, expected one of {', '.join(EQUITY_SAMPLING)}")
+    return EQUITY_SAMPLING[name]
+
+
+def _trade_comment(act, num, payload):
+    if act == ACT_BUY:
+        return "Condition-based Entry"
+    if act == ACT_SAFETY:
+        return f"Added safety order #{num}"
+    if act == ACT_SELL:
+        return "Exit triggered by conditions" + (" + min profit" if payload.get("minprof_toggle", False) else "")
+    if act == ACT_STOP_LOSS:
+        return f"Stop loss triggered at {payload.get('stop_loss_value', 0.0)}%"
+    if act == ACT_TIMEOUT:
+        return f"Deal closed after timeout of {payload.get('close_deal_after_timeout', 0)} minutes"
+    if act == ACT_TAKE_PROFIT:
+        return f"Take profit triggered at {payload.get('target_profit', 0.0)}%"
+    return "Equity checkpoint"
+
+
+# Pass-2 event kinds
+KIND_OTHER = 0
+KIND_ENTRY = 1
+KIND_EXIT = 2
+KIND_MARK = 3
+
+ACTION_KINDS = np.array([
+    KIND_ENTRY,       # ACT_BUY
+    KIND_ENTRY,       # ACT_SAFETY
+    KIND_EXIT,        # ACT_SELL
+    KIND_EXIT,        # ACT_STOP_LOSS
+    KIND_EXIT,        # ACT_TIMEOUT
+    KIND_EXIT,        # ACT_TAKE_PROFIT
+    KIND_MARK,        # ACT_MARK
+], dtype=np.int8)
+
+
+class EventLog:
+    """
+    Pass-1 trade events as parallel arrays.
+
+    The kernel appends through _record(): the row (of the window being
+    simulated) the event fired on, its ACT_* code, the safety order number, the
+    EV_* float fields and the integer trade id (0 for equity marks). grow()
+    doubles the capacity when the kernel runs out of room. resolve() turns the
+    rows of a finished window into timestamps and symbol codes, and seal()
+    trims the buffers and puts the events in timestamp order, those sharing a
+    timestamp in the order the kernel emitted them.
+    Text (action names, comments, "n-SYM" trade ids) is only built for the rows
+    that reach the ledger; indicator values are kept only for the columns
+    asked for.
+    """
+
+    def __init__(self, capacity):
+        self.row = np.zeros(capacity, dtype=np.int64)
+        self.action = np.zeros(capacity, dtype=np.int8)
+        self.number = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros((capacity, N_EV), dtype=np.float64)
+        self.trade = np.zeros(capacity, dtype=np.int64)
+        self.timestamp = np.zeros(capacity, dtype=np.int64)
+        self.symbol = np.zeros(capacity, dtype=np.int64)
+        self.pairs = None
+        self.snapshots = {}
+        self._snapshot_parts = {}
+
+    def __len__(self):
+        return len(self.row)
+
+    def buffers(self):
+        return self.row, self.action, self.number, self.values, self.trade
+
+    def grow(self):
+        cap = 2 * len(self.row)
+        self.row = np.resize(self.row, cap)
+        self.action = np.resize(self.action, cap)
+        self.number = np.resize(self.number, cap)
+        self.values = np.resize(self.values, (cap, N_EV))
+        self.trade = np.resize(self.trade, cap)
+        self.timestamp = np.resize(self.timestamp, cap)
+        self.symbol = np.resize(self.symbol, cap)
+
+    def resolve(self, start, stop, columns, snapshot_cols=()):
+        """Fill in timestamp, symbol and snapshot values of events start..stop from their window."""
+        row = self.row[start:stop]
+        self.timestamp[start:stop] = columns["timestamp"][row]
+        self.symbol[start:stop] = columns["symbol"][row]
+        for c in snapshot_cols:
+            self._snapshot_parts.setdefault(c, []).append(columns[c][row])
+
+    def seal(self, n, pairs):
+        """
+        Keep the first n events, ordered by timestamp. Events sharing one stay
+        in emission order, which pass 2 sizes the orders in: an entry after
+        the exits emitted before it.
+        """
+        order = np.argsort(self.timestamp[:n], kind="stable")
+        self.row = self.row[:n][order]
+        self.action = self.action[:n][order]
+        self.number = self.number[:n][order]
+        self.values = self.values[:n][order]
+        self.trade = self.trade[:n][order]
+        self.timestamp = self.timestamp[:n][order]
+        self.symbol = self.symbol[:n][order]
+        self.pairs = list(pairs)
+        for c, parts in self._snapshot_parts.items():
+            self.snapshots[c] = np.concatenate(parts)[order]
+        self._snapshot_parts = {}
+
+    def kinds(self):
+        return ACTION_KINDS[self.action]
+
+    def action_labels(self, idx):
+        return np.array([ACTION_NAMES[a] if a != ACT_SAFETY else f"Safety Order #{k}"
+                         for a, k in zip(self.action[idx], self.number[idx])], dtype=object)
+
+    def comments(self, idx, payload):
+        return np.array([_trade_comment(a, k, payload)
+                         for a, k in zip(self.action[idx], self.number[idx])], dtype=object)
+
+    def trade_labels(self, idx):
+        return np.array([f"{tid}-{self.pairs[s]}" if tid > 0 else ""
+                         for tid, s in zip(self.trade[idx], self.symbol[idx])], dtype=object)
+
+    def to_frame(self, payload):
+        """The pass-1 ledger in the old df_trades layout (for inspection and CSV dumps)."""
+        idx = np.arange(len(self.row))
+        profit_pct = self.values[:, EV_PROFIT_PCT]
+        frame = {
+            "timestamp": self.timestamp.view("datetime64[ns]"),
+            "symbol": [self.pairs[s] for s in self.symbol],
+            "action": self.action_labels(idx),
+            "price": self.values[:, EV_PRICE],
+            "quantity": self.values[:, EV_QTY],
+            "amount": self.values[:, EV_AMOUNT],
+            "total_amount": self.values[:, EV_TOTAL],
+            "move_from_entry": self.values[:, EV_MOVE],
+            "profit_percent": ["" if p != p else p for p in profit_pct.tolist()],
+            "trade_comment": self.comments(idx, payload),
+            "trade_id": self.trade_labels(idx),
+        }
+        for c, v in self.snapshots.items():
+            frame.setdefault(c, v)
+        return pd.DataFrame(frame)
+
+
+class Suspended(Exception):
+    """Pass 1 ran out of its time budget; its state is saved at checkpoint."""
+
+    def __init__(self, checkpoint):
+        super().__init__(checkpoint)
+        self.checkpoint = checkpoint
+
+    def __str__(self):
+        return f"Suspended, state saved to {self.checkpoint}"
+
+
+class Cancelled(Exception):
+    """The run's cancel token was set; it stopped at the next window boundary."""
+
+    def __str__(self):
+        return "Backtest cancelled"
+
+
+def check_cancel(cancel):
+    """Raise Cancelled once cancel (anything with is_set(), e.g. a threading.Event) is set."""
+    if cancel is not None and cancel.is_set():
+        raise Cancelled()
+
+
+CHECKPOINT_VERSION = 2
+
+
+def checkpoint_key(payload, pairs):
+    """Identifies the run a checkpoint belongs to: same payload, same simulated pairs."""
+    return json.dumps([CHECKPOINT_VERSION, signal_key(payload, stops=True), list(pairs)])
+
+
+def save_checkpoint(path, key, state):
+    """Pickle state to path, replacing the previous checkpoint only once the new one is complete."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        pickle.dump({"key": key, "state": state}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def load_checkpoint(path, key):
+    """State saved at path for key, or None when there is none. Unpickles, so only load trusted files."""
+    if not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        saved = pickle.load(f)
+    if saved.get("key") != key:
+        print(f"Ignoring checkpoint {path}: it belongs to another run")
+        return None
+    return saved["state"]
+
+
+def remove_checkpoint(path):
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
+class SignalSimulator:
+    """
+    Pass 1 (signal generation) fed one time window at a time.
+
+    Each feed() takes the time-ordered rows of all pairs for the next window,
+    as built by backtest_data.merge_pairs(): "timestamp" (int64 ns), "symbol"
+    (index into pairs), "close", the "close_{tf}" of the entry and safety
+    timeframes and the per-row condition results "entry_ok", "exit_ok" and
+    "safety_ok". Windows must follow each other in time without sharing a
+    timestamp. Balances, open deals, cooldowns and timeouts live in the kernel
+    state and simply carry over; entry signals still waiting for the next
+    timestamp when a window ends are carried into the next one as rows of
+    their own, so the result does not depend on where the windows are cut.
+
+    stop_policy is a backtest_stops.EarlyStopPolicy checked at stop_times, a
+    list of (label, timestamp ns) in time order: when the data reaches each
+    time, the policy sees interim_metrics() and may end the run there. Its
+    max_drawdown(SIGNAL), if any, is checked by the kernel on every row
+    instead, which then visits every bar of a held symbol.
+    With skip_idle_rows the kernel jumps from one actionable row to the next
+    (entry signals, exit signals, TP/SL/safety thresholds, equity marks)
+    instead of visiting every bar; the ledger is the same either way.
+    snapshot_cols lists further columns (indicator values) to capture at each
+    event; nothing is copied unless asked for.
+    """
+
+    def __init__(self, pairs, payload, entry_tf="1m", so_tf="1m", skip_idle_rows=True,
+                 snapshot_cols=None, stop_policy=None, stop_times=()):
+        initial_balance = payload.get("initial_balance", 10000.0)
+        self.pairs = list(pairs)
+        self.stop_policy = stop_policy
+        self.stop_times = list(stop_times) if stop_policy is not None else []
+        self.stop_reason = None
+        self.entry_tf = entry_tf
+        self.so_tf = so_tf
+        self.snapshot_cols = list(snapshot_cols or ())
+        self.columns = ["timestamp", "symbol", "close", "entry_ok", "exit_ok", "safety_ok"]
+        for c in [f"close_{tf}" for tf in (entry_tf, so_tf) if tf != "1m"] + self.snapshot_cols:
+            if c not in self.columns:
+                self.columns.append(c)
+
+        drawdown_limit = stop_policy.max_drawdown(backtest_stops.SIGNAL) if stop_policy is not None else None
+        self.pf, self.pi = _build_params(payload, initial_balance, drawdown_limit)
+        self.pi[PI_SKIP] = bool(skip_idle_rows)
+
+        n_syms = len(self.pairs)
+        self.fs = np.zeros(N_FS, dtype=np.float64)
+        self.fs[FS_FREE_CASH] = initial_balance
+        self.fs[FS_REAL_BALANCE] = initial_balance
+        self.fs[FS_BALANCE] = initial_balance
+        self.fs[FS_MAX_BALANCE] = initial_balance
+        self.fs[FS_MAX_REAL] = initial_balance
+        self.st = np.zeros(N_ST, dtype=np.int64)
+        self.st[ST_LAST_PROCESSED] = NO_TIME
+        self.sf = np.zeros((n_syms, N_SF), dtype=np.float64)
+        self.si = np.zeros((n_syms, N_SI), dtype=np.int64)
+        self.si[:, SI_CLOSED] = NO_TIME
+        self.si[:, SI_COOLDOWN_END] = NO_TIME
+        self.si[:, SI_TIMEOUT_AT] = NO_GATE
+        self.si[:, SI_LAST_MARK] = NO_TIME
+
+        self.events = EventLog(max(1024, 4 * (int(self.pi[PI_MAX_SO]) + 4)))
+        self.pending = None
+        self.last_ts = NO_TIME
+        self.stop_ts = NO_TIME
+        self.n_rows = 0
+
+    # What checkpoint() saves: everything feed() changes
+    STATE = ("fs", "st", "sf", "si", "events", "pending", "last_ts", "stop_ts", "n_rows",
+             "stop_times", "stop_reason")
+
+    def checkpoint(self):
+        """
+        The run's state between two feed() calls as a picklable dict: balances
+        and drawdown maxima, open deals, cooldown and timeout clocks, the event
+        log with its write offset and the entry signals carried forward.
+        """
+        state = {}
+        for name in self.STATE:
+            value = getattr(self, name)
+            state[name] = value.copy() if isinstance(value, np.ndarray) else value
+        state["stop_times"] = list(self.stop_times)
+        return state
+
+    def restore(self, state):
+        """Continue from a checkpoint() of a simulator built with the same arguments."""
+        for name in self.STATE:
+            setattr(self, name, state[name])
+
+    @property
+    def stopped(self):
+        return self.st[ST_STOP] != 0 or self.stop_reason is not None
+
+    def interim_metrics(self):
+        """Net profit, total profit and max drawdown so far, from the pass-1 balances."""
+        initial_balance = self.pf[PF_INITIAL_BALANCE]
+        unrealized = self.fs[FS_FREE_CASH] + self.fs[FS_POS_VALUE] * (1 - self.pf[PF_FEE])
+        return {
+            "net_profit": (self.fs[FS_REAL_BALANCE] - initial_balance) / initial_balance,
+            "net_profit_usd": self.fs[FS_REAL_BALANCE] - initial_balance,
+            "total_profit": (unrealized - initial_balance) / initial_balance,
+            "max_drawdown": self.fs[FS_MAX_DD],
+        }
+
+    def _prices(self, columns):
+        close = columns["close"].astype(np.float64, copy=False)
+        entry_px = close if self.entry_tf == "1m" else columns[f"close_{self.entry_tf}"].astype(np.float64, copy=False)
+        so_px = close if self.so_tf == "1m" else columns[f"close_{self.so_tf}"].astype(np.float64, copy=False)
+        return close, entry_px, so_px
+
+    def feed(self, columns):
+        """Simulate the next window. Returns False once an early stop has fired."""
+        if self.stopped:
+            return False
+        ts = columns["timestamp"]
+        lo = 0
+        # Split the window after the rows at each stop time it reaches and ask
+        # the policy about the state there. Entries still waiting from before
+        # the stop time open first, as they would on the next row; those
+        # found at the stop time itself are dropped if the run ends there.
+        while self.stop_times and len(ts) and ts[-1] >= self.stop_times[0][1]:
+            label, t = self.stop_times.pop(0)
+            cut = max(lo, int(np.searchsorted(ts, t, side="right")))
+            if not self._feed({c: v[lo:cut] for c, v in columns.items()}):
+                return False
+            lo = cut
+            if self.pending is not None and self.last_ts < t:
+                self._open_pending(ts[cut] if cut < len(ts) else t)
+            state = dict(self.interim_metrics(), time=pd.Timestamp(t))
+            self.stop_reason = self.stop_policy.check(backtest_stops.SIGNAL, label, state) or None
+            if self.stop_reason is not None:
+                self.pending = None
+                return False
+        if lo:
+            columns = {c: v[lo:] for c, v in columns.items()}
+        return self._feed(columns)
+
+    def _feed(self, columns):
+        n_new = len(columns["timestamp"])
+        if n_new == 0:
+            return True
+        self.n_rows += n_new
+        columns = {c: columns[c] for c in self.columns}
+        n_carry = 0
+        if self.pending is not None:
+            n_carry = len(self.pending["timestamp"])
+            columns = {c: np.concatenate([self.pending[c], columns[c]]) for c in self.columns}
+            self.pending = None
+
+        pf, pi, st = self.pf, self.pi, self.st
+        n_syms = len(self.pairs)
+        ts = columns["timestamp"]
+        sym = columns["symbol"]
+        close, entry_px, so_px = self._prices(columns)
+        entry_ok = columns["entry_ok"].astype(np.bool_, copy=False)
+        exit_ok = columns["exit_ok"].astype(np.bool_, copy=False)
+        safety_ok = columns["safety_ok"].astype(np.bool_, copy=False)
+
+        # Rows grouped by symbol (in time order within each symbol), plus for each
+        # position the next row where an idle symbol could act: an entry signal,
+        # or a NaN close when the drawdown stop needs exact mark-to-market.
+        n_rows = len(ts)
+        sym_rows = np.argsort(sym, kind="stable").astype(np.int64)
+        sym_start = np.searchsorted(sym[sym_rows], np.arange(n_syms + 1)).astype(np.int64)
+        local_pos = np.empty(n_rows, dtype=np.int64)
+        local_pos[sym_rows] = np.arange(n_rows)
+        hot = np.zeros(n_rows, dtype=np.bool_)
+        if pi[PI_HAS_ENTRY]:
+            hot |= entry_ok
+        if pi[PI_DD_STOP]:
+            hot |= np.isnan(close)
+        hot_pos = np.where(hot[sym_rows], np.arange(n_rows), n_rows)
+        hot_next = np.minimum.accumulate(hot_pos[::-1])[::-1]
+        hot_next = np.minimum(hot_next, sym_start[1:][sym[sym_rows]]).astype(np.int64)
+
+        # Until the kernel has looked at a symbol in this window, its first new
+        # row counts as actionable
+        nxt = np.full(n_syms, n_rows, dtype=np.int64)
+        for s in range(n_syms):
+            q = _first_after(sym_rows, sym_start[s], sym_start[s + 1], n_carry - 1)
+            if q < sym_start[s + 1]:
+                nxt[s] = sym_rows[q]
+
+        # Candidates are collected per timestamp, so the longest run of equal
+        # timestamps bounds how many can be pending at once; the carried ones
+        # are the window's first rows.
+        run_starts = np.flatnonzero(np.r_[True, ts[1:] != ts[:-1]])
+        max_run = int(np.diff(np.r_[run_starts, n_rows]).max())
+        cand = np.zeros(max_run + 1, dtype=np.int64)
+        cand[:n_carry] = np.arange(n_carry)
+        st[ST_ROW] = n_carry
+
+        events = self.events
+        first_event = int(st[ST_EVENTS])
+        while True:
+            _signal_kernel(ts, sym, close, entry_px, so_px, entry_ok, exit_ok, safety_ok,
+                           pf, pi, sym_rows, sym_start, local_pos, hot_next,
+                           self.fs, st, self.sf, self.si, nxt, cand, *events.buffers())
+            if st[ST_ROW] >= n_rows or st[ST_STOP] != 0:
+                break
+            events.grow()
+        events.resolve(first_event, int(st[ST_EVENTS]), columns, self.snapshot_cols)
+        self.last_ts = ts[-1]
+
+        if self.stopped:
+            self.stop_ts = ts[st[ST_STOP_ROW]]
+            self.stop_reason = self.stop_policy.drawdown_reason(backtest_stops.SIGNAL, pd.Timestamp(self.stop_ts))
+            return False
+        if st[ST_CANDIDATES] > 0:
+            rows = cand[:st[ST_CANDIDATES]].copy()
+            self.pending = {c: v[rows] for c, v in columns.items()}
+        return True
+
+    def _open_pending(self, t):
+        """Open the entries carried over from the last timestamp, at time t."""
+        st = self.st
+        columns = self.pending
+        self.pending = None
+        n = len(columns["timestamp"])
+        close, entry_px, _ = self._prices(columns)
+        events = self.events
+        while len(events) - st[ST_EVENTS] < n:
+            events.grow()
+        first_event = int(st[ST_EVENTS])
+        _open_candidates(t, columns["symbol"], close, entry_px,
+                         self.pf, self.pi, self.fs, st, self.sf, self.si,
+                         np.arange(n, dtype=np.int64), *events.buffers())
+        events.resolve(first_event, int(st[ST_EVENTS]), columns, self.snapshot_cols)
+
+    def finish(self):
+        """
+        End of data: open the entries still waiting for a next timestamp and
+        return (events, early_stop_reason), where events is the sealed
+        EventLog or None when no event was generated.
+        """
+        st = self.st
+        if self.pending is not None:
+            self._open_pending(self.last_ts)
+
+        early_stop_reason = self.stop_reason
+        if early_stop_reason is not None:
+            print(early_stop_reason)
+
+        n = int(st[ST_EVENTS])
+        if n == 0:
+            return None, early_stop_reason
+        self.events.seal(n, self.pairs)
+        return self.events, early_stop_reason
+
+
+# Snapshot per-pair runs must capture for merge_event_logs() to order the opens
+OPEN_ORDER_COLUMN = "close"
+
+
+def _open_order(buys, timestamp, close):
+    """buys (event indices, pair order within a timestamp) in the order _open_candidates() opens them."""
+    buys = buys[np.argsort(timestamp[buys], kind="stable")]
+    order = []
+    for batch in np.split(buys, np.flatnonzero(np.diff(timestamp[buys])) + 1):
+        batch = batch.tolist()
+        for a in range(1, len(batch)):
+            r = batch[a]
+            b = a - 1
+            while b >= 0 and close[batch[b]] > close[r]:
+                batch[b + 1] = batch[b]
+                b -= 1
+            batch[b + 1] = r
+        order.extend(batch)
+    return np.array(order, dtype=np.int64)
+
+
+def merge_event_logs(logs, pairs, snapshot_cols=()):
+    """
+    Combine per-pair pass-1 logs into the log one run over all pairs gives
+    when slot_independent() holds. logs[k] is the sealed log of a
+    SignalSimulator over [pairs[k]] with the OPEN_ORDER_COLUMN snapshot, or
+    None. Trade ids are renumbered in the order the joint run opens trades:
+    by signal timestamp, then by close within a timestamp. Events sharing a
+    timestamp are put in the joint run's emission order: the other events
+    pair by pair, then the entries in opening order. Only the snapshot_cols
+    snapshots are kept. Returns None when there is no event.
+    """
+    parts = [(k, log) for k, log in enumerate(logs) if log is not None and len(log)]
+    if not parts:
+        return None
+
+    def cat(name):
+        return np.concatenate([getattr(log, name) for _, log in parts])
+
+    symbol = np.concatenate([np.full(len(log), k, dtype=np.int64) for k, log in parts])
+    timestamp = cat("timestamp")
+    action = cat("action")
+    trade = cat("trade")
+    close = np.concatenate([log.snapshots[OPEN_ORDER_COLUMN] for _, log in parts]).astype(np.float64)
+
+    # Per-pair ids run 1..m in opening order; give each (pair, id) its global id
+    offsets = np.zeros(len(pairs) + 1, dtype=np.int64)
+    for k, log in parts:
+        offsets[k + 1] = int(log.trade.max())
+    offsets = np.cumsum(offsets)
+    buys = np.flatnonzero(action == ACT_BUY)
+    opened = _open_order(buys, timestamp, close)
+    global_id = np.zeros(offsets[-1] + 1, dtype=np.int64)
+    global_id[offsets[symbol[opened]] + trade[opened]] = np.arange(1, len(opened) + 1)
+    trade = np.where(trade > 0, global_id[offsets[symbol] + trade], 0)
+
+    # The joint run opens a timestamp's entries after all its other events
+    rank = symbol.copy()
+    rank[opened] = np.arange(len(opened))
+    order = np.lexsort((rank, action == ACT_BUY, timestamp))
+
+    events = EventLog(0)
+    events.row = cat("row")[order]
+    events.action = action[order]
+    events.number = cat("number")[order]
+    events.values = np.concatenate([log.values for _, log in parts])[order]
+    events.trade = trade[order]
+    events.timestamp = timestamp[order]
+    events.symbol = symbol[order]
+    events._snapshot_parts = {c: [np.concatenate([log.snapshots[c] for _, log in parts])[order]]
+                              for c in snapshot_cols}
+    events.seal(len(symbol), pairs)
+    return events
+
+
+# Pass-2 output columns (replay matrix)
+RP_POSITION = 0
+RP_ORDER_SIZE = 1
+RP_TRADE_SIZE = 2
+RP_PROFIT_LOSS = 3
+RP_BALANCE = 4
+RP_REAL_BALANCE = 5
+RP_FREE_CASH = 6
+RP_POSITION_CHANGE = 7
+RP_POSITION_HELD = 8
+RP_UNREALIZED = 9
+RP_DRAWDOWN = 10
+RP_MAX_DRAWDOWN = 11
+RP_REALIZED_DD = 12
+RP_MAX_REALIZED_DD = 13
+N_RP = 14
+
+REPLAY_COLUMNS = [
+    ("position", RP_POSITION, 4), ("order_size", RP_ORDER_SIZE, 2), ("trade_size", RP_TRADE_SIZE, 2),
+    ("profit_loss", RP_PROFIT_LOSS, 2), ("balance", RP_BALANCE, 2), ("real_balance", RP_REAL_BALANCE, 2),
+    ("free_cash", RP_FREE_CASH, 2), ("position_change", RP_POSITION_CHANGE, 4),
+    ("position_held", RP_POSITION_HELD, 4), ("unrealized_balance", RP_UNREALIZED, 2),
+    ("drawdown", RP_DRAWDOWN, 4), ("max_drawdown", RP_MAX_DRAWDOWN, 4),
+    ("realized_drawdown", RP_REALIZED_DD, 4), ("max_realized_drawdown", RP_MAX_REALIZED_DD, 4),
+]
+
+
+@_jit
+def _deal_filter(sym, kind, trade, n_syms, n_trades, max_deals):
+    """Drop the events of trades that would exceed max_active_deals."""
+    n = sym.shape[0]
+    keep = np.zeros(n, dtype=np.bool_)
+    active = np.full(n_syms, -1, dtype=np.int64)
+    skipped = np.zeros(n_trades, dtype=np.bool_)
+    active_count = 0
+    for k in range(n):
+        s = sym[k]
+        tid = trade[k]
+        if kind[k] == KIND_MARK:
+            keep[k] = True
+            continue
+        if skipped[tid]:
+            continue
+        if kind[k] == KIND_ENTRY:
+            if active[s] == -1:
+                if active_count < max_deals:
+                    active[s] = tid
+                    active_count += 1
+                    keep[k] = True
+                else:
+                    skipped[tid] = True
+            elif tid == active[s]:
+                keep[k] = True
+            else:
+                skipped[tid] = True
+        elif kind[k] == KIND_EXIT:
+            if active[s] != -1 and tid == active[s]:
+                active[s] = -1
+                active_count -= 1
+            keep[k] = True
+    return keep
+
+
+@_jit
+def _replay_kernel(ts, sym, kind, trade, price, amount, sym_order, n_pairs, n_trades,
+                   initial_balance, fee, risk_reduction, reinvest_profit, dd_limit, sample_trades,
+                   out, ledger_rows, equity, equity_rows, counts, stop):
+    """
+    Rescale the pass-1 orders by the realized balance and track balances and
+    drawdowns event by event. sym indexes the n_pairs pairs and sym_order
+    lists the ones traded, in first-seen order. Trades go to out/ledger_rows;
+    equity marks, and trades too when sample_trades is set, go to
+    equity/equity_rows as (unrealized balance, drawdown). counts holds the rows written to each.
+    Returns the number of events consumed; stop[0] is set to 1 when the max
+    drawdown reaches dd_limit, which ends the run on that event.
+    """
+    n = ts.shape[0]
+    n_syms = sym_order.shape[0]
+    positions = np.zeros(n_pairs, dtype=np.float64)
+    last_close = np.zeros(n_pairs, dtype=np.float64)
+    t_seen = np.zeros(n_trades, dtype=np.bool_)
+    t_pos = np.zeros(n_trades, dtype=np.float64)
+    t_size = np.zeros(n_trades, dtype=np.float64)
+    t_frac = np.zeros(n_trades, dtype=np.float64)
+    balance = initial_balance
+    real_balance = initial_balance
+    free_cash = initial_balance
+    max_balance = initial_balance
+    max_dd = 0.0
+    max_real = initial_balance
+    max_real_dd = 0.0
+    for k in range(n):
+        s = sym[k]
+        tid = trade[k]
+        px = price[k]
+        last_close[s] = px
+        position = 0.0
+        order_size = 0.0
+        profit_loss = 0.0
+        position_change = 0.0
+        if not t_seen[tid]:
+            t_seen[tid] = True
+            t_frac[tid] = (real_balance / initial_balance) if initial_balance else 0.0
+
+        if kind[k] == KIND_ENTRY:
+            order_size = t_frac[tid] * amount[k]
+            position = order_size / px if px > 0 else 0.0
+            positions[s] += position
+            position_change = position
+            free_cash -= order_size * (1 + fee)
+            t_pos[tid] += position
+            t_size[tid] += order_size
+        elif kind[k] == KIND_EXIT:
+            position = t_pos[tid]
+            order_size = position * px
+            profit_loss = order_size * (1 - fee) - t_size[tid] * (1 + fee)
+            positions[s] -= position
+            position_change = -position
+            free_cash += order_size * (1 - fee)
+            if profit_loss < 0:
+                balance += profit_loss * (risk_reduction / 100.0)
+            elif profit_loss > 0:
+                balance += profit_loss * (reinvest_profit / 100.0)
+            t_pos[tid] = 0.0
+            t_size[tid] = 0.0
+            real_balance += profit_loss - order_size * fee
+
+        # Summed in first-seen symbol order, like the dict the old loop used
+        unrealized = free_cash
+        for j in range(n_syms):
+            o = sym_order[j]
+            unrealized += (positions[o] * last_close[o]) * (1 - fee)
+        if unrealized > max_balance:
+            max_balance = unrealized
+        drawdown = 0.0
+        if max_balance > 0:
+            drawdown = (max_balance - unrealized) / max_balance
+        if drawdown > max_dd:
+            max_dd = drawdown
+
+        if real_balance > max_real:
+            max_real = real_balance
+        real_dd = 0.0
+        if max_real > 0:
+            real_dd = (max_real - real_balance) / max_real
+        if real_dd > max_real_dd:
+            max_real_dd = real_dd
+
+        if kind[k] != KIND_MARK:
+            j = counts[0]
+            ledger_rows[j] = k
+            out[j, RP_POSITION] = t_pos[tid]
+            out[j, RP_ORDER_SIZE] = order_size
+            out[j, RP_TRADE_SIZE] = t_size[tid]
+            out[j, RP_PROFIT_LOSS] = profit_loss
+            out[j, RP_BALANCE] = balance
+            out[j, RP_REAL_BALANCE] = real_balance
+            out[j, RP_FREE_CASH] = free_cash
+            out[j, RP_POSITION_CHANGE] = position_change
+            out[j, RP_POSITION_HELD] = positions[s]
+            out[j, RP_UNREALIZED] = unrealized
+            out[j, RP_DRAWDOWN] = drawdown
+            out[j, RP_MAX_DRAWDOWN] = max_dd
+            out[j, RP_REALIZED_DD] = real_dd
+            out[j, RP_MAX_REALIZED_DD] = max_real_dd
+            counts[0] = j + 1
+        if kind[k] == KIND_MARK or sample_trades:
+            j = counts[1]
+            equity_rows[j] = k
+            equity[j, 0] = unrealized
+            equity[j, 1] = drawdown
+            counts[1] = j + 1
+
+        if max_dd >= dd_limit:
+            stop[0] = 1
+            return k + 1
+    return n
+
+
+def replay_positions(events, payload, stop_policy=None):
+    """
+    Run pass 2 over the pass-1 EventLog: apply the max_active_deals filter, then
+    resize every order by real_balance / initial_balance at the trade's first
+    event and track fees, reinvestment, risk reduction and drawdowns.
+
+    stop_policy's max_drawdown(REPLAY), if any, is checked after each event
+    is written and ends the run on the event reaching it; its checkpoints are
+    left to backtest_stops.truncate_replay(). Returns (df_out, equity,
+    early_stop_reason): df_out is the trade ledger, or None when every trade
+    was filtered out; equity is the sampled (timestamp, unrealized_balance,
+    drawdown) curve, or None when equity_sampling is "none".
+    """
+    initial_balance = payload.get("initial_balance", 10000.0)
+    trading_fee = payload.get("trading_fee", 0.0) / 100
+    risk_reduction = payload.get("risk_reduction", 0.0)
+    reinvest_profit = payload.get("reinvest_profit", 0.0)
+    max_active_deals = payload.get("max_active_deals", 0)
+    sample_equity = equity_cadence(payload) is not None
+
+    kind = events.kinds()
+    n_trades = int(events.trade.max()) + 1
+    # Deal slots go out in (timestamp, symbol) order, as in the old filter;
+    # the kept events are then sized in emission order.
+    sym_rank = np.argsort(np.argsort(np.array(events.pairs, dtype=object), kind="stable"))
+    by_symbol = np.lexsort((sym_rank[events.symbol], events.timestamp))
+    keep = np.zeros(len(kind), dtype=np.bool_)
+    keep[by_symbol] = _deal_filter(events.symbol[by_symbol], kind[by_symbol], events.trade[by_symbol],
+                                   len(events.pairs), n_trades, max_active_deals)
+    kept_rows = np.flatnonzero(keep)
+    if not (kind[kept_rows] != KIND_MARK).any():
+        return None, None, None
+    ts = events.timestamp[kept_rows]
+    sym = events.symbol[kept_rows]
+    price = events.values[kept_rows, EV_PRICE]
+
+    first_seen = np.unique(sym, return_index=True)[1]
+    sym_order = sym[np.sort(first_seen)].astype(np.int64)
+
+    drawdown_limit = stop_policy.max_drawdown(backtest_stops.REPLAY) if stop_policy is not None else None
+    dd_limit = drawdown_limit if drawdown_limit is not None else np.inf
+
+    n = len(kept_rows)
+    out = np.zeros((n, N_RP), dtype=np.float64)
+    ledger_rows = np.zeros(n, dtype=np.int64)
+    equity = np.zeros((n if sample_equity else 0, 2), dtype=np.float64)
+    equity_rows = np.zeros(len(equity), dtype=np.int64)
+    counts = np.zeros(2, dtype=np.int64)
+    stop = np.zeros(1, dtype=np.int64)
+    n_done = _replay_kernel(ts, sym, kind[kept_rows], events.trade[kept_rows],
+                            price, events.values[kept_rows, EV_AMOUNT], sym_order, len(events.pairs), n_trades,
+                            float(initial_balance), trading_fee, float(risk_reduction), float(reinvest_profit),
+                            dd_limit, sample_equity,
+                            out, ledger_rows, equity, equity_rows, counts, stop)
+
+    early_stop_reason = None
+    if stop[0]:
+        early_stop_reason = stop_policy.drawdown_reason(backtest_stops.REPLAY, pd.Timestamp(ts[n_done - 1]))
+        print(early_stop_reason)
+
+    n_ledger, n_equity = counts
+    if n_ledger == 0:
+        return None, None, early_stop_reason
+    local = ledger_rows[:n_ledger]
+    rows = kept_rows[local]
+    columns = {
+        "timestamp": ts[local].view("datetime64[ns]"),
+        "symbol": np.array(events.pairs, dtype=object)[sym[local]],
+        "action": events.action_labels(rows),
+        "price": round_like_python(price[local], 4),
+        "trade_comment": events.comments(rows, payload),
+        "trade_id": events.trade_labels(rows),
+    }
+    for name, col, digits in REPLAY_COLUMNS:
+        columns[name] = round_like_python(out[:n_ledger, col], digits)
+    df_equity = None
+    if sample_equity:
+        df_equity = pd.DataFrame({
+            "timestamp": ts[equity_rows[:n_equity]].view("datetime64[ns]"),
+            "unrealized_balance": round_like_python(equity[:n_equity, 0], 2),
+            "drawdown": round_like_python(equity[:n_equity, 1], 4),
+        })
+    return pd.DataFrame(columns), df_equity, early_stop_reason
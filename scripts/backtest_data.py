@@ -0,0 +1,269 @@
+"""
+Parquet loading for the crypto backtest engine.
+
+iter_windows() streams one {pair}_all_tf_merged.parquet file, restricted to
+the requested columns, as consecutive time windows (calendar months by
+default, see window_edges()). Row groups whose timestamp statistics fall
+outside the date range are never read or decoded, so a short backtest pays
+only for its own months. The others are decoded batch by batch as the
+windows advance (a group at a time in files not recorded as sorted by
+timestamp in their parquet sorting_columns), so a long backtest holds one
+window per pair in memory instead of every pair's full history.
+
+merge_pairs() interleaves the per-pair frames, each already in time order,
+into one time-ordered set of arrays for the simulation. Every row's place in
+the merge is found by binary search against the other pairs' timestamps, so
+the pairs are neither concatenated into one frame nor sorted again.
+
+add_daily_volume() is the writers' side of the layout: fetcher1m.py,
+update_data.py and minute_update.py call it on every frame they save.
+"""
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+TIMESTAMP_COLUMN = "timestamp"
+# USDT volume of each row's calendar day, read by the min_daily_volume filter
+DAILY_VOLUME_COLUMN = "daily_vol_usdt"
+WINDOW_FREQ = "MS"
+BATCH_ROWS = 64 * 1024
+
+
+def add_daily_volume(df):
+    """Add DAILY_VOLUME_COLUMN to a frame with timestamp, volume and close columns."""
+    day = df[TIMESTAMP_COLUMN].dt.floor("D")
+    df[DAILY_VOLUME_COLUMN] = (df["volume"] * df["close"]).groupby(day).transform("sum")
+    return df
+
+
+def _sorted_by(metadata, column_index):
+    if metadata.num_row_groups == 0:
+        return False
+    for rg in range(metadata.num_row_groups):
+        sorting = metadata.row_group(rg).sorting_columns
+        if not sorting or sorting[0].column_index != column_index or sorting[0].descending:
+            return False
+    return True
+
+
+def _naive(value):
+    value = pd.Timestamp(value)
+    return value.tz_convert(None) if value.tzinfo is not None else value
+
+
+def _row_group_spans(metadata, column_index):
+    """(first, last) timestamp of each row group, or None where statistics are missing."""
+    spans = []
+    for rg in range(metadata.num_row_groups):
+        stats = metadata.row_group(rg).column(column_index).statistics
+        if stats is None or not stats.has_min_max:
+            spans.append(None)
+        else:
+            spans.append((_naive(stats.min), _naive(stats.max)))
+    return spans
+
+
+def time_span(file_path):
+    """(first, last) timestamp of file_path from its statistics, or None when unknown."""
+    parquet = pq.ParquetFile(file_path)
+    column_index = parquet.schema_arrow.get_field_index(TIMESTAMP_COLUMN)
+    if column_index < 0:
+        return None
+    spans = _row_group_spans(parquet.metadata, column_index)
+    if not spans or None in spans:
+        return None
+    return min(s[0] for s in spans), max(s[1] for s in spans)
+
+
+def count_rows(file_path, start=None, end=None):
+    """
+    Approximate number of rows of file_path with start <= timestamp <= end,
+    from its statistics: a row group partly in range counts in proportion to
+    the overlap of its time span, one without statistics counts whole.
+    """
+    parquet = pq.ParquetFile(file_path)
+    metadata = parquet.metadata
+    column_index = parquet.schema_arrow.get_field_index(TIMESTAMP_COLUMN)
+    if column_index < 0:
+        return metadata.num_rows
+    start = None if start is None or pd.isnull(start) else _naive(start)
+    end = None if end is None or pd.isnull(end) else _naive(end)
+    rows = 0.0
+    for rg, span in enumerate(_row_group_spans(metadata, column_index)):
+        n = metadata.row_group(rg).num_rows
+        if span is None:
+            rows += n
+            continue
+        first, last = span
+        lo = first if start is None else max(first, start)
+        hi = last if end is None else min(last, end)
+        if hi < lo:
+            continue
+        width = (last - first).total_seconds()
+        rows += n if width <= 0 else n * (hi - lo).total_seconds() / width
+    return int(round(rows))
+
+
+def window_edges(start, stop, freq=WINDOW_FREQ):
+    """
+    Boundaries that split [start, stop) into calendar windows: start, every
+    period start (midnight of the 1st for months) strictly inside, then stop.
+    With an open bound the whole range is one window.
+    """
+    if start is None or stop is None:
+        return [start, stop]
+    start, stop = _naive(start), _naive(stop)
+    inner = [t for t in pd.date_range(start.normalize(), stop, freq=freq) if start < t < stop]
+    return [start, *inner, stop]
+
+
+def _timestamps_ns(values):
+    return np.asarray(values).astype("datetime64[ns]").view("int64")
+
+
+def merge_positions(timestamps):
+    """
+    Index of every row of each time-sorted array in their merge. Equal
+    timestamps keep the order of the arrays, as a stable sort of the
+    concatenation would.
+    """
+    positions = []
+    for p, ts in enumerate(timestamps):
+        pos = np.arange(len(ts), dtype=np.int64)
+        for q, other in enumerate(timestamps):
+            if q != p:
+                pos += np.searchsorted(other, ts, side="right" if q < p else "left")
+        positions.append(pos)
+    return positions
+
+
+def merge_pairs(frames, columns):
+    """
+    Merge time-sorted frames into time-ordered arrays: "timestamp" (int64 ns),
+    "symbol" (the frame's index in frames) and each name in columns.
+    Only the listed columns are copied, each straight into its merged slot.
+    Empty frames contribute nothing and need not have the columns.
+    """
+    filled = [k for k, f in enumerate(frames) if len(f)]
+    timestamps = [np.empty(0, dtype=np.int64) for _ in frames]
+    for k in filled:
+        timestamps[k] = _timestamps_ns(frames[k][TIMESTAMP_COLUMN].to_numpy())
+    positions = merge_positions(timestamps)
+    n = sum(len(ts) for ts in timestamps)
+    merged = {
+        TIMESTAMP_COLUMN: np.empty(n, dtype=np.int64),
+        "symbol": np.empty(n, dtype=np.int64),
+    }
+    for k, (ts, pos) in enumerate(zip(timestamps, positions)):
+        merged[TIMESTAMP_COLUMN][pos] = ts
+        merged["symbol"][pos] = k
+    for col in columns:
+        values = {k: frames[k][col].to_numpy() for k in filled}
+        out = np.empty(n, dtype=np.result_type(*[v.dtype for v in values.values()]) if filled else np.float64)
+        for k, v in values.items():
+            out[positions[k]] = v
+        merged[col] = out
+    return merged
+
+
+def _group_spans(parquet, column_index):
+    """
+    (first, last) timestamp of each row group: from its statistics, or from
+    the group's own timestamps where those are missing (None if it has none).
+    """
+    spans = _row_group_spans(parquet.metadata, column_index)
+    for rg, span in enumerate(spans):
+        if span is None:
+            ts = pd.to_datetime(parquet.read_row_group(rg, columns=[TIMESTAMP_COLUMN]).column(0).to_pandas(),
+                                errors="coerce").dropna()
+            spans[rg] = (_naive(ts.min()), _naive(ts.max())) if len(ts) else None
+    return spans
+
+
+def _iter_group_windows(parquet, columns, bounds, empty):
+    """
+    iter_windows() for a file not known to be in timestamp order: each window
+    reads the row groups whose time span overlaps it, keeps its own rows and
+    sorts them. A group spanning several windows is read once and kept until
+    the last of them.
+    """
+    spans = _group_spans(parquet, parquet.schema_arrow.get_field_index(TIMESTAMP_COLUMN))
+    groups = [rg for rg, span in enumerate(spans)
+              if span is not None and span[1].value >= bounds[0] and span[0].value < bounds[-1]]
+    cache = {}
+    for k in range(len(bounds) - 1):
+        lo, hi = bounds[k], bounds[k + 1]
+        parts = []
+        for rg in groups:
+            first, last = spans[rg]
+            if last.value < lo or first.value >= hi:
+                continue
+            if rg not in cache:
+                df = parquet.read_row_group(rg, columns=columns).to_pandas()
+                df[TIMESTAMP_COLUMN] = pd.to_datetime(df[TIMESTAMP_COLUMN], errors="coerce")
+                cache[rg] = df
+            df = cache[rg]
+            ts = _timestamps_ns(df[TIMESTAMP_COLUMN].to_numpy())
+            parts.append(df[df[TIMESTAMP_COLUMN].notna().to_numpy() & (ts >= lo) & (ts < hi)])
+        for rg in [rg for rg in cache if spans[rg][1].value < hi]:
+            del cache[rg]
+        if not parts:
+            yield empty.copy()
+            continue
+        df = pd.concat(parts, ignore_index=True)
+        if not df[TIMESTAMP_COLUMN].is_monotonic_increasing:
+            df = df.sort_values(TIMESTAMP_COLUMN, kind="stable")
+        yield df.reset_index(drop=True)
+
+
+def _edge_ns(edge, default):
+    return default if edge is None or pd.isnull(edge) else _naive(edge).value
+
+
+def iter_windows(file_path, columns, edges):
+    """
+    Yield the rows of file_path one window at a time: frame k holds the rows
+    with edges[k] <= timestamp < edges[k + 1], the last one also those at
+    edges[-1] (a None edge is open), in timestamp order. Only row groups
+    overlapping the range are read. A file whose writer recorded that it is
+    sorted by timestamp is read a batch at a time; any other file a row
+    group at a time, placed by the groups' time spans.
+    """
+    parquet = pq.ParquetFile(file_path)
+    column_index = parquet.schema_arrow.get_field_index(TIMESTAMP_COLUMN)
+    n_windows = len(edges) - 1
+    bounds = np.array([_edge_ns(edges[0], np.iinfo(np.int64).min)]
+                      + [_naive(e).value for e in edges[1:-1]]
+                      + [_edge_ns(edges[-1], np.iinfo(np.int64).max - 1) + 1], dtype=np.int64)
+    empty = parquet.schema_arrow.empty_table().select(columns).to_pandas()
+    empty[TIMESTAMP_COLUMN] = pd.to_datetime(empty[TIMESTAMP_COLUMN])
+
+    if not _sorted_by(parquet.metadata, column_index):
+        yield from _iter_group_windows(parquet, columns, bounds, empty)
+        return
+
+    groups = [rg for rg, span in enumerate(_row_group_spans(parquet.metadata, column_index))
+              if span is None or (span[1].value >= bounds[0] and span[0].value < bounds[-1])]
+
+    def window(parts):
+        return pd.concat(parts, ignore_index=True) if parts else empty.copy()
+
+    k = 0
+    parts = []
+    for batch in parquet.iter_batches(batch_size=BATCH_ROWS, row_groups=groups, columns=columns):
+        df = batch.to_pandas()
+        df[TIMESTAMP_COLUMN] = pd.to_datetime(df[TIMESTAMP_COLUMN], errors="coerce")
+        cuts = np.searchsorted(_timestamps_ns(df[TIMESTAMP_COLUMN].to_numpy()), bounds)
+        while k < n_windows:
+            if cuts[k + 1] > cuts[k]:
+                parts.append(df.iloc[cuts[k]:cuts[k + 1]])
+            if cuts[k + 1] == len(df):
+                break
+            yield window(parts)
+            parts = []
+            k += 1
+        if k == n_windows:
+            return
+    for k in range(k, n_windows):
+        yield window(parts)
+        parts = []
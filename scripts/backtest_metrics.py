@@ -0,0 +1,192 @@
+"""
+Vectorized trade metrics for the crypto backtest engine.
+
+ledger_metrics() computes the metrics dict compute_metrics() reports from the
+pass-2 ledger (df_out) in one pass over its columns: action masks for entries
+and exits, a grouped first-entry lookup per trade for deal durations and
+np.diff over the timestamps for exposure. Running totals are summed in row
+order, so the numbers are the same as the old row loops produced. When the
+replay sampled an equity curve, the balance, drawdown and daily return figures
+come from that curve, which also has the marks between trades.
+"""
+import numpy as np
+import pandas as pd
+
+
+def _action_masks(actions):
+    """Entry/exit masks for the action column, classified once per distinct action."""
+    codes, uniques = pd.factorize(actions)
+    lower = [str(a).lower() for a in uniques]
+    is_entry = np.array([("buy" in a) or ("safety" in a) for a in lower], dtype=np.bool_)
+    is_exit = np.array([("sell" in a) or ("exit" in a) for a in lower], dtype=np.bool_)
+    if len(codes) == 0:
+        return np.zeros(0, dtype=np.bool_), np.zeros(0, dtype=np.bool_)
+    return is_entry[codes], is_exit[codes]
+
+
+def _running_sum(values):
+    """Left-to-right sum (np.sum is pairwise and can differ in the last bits)."""
+    if len(values) == 0:
+        return 0.0
+    return float(np.cumsum(values)[-1])
+
+
+def _deal_durations(timestamps, trade_ids, is_entry, is_exit):
+    """
+    Time from the first entry of each deal to its exit. A deal is the run of
+    events of one trade_id up to and including an exit; exits with no entry
+    before them in their run are ignored.
+    """
+    mask = is_entry | is_exit
+    events = pd.DataFrame({
+        "timestamp": timestamps[mask],
+        "trade_id": trade_ids[mask],
+        "exit": is_exit[mask],
+    })
+    grouped = events.groupby("trade_id", sort=False)["exit"]
+    # Exits seen earlier in the same trade split it into separate deals
+    events["deal"] = grouped.cumsum() - events["exit"]
+    entries = events[~events["exit"]]
+    opened = entries.groupby(["trade_id", "deal"], sort=False)["timestamp"].min()
+    exits = events[events["exit"]]
+    opened_at = pd.Series(
+        opened.reindex(pd.MultiIndex.from_arrays([exits["trade_id"], exits["deal"]])).to_numpy(),
+        index=exits.index
+    )
+    has_open = opened_at.notna().to_numpy()
+    return exits["timestamp"][has_open] - opened_at[has_open].astype(exits["timestamp"].dtype)
+
+
+def _any_held(symbols, position_held):
+    """Whether any symbol holds a position after each row (position_held is per symbol)."""
+    now = (position_held > 0).astype(np.int64)
+    before = pd.Series(now).groupby(pd.factorize(symbols)[0]).shift(fill_value=0).to_numpy()
+    return np.cumsum(now - before) > 0
+
+
+def _fmt_td(td):
+    secs = int(td.total_seconds())
+    days, secs = divmod(secs, 86400)
+    hours, secs = divmod(secs, 3600)
+    minutes, secs = divmod(secs, 60)
+    return f"{days} days, {hours} hours, {minutes} minutes"
+
+
+def ledger_metrics(df_out, initial_balance, equity=None):
+    """
+    Compute the run metrics from the pass-2 ledger and, when given, the sampled
+    equity curve (timestamps already datetime in both).
+    """
+    curve = df_out if equity is None or equity.empty else equity
+    timestamps = df_out["timestamp"]
+    ts_ns = timestamps.to_numpy().astype("datetime64[ns]").view("int64")
+    is_entry, is_exit = _action_masks(df_out["action"].to_numpy())
+    has_pl = "profit_loss" in df_out.columns
+    pl = df_out["profit_loss"].to_numpy(dtype=np.float64) if has_pl else np.zeros(len(df_out))
+
+    last_realized = df_out["real_balance"].iloc[-1]
+    last_total = curve["unrealized_balance"].iloc[-1]
+    total_profit = (last_total - initial_balance) / initial_balance
+    total_profit_usd = round(last_total - initial_balance, 2)
+    net_profit = (last_realized - initial_balance) / initial_balance
+    net_profit_usd = round(last_realized - initial_balance, 2)
+
+    start_ts = min(timestamps.iloc[0], curve["timestamp"].iloc[0])
+    end_ts = max(timestamps.iloc[-1], curve["timestamp"].iloc[-1])
+    total_minutes = (end_ts - start_ts).total_seconds() / 60.0
+    total_days = total_minutes / (60.0 * 24.0)
+    if total_days <= 0:
+        average_daily_profit = 0.0
+    else:
+        average_daily_profit = net_profit / total_days
+
+    durations = _deal_durations(timestamps.to_numpy(), df_out["trade_id"].to_numpy(), is_entry, is_exit)
+    if len(durations) == 0:
+        max_deal_duration = "0 days"
+        avg_deal_duration = "0 days"
+    else:
+        max_deal_duration = _fmt_td(durations.max())
+        avg_deal_duration = _fmt_td(durations.sum() / len(durations))
+
+    total_years = total_minutes / 525600.0
+    if total_years > 0:
+        yearly_return = (1 + net_profit) ** (1 / total_years) - 1
+    else:
+        yearly_return = 0.0
+
+    closed = is_exit & has_pl
+    realized = closed & (pl != 0)
+    gross_profit = _running_sum(pl[realized & (pl > 0)])
+    gross_loss = _running_sum(np.abs(pl[realized & ~(pl > 0)]))
+    if gross_loss > 0:
+        profit_factor = gross_profit / gross_loss
+    else:
+        profit_factor = "Infinity" if gross_profit > 0 else 1.0
+
+    daily_bal = curve.resample("1D", on="timestamp")["unrealized_balance"].last().ffill()
+    daily_ret = daily_bal.pct_change().dropna()
+    if len(daily_ret) > 1:
+        sharpe_ratio = daily_ret.mean() / daily_ret.std() * np.sqrt(252)
+    else:
+        sharpe_ratio = 0.0
+
+    neg_ret = daily_ret[daily_ret < 0]
+    if len(neg_ret) > 0:
+        downside_std = neg_ret.std()
+        sortino_ratio = daily_ret.mean() / downside_std * np.sqrt(252)
+    else:
+        sortino_ratio = 0.0
+
+    total_trades = int(closed.sum())
+    wins = int((closed & (pl > 0)).sum())
+    win_rate = wins / total_trades if total_trades > 0 else 0.0
+    avg_profit_per_trade = (gross_profit - gross_loss) / total_trades if total_trades > 0 else 0.0
+
+    num_losses = total_trades - wins
+    avg_win_amt = gross_profit / wins if wins > 0 else 0.0
+    avg_loss_amt = gross_loss / num_losses if num_losses > 0 else 1.0
+    risk_reward_ratio = (avg_win_amt / avg_loss_amt) if avg_loss_amt > 0 else float("inf")
+
+    # Minutes until the next event (the end of the curve after the last one),
+    # counted while any symbol is held
+    gaps = np.diff(np.append(ts_ns, end_ts.value)) / 1e9 / 60.0
+    held = _any_held(df_out["symbol"].to_numpy(), df_out["position_held"].to_numpy(dtype=np.float64))
+    in_position_minutes = _running_sum(gaps[held])
+    exposure_time_frac = in_position_minutes / total_minutes if total_minutes > 0 else 0.0
+
+    var_95 = 0.0
+    if len(daily_ret) > 0:
+        var_95 = -daily_ret.quantile(0.05)
+
+    metrics = {
+        "net_profit": net_profit,
+        "total_profit": total_profit,
+        "net_profit_usd": f"${round(net_profit_usd,2)}",
+        "total_profit_usd": f"${round(total_profit_usd,2)}",
+        "average_daily_profit": average_daily_profit,
+        "max_deal_duration": max_deal_duration,
+        "avg_deal_duration": avg_deal_duration,
+        "yearly_return": yearly_return,
+        "profit_factor": profit_factor,
+        "gross_profit": gross_profit,
+        "gross_loss": gross_loss,
+        "sharpe_ratio": sharpe_ratio,
+        "sortino_ratio": sortino_ratio,
+        "total_trades": total_trades,
+        "win_rate": win_rate,
+        "avg_profit_per_trade": avg_profit_per_trade,
+        "risk_reward_ratio": risk_reward_ratio,
+        "exposure_time_frac": exposure_time_frac,
+        "var_95": var_95
+    }
+
+    if curve is df_out:
+        metrics["max_drawdown"] = df_out["max_drawdown"].iloc[-1]
+    else:
+        metrics["max_drawdown"] = max(df_out["max_drawdown"].iloc[-1], curve["drawdown"].max())
+    if "max_realized_drawdown" in df_out.columns:
+        metrics["max_realized_drawdown"] = df_out["max_realized_drawdown"].iloc[-1]
+    else:
+        metrics["max_realized_drawdown"] = 0.0
+    metrics["total_realized_loss"] = _running_sum(np.abs(pl[is_exit & (pl < 0)]))
+    return metrics
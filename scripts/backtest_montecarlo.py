@@ -0,0 +1,118 @@
+"""
+Monte Carlo robustness check for the crypto backtest engine.
+
+monte_carlo() takes the closed-trade returns from the pass-2 ledger (df_out):
+the change in realized balance from one exit to the next, so compounding them
+in ledger order gives back the realized balance at the last exit. It then
+builds thousands of alternative trade sequences:
+
+    "bootstrap"   draw the trades with replacement (final balance varies)
+    "shuffle"     reorder the same trades (only the path, so the drawdown, varies)
+
+Paths are rows of a (paths, trades) matrix whose equity is a cumulative
+product along the rows. Nothing loops in Python per path or per trade; the
+matrix is filled a block of rows at a time to bound memory.
+
+from_payload() reads payload["monte_carlo"]: None/False (off), True (the
+defaults) or {"paths": 10000, "method": "bootstrap", "seed": 1,
+"percentiles": [5, 50, 95]}.
+"""
+import numpy as np
+
+import backtest_metrics
+
+DEFAULT_PATHS = 10000
+DEFAULT_METHOD = "bootstrap"
+METHODS = ("bootstrap", "shuffle")
+DEFAULT_PERCENTILES = (5, 25, 50, 75, 95)
+# Elements of the path matrix filled at once (float64, so ~16 MB)
+BLOCK_ELEMENTS = 2 * 1024 * 1024
+
+
+def trade_returns(df_out, initial_balance):
+    """Realized balance change of each closed trade, as a fraction of the balance before it."""
+    _, is_exit = backtest_metrics._action_masks(df_out["action"].to_numpy())
+    balances = df_out["real_balance"].to_numpy(dtype=np.float64)[is_exit]
+    before = np.concatenate(([float(initial_balance)], balances[:-1]))
+    ok = before > 0
+    return balances[ok] / before[ok] - 1.0
+
+
+def _block_stats(returns, rows, method, rng):
+    """Final equity (1.0 = start) and max drawdown of rows simulated paths."""
+    if method == "shuffle":
+        paths = rng.permuted(np.broadcast_to(returns, (rows, len(returns))), axis=1)
+    else:
+        paths = returns[rng.integers(0, len(returns), size=(rows, len(returns)))]
+    np.add(paths, 1.0, out=paths)
+    np.cumprod(paths, axis=1, out=paths)
+    # The starting balance is the first peak
+    peaks = np.maximum.accumulate(paths, axis=1)
+    np.maximum(peaks, 1.0, out=peaks)
+    drawdowns = 1.0 - paths / peaks
+    return paths[:, -1].copy(), drawdowns.max(axis=1)
+
+
+def _summary(values, percentiles):
+    return {f"p{p:g}": float(v) for p, v in zip(percentiles, np.percentile(values, percentiles))}
+
+
+def monte_carlo(df_out, initial_balance, paths=DEFAULT_PATHS, method=DEFAULT_METHOD, seed=None,
+                percentiles=DEFAULT_PERCENTILES):
+    """
+    Percentiles of the final balance, net profit and max drawdown over paths
+    resampled trade sequences, plus the probability of ending below the
+    initial balance. None when the ledger has no closed trade.
+    """
+    if method not in METHODS:
+        raise ValueError(f"Unknown Monte Carlo method {method!r}")
+    paths = int(paths)
+    if paths <= 0:
+        raise ValueError("Monte Carlo needs at least one path")
+    returns = trade_returns(df_out, initial_balance)
+    if len(returns) == 0:
+        return None
+
+    rng = np.random.default_rng(seed)
+    block = max(1, BLOCK_ELEMENTS // len(returns))
+    finals = np.empty(paths)
+    drawdowns = np.empty(paths)
+    for start in range(0, paths, block):
+        stop = min(start + block, paths)
+        finals[start:stop], drawdowns[start:stop] = _block_stats(returns, stop - start, method, rng)
+
+    percentiles = [float(p) for p in percentiles]
+    return {
+        "method": method,
+        "paths": paths,
+        "trades": int(len(returns)),
+        "final_balance": _summary(finals * initial_balance, percentiles),
+        "net_profit": _summary(finals - 1.0, percentiles),
+        "max_drawdown": _summary(drawdowns, percentiles),
+        "probability_of_loss": float(np.mean(finals < 1.0)),
+    }
+
+
+def from_payload(spec, df_out, initial_balance):
+    """
+    monte_carlo() as configured by payload["monte_carlo"], None when it is
+    off. A setting it fails on gives {"status": "error", "message": ...}
+    rather than failing the backtest it was asked for with.
+    """
+    if not spec:
+        return None
+    if spec is True:
+        spec = {}
+    try:
+        if not isinstance(spec, dict):
+            raise ValueError(f"Unknown monte_carlo setting {spec!r}")
+        return monte_carlo(
+            df_out, initial_balance,
+            paths=spec.get("paths", DEFAULT_PATHS),
+            method=spec.get("method", DEFAULT_METHOD),
+            seed=spec.get("seed"),
+            percentiles=spec.get("percentiles", DEFAULT_PERCENTILES),
+        )
+    except Exception as e:
+        print(f"Monte Carlo skipped: {e}")
+        return {"status": "error", "message": str(e)}
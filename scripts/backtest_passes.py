@@ -0,0 +1,537 @@
+"""
+Pass-1 and pass-2 drivers shared by backtest.py and backtest2.py.
+
+The engines only differ in their constants (BAR_CLOSE_COLUMNS,
+BASE_GATE_COLUMNS, DEFAULT_EARLY_STOP), in where they read the pair files
+from (DATA_DIR, stream_parquets_in_parallel()) and in their payload defaults
+(get_user_payload()). Every function here takes the engine module and reads
+those from it when called, as backtest_sweep does; callers that point an
+engine at another data directory keep setting engine.DATA_DIR.
+
+run_backtest() runs pass 1 over all pairs (run_signal_pass()), or a pair at a
+time on a process pool when the pairs never wait for each other
+(run_pair_signal_passes()), then pass 2 and the metrics. run_backtests()
+runs several payloads over one scan of the data.
+"""
+import importlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+import backtest_conditions
+import backtest_core
+import backtest_data
+import backtest_montecarlo
+import backtest_stops
+
+# Seconds between two checkpoints of pass 1
+CHECKPOINT_INTERVAL = 60
+# Worker processes for the per-pair pass 1 (None: one per CPU)
+PAIR_PROCESSES = None
+# Seconds between two looks at the workers' progress and the cancel token
+PAIR_POLL_INTERVAL = 1.0
+
+
+def filter_pair_window(df, start_date, end_date, min_daily_volume):
+    """Rows of one pair's window the simulation sees: inside the dates and above the volume floor."""
+    if start_date is not None and not pd.isnull(start_date):
+        df = df[df["timestamp"] >= start_date]
+    if end_date is not None and not pd.isnull(end_date):
+        df = df[df["timestamp"] <= end_date]
+    if df.empty:
+        return df
+    if not pd.api.types.is_datetime64_any_dtype(df["timestamp"]):
+        df["timestamp"] = pd.to_datetime(df["timestamp"])
+
+    # Rows below the volume floor never reach the simulation, so the
+    # previous row used by crossing conditions is the previous kept row.
+    if min_daily_volume > 0:
+        df = df[backtest_core.daily_volume_mask(df, min_daily_volume)].reset_index(drop=True)
+    return df
+
+
+def run_signal_pass(engine, pairs, payload, policy, snapshot_cols=None, checkpoint=None, deadline=None,
+                    on_rows=None, cancel=None):
+    """
+    Pass 1 over pairs, streamed a window at a time. Returns (events,
+    early_stop_reason, has_data): what SignalSimulator.finish() returns, and
+    whether any row was left after the date and volume filters.
+
+    With a checkpoint path the state is saved there between windows every
+    CHECKPOINT_INTERVAL seconds, and a run finding a checkpoint of the same
+    payload resumes from it; the file is removed once pass 1 is done. Past
+    deadline (a time.monotonic() value) the run saves and raises
+    backtest_core.Suspended instead of going on; run it again to resume.
+
+    on_rows(n) is called with the number of 1m rows each window read. cancel
+    (anything with is_set(), see backtest_core.check_cancel) is checked
+    before each window, and once set the run raises backtest_core.Cancelled.
+    """
+    entry_conditions = payload.get("entry_conditions", [])
+    exit_conditions = payload.get("exit_conditions", [])
+    safety_conditions = payload.get("safety_conditions", [])
+    min_daily_volume = payload.get("min_daily_volume", 0.0)
+    has_entry_conditions = bool(entry_conditions)
+    has_exit_conditions = payload.get("conditions_active", False) and bool(exit_conditions)
+    has_safety_conditions = payload.get("safety_order_toggle", False) and bool(safety_conditions)
+
+    req_cols = engine.gather_required_columns(
+        payload.get("entry_conditions", []),
+        payload.get("safety_conditions", []),
+        payload.get("exit_conditions", [])
+    )
+    if min_daily_volume > 0:
+        req_cols.append(backtest_core.DAILY_VOLUME_COLUMN)
+    base_tf = engine.base_timeframe(payload, policy)
+    base_gate = engine.BASE_GATE_COLUMNS[base_tf] if base_tf != "1m" else None
+    if base_gate is not None and base_gate not in req_cols:
+        req_cols.append(base_gate)
+    start_date = pd.to_datetime(payload.get("start_date", ""), errors="coerce")
+    end_date = pd.to_datetime(payload.get("end_date", ""), errors="coerce")
+    entry_mask = backtest_conditions.compile_conditions(entry_conditions, engine.BAR_CLOSE_COLUMNS)
+    exit_mask = backtest_conditions.compile_conditions(exit_conditions, engine.BAR_CLOSE_COLUMNS)
+    safety_mask = backtest_conditions.compile_conditions(safety_conditions, engine.BAR_CLOSE_COLUMNS)
+
+    entry_tf = engine.get_highest_timeframe(entry_conditions) if entry_conditions else "1m"
+    so_tf = engine.get_highest_timeframe(safety_conditions) if safety_conditions else "1m"
+    sim_cols = ["close", "entry_ok", "exit_ok", "safety_ok"]
+    sim_cols += [f"close_{tf}" for tf in sorted({entry_tf, so_tf}) if tf != "1m"]
+
+    # Pass 1 runs a window at a time; the simulator carries open deals and
+    # balances over, and each pair's last kept row feeds the crossing
+    # conditions of its next window.
+    sim = backtest_core.SignalSimulator(
+        pairs, payload,
+        entry_tf=entry_tf, so_tf=so_tf, stop_policy=policy, snapshot_cols=snapshot_cols,
+        stop_times=backtest_stops.stop_times(policy, backtest_stops.SIGNAL, start_date, end_date)
+    )
+    prev_rows = {}
+    has_data = False
+    first_window = 0
+    rows_done = 0
+    key = backtest_core.checkpoint_key(payload, pairs)
+    state = backtest_core.load_checkpoint(checkpoint, key) if checkpoint else None
+    if state is not None:
+        sim.restore(state["sim"])
+        prev_rows = state["prev_rows"]
+        has_data = state["has_data"]
+        first_window = state["windows_done"]
+        rows_done = state.get("rows_done", 0)
+        print(f"Resuming pass 1 from {checkpoint} after {first_window} windows")
+        if on_rows is not None and rows_done:
+            on_rows(rows_done)
+    saved_at = time.monotonic()
+    windows = engine.stream_parquets_in_parallel(pairs, req_cols, start_date, end_date, first_window)
+    for windows_done, dfs_map in enumerate(windows, start=first_window + 1):
+        if cancel is not None and cancel.is_set():
+            windows.close()
+            raise backtest_core.Cancelled()
+        rows = sum(len(df) for df in dfs_map.values())
+        for sym, df in dfs_map.items():
+            df = filter_pair_window(df, start_date, end_date, min_daily_volume)
+            if df.empty:
+                dfs_map[sym] = df
+                continue
+            for col, mask, active in (("entry_ok", entry_mask, has_entry_conditions),
+                                      ("exit_ok", exit_mask, has_exit_conditions),
+                                      ("safety_ok", safety_mask, has_safety_conditions)):
+                df[col] = mask(df, prev_rows.get(sym)) if active else False
+            if len(df):
+                prev_rows[sym] = df.tail(1).copy()
+            # Nothing can happen between base_tf closes, so pass 1 only gets
+            # those rows; the masks above were computed on every 1m row.
+            if base_gate is not None:
+                df = df[df[base_gate].to_numpy(dtype=bool)]
+            dfs_map[sym] = df
+
+        if not all(dfs_map[p].empty for p in pairs):
+            has_data = True
+            # Interleave the pairs' rows in time order, keeping only what the
+            # simulation reads; the window's frames are dropped afterwards.
+            columns = backtest_data.merge_pairs([dfs_map[p] for p in pairs], sim_cols)
+            dfs_map.clear()
+            if not sim.feed(columns):
+                break
+        rows_done += rows
+        if on_rows is not None:
+            on_rows(rows)
+
+        if checkpoint is None:
+            continue
+        now = time.monotonic()
+        suspend = deadline is not None and now >= deadline
+        if suspend or now - saved_at >= CHECKPOINT_INTERVAL:
+            state = {"sim": sim.checkpoint(), "prev_rows": prev_rows, "has_data": has_data,
+                     "windows_done": windows_done, "rows_done": rows_done}
+            backtest_core.save_checkpoint(checkpoint, key, state)
+            saved_at = now
+            if suspend:
+                windows.close()
+                raise backtest_core.Suspended(checkpoint)
+
+    backtest_core.remove_checkpoint(checkpoint)
+    if not has_data:
+        return None, None, False
+    events, early_stop_reason = sim.finish()
+    return events, early_stop_reason, True
+
+
+# Engine, row counter and cancel flag the workers of run_pair_signal_passes()
+# share with the caller, handed over by _init_pair_worker()
+_pair_engine = None
+_pair_rows = None
+_pair_cancel = None
+
+
+def _init_pair_worker(engine_name, rows, cancel, data_dir):
+    global _pair_engine, _pair_rows, _pair_cancel
+    _pair_engine = importlib.import_module(engine_name)
+    # The worker imported the engine afresh, without the caller's setting
+    _pair_engine.DATA_DIR = data_dir
+    _pair_rows, _pair_cancel = rows, cancel
+
+
+def _engine_name(engine):
+    """
+    Name a worker imports engine by. A script run as __main__ is imported by
+    its file name: the copy multiprocessing runs in the worker as __mp_main__
+    keeps its functions' globals apart from the module's attributes.
+    """
+    if engine.__name__ != "__main__":
+        return engine.__name__
+    return os.path.splitext(os.path.basename(engine.__file__))[0]
+
+
+def _count_pair_rows(n):
+    with _pair_rows.get_lock():
+        _pair_rows.value += n
+
+
+def _pair_signal_pass(engine, pair, payload, checkpoint, deadline, on_rows=None, cancel=None):
+    """Pass 1 of a single pair for run_pair_signal_passes()."""
+    if checkpoint:
+        checkpoint = f"{checkpoint}.{pair.replace('/', '_')}"
+    events, _, has_data = run_signal_pass(engine, [pair], payload, backtest_stops.EarlyStopPolicy(),
+                                          snapshot_cols=[backtest_core.OPEN_ORDER_COLUMN],
+                                          checkpoint=checkpoint, deadline=deadline,
+                                          on_rows=on_rows, cancel=cancel)
+    return events, has_data
+
+
+def _pair_worker(pair, payload, checkpoint, deadline):
+    """_pair_signal_pass() in a worker process, with the shared row counter and cancel flag."""
+    return _pair_signal_pass(_pair_engine, pair, payload, checkpoint, deadline, _count_pair_rows, _pair_cancel)
+
+
+def run_pair_signal_passes(engine, pairs, payload, checkpoint=None, deadline=None, on_rows=None, cancel=None):
+    """
+    Pass 1 with a process per pair, for payloads where
+    backtest_core.slot_independent() holds: the pairs never wait for each
+    other, so the merged logs are the events of run_signal_pass() over all
+    pairs. Returns the same triple. Each pair checkpoints to its own file
+    next to checkpoint. on_rows and cancel work as in run_signal_pass(); the
+    workers count their rows and see the cancel token through shared memory.
+    With a single process the pairs run one after the other in this one.
+    """
+    processes = min(len(pairs), PAIR_PROCESSES or os.cpu_count() or 1)
+    if processes <= 1:
+        results = [_pair_signal_pass(engine, pair, payload, checkpoint, deadline, on_rows, cancel)
+                   for pair in pairs]
+        events = backtest_core.merge_event_logs([events for events, _ in results], pairs)
+        return events, None, any(has_data for _, has_data in results)
+
+    # Workers start from a fresh interpreter rather than a fork, which would
+    # copy the locks of the caller's other threads (the job server's) in
+    # whatever state they are.
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+    rows = context.Value("q", 0)
+    stop = context.Event()
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_pair_worker,
+                             initargs=(_engine_name(engine), rows, stop, engine.DATA_DIR)) as pool:
+        futures = [pool.submit(_pair_worker, pair, payload, checkpoint, deadline) for pair in pairs]
+        pending = futures
+        reported = 0
+        while pending:
+            _, pending = wait(pending, timeout=PAIR_POLL_INTERVAL)
+            if cancel is not None and cancel.is_set():
+                stop.set()
+            done = rows.value
+            if on_rows is not None and done > reported:
+                on_rows(done - reported)
+                reported = done
+        results = [future.result() for future in futures]
+    events = backtest_core.merge_event_logs([events for events, _ in results], pairs)
+    return events, None, any(has_data for _, has_data in results)
+
+
+def _finish_backtest(engine, payload, events, early_stop_reason, has_data, policy, on_phase=None, cancel=None):
+    """
+    Pass 2, metrics and the result dict of run_backtest() from the pass-1
+    output. on_phase("replay") and on_phase("metrics") are called as those
+    start, each after a look at cancel.
+    """
+    strategy_name = payload.get("strategy_name", '')
+    initial_balance = payload.get("initial_balance", 10000.0)
+    start_date = pd.to_datetime(payload.get("start_date", ""), errors="coerce")
+    end_date = pd.to_datetime(payload.get("end_date", ""), errors="coerce")
+    results_dir = os.path.join(engine.DATA_DIR, "backtest_results", strategy_name)
+    if not has_data:
+        return {"status": "success", "message": "No data after filtering dates."}
+    if events is None:
+        os.makedirs(results_dir, exist_ok=True)
+        return {
+            "status": "success",
+            "message": "No trades generated => cannot display metrics.",
+            "results_directory": results_dir
+        }
+
+    backtest_core.check_cancel(cancel)
+    if on_phase is not None:
+        on_phase("replay")
+    df_out, equity, replay_stop_reason = backtest_core.replay_positions(events, payload, policy)
+    df_out, equity, early_stop_reason = backtest_stops.truncate_replay(
+        policy, backtest_stops.stop_times(policy, backtest_stops.REPLAY, start_date, end_date),
+        df_out, equity, initial_balance
+    )
+    early_stop_reason = early_stop_reason or replay_stop_reason
+    if df_out is None:
+        os.makedirs(results_dir, exist_ok=True)
+        return {
+            "status": "success",
+            "message": "All trades were skipped => no final CSV => no metrics.",
+            "results_directory": results_dir
+        }
+
+    os.makedirs(results_dir, exist_ok=True)
+    out_final = os.path.join(results_dir, "all_trades_combined.csv")
+    df_out.to_csv(out_final, index=False)
+    print(f"Final backtest => {out_final}")
+
+    backtest_core.check_cancel(cancel)
+    if on_phase is not None:
+        on_phase("metrics")
+    result = engine.compute_metrics(df_out, initial_balance, payload, results_dir, engine.DATA_DIR, equity)
+    if result.get("status") == "success":
+        monte_carlo = backtest_montecarlo.from_payload(payload.get("monte_carlo"), df_out, initial_balance)
+        if monte_carlo is not None:
+            result["monte_carlo"] = monte_carlo
+    if isinstance(result, dict) and "df_out" in result:
+        result["df_out"] = result["df_out"].to_dict("records")
+
+    if early_stop_reason:
+        result["message"] = early_stop_reason
+    return result
+
+
+def run_backtest(engine, payload, progress=None, cancel=None):
+    """
+    Backtest of payload. progress(phase, bars_done, bars_total) is called as
+    the run goes through "load", "simulate", "replay" and "metrics", where
+    bars_done counts the 1m rows pass 1 has read so far out of the
+    engine.count_bars() estimate. cancel (e.g. a threading.Event) is checked
+    between windows and phases; once it is set the run stops and returns
+    status "cancelled".
+    """
+    try:
+        payload = engine.get_user_payload(payload)
+
+        pairs = payload.get("pairs", [])
+        pairs.sort()
+        if not pairs:
+            return {"status": "error", "message": "No pairs selected."}
+
+        policy = engine.early_stop_policy(payload)
+        checkpoint = payload.get("checkpoint")
+        time_budget = payload.get("time_budget")
+        deadline = time.monotonic() + time_budget if time_budget else None
+        on_rows = on_phase = None
+        if progress is not None:
+            bars_total = engine.count_bars(pairs, pd.to_datetime(payload.get("start_date", ""), errors="coerce"),
+                                           pd.to_datetime(payload.get("end_date", ""), errors="coerce"))
+            bars_done = 0
+
+            def on_rows(n):
+                nonlocal bars_done
+                bars_done += n
+                progress("simulate", bars_done, bars_total)
+
+            def on_phase(phase):
+                progress(phase, bars_done, bars_total)
+
+            on_phase("load")
+        # With a deal slot for every pair, each pair's pass 1 runs on its own
+        if backtest_core.slot_independent(payload, len(pairs), policy.watches(backtest_stops.SIGNAL)):
+            events, early_stop_reason, has_data = run_pair_signal_passes(engine, pairs, payload, checkpoint,
+                                                                         deadline, on_rows=on_rows,
+                                                                         cancel=cancel)
+        else:
+            events, early_stop_reason, has_data = run_signal_pass(engine, pairs, payload, policy,
+                                                                  checkpoint=checkpoint, deadline=deadline,
+                                                                  on_rows=on_rows, cancel=cancel)
+        return _finish_backtest(engine, payload, events, early_stop_reason, has_data, policy, on_phase, cancel)
+
+    except backtest_core.Suspended as e:
+        print(e)
+        return {"status": "suspended", "message": str(e), "checkpoint": e.checkpoint}
+    except backtest_core.Cancelled as e:
+        print(e)
+        return {"status": "cancelled", "message": str(e)}
+    except Exception as e:
+        print("Exception in run_backtest:", e)
+        return {"status": "error", "message": str(e)}
+
+
+def _batch_job(engine, payload):
+    """Pass-1 state of one payload of run_backtests()."""
+    entry_conditions = payload.get("entry_conditions", [])
+    exit_conditions = payload.get("exit_conditions", [])
+    safety_conditions = payload.get("safety_conditions", [])
+    min_daily_volume = payload.get("min_daily_volume", 0.0)
+    req_cols = engine.gather_required_columns(entry_conditions, safety_conditions, exit_conditions)
+    if min_daily_volume > 0:
+        req_cols.append(backtest_core.DAILY_VOLUME_COLUMN)
+    policy = engine.early_stop_policy(payload)
+    base_tf = engine.base_timeframe(payload, policy)
+    base_gate = engine.BASE_GATE_COLUMNS[base_tf] if base_tf != "1m" else None
+    if base_gate is not None:
+        req_cols.append(base_gate)
+    start_date = pd.to_datetime(payload.get("start_date", ""), errors="coerce")
+    end_date = pd.to_datetime(payload.get("end_date", ""), errors="coerce")
+
+    entry_tf = engine.get_highest_timeframe(entry_conditions) if entry_conditions else "1m"
+    so_tf = engine.get_highest_timeframe(safety_conditions) if safety_conditions else "1m"
+    price_cols = ["close"] + [f"close_{tf}" for tf in sorted({entry_tf, so_tf}) if tf != "1m"]
+    sim = backtest_core.SignalSimulator(
+        payload["pairs"], payload,
+        entry_tf=entry_tf, so_tf=so_tf, stop_policy=policy,
+        stop_times=backtest_stops.stop_times(policy, backtest_stops.SIGNAL, start_date, end_date)
+    )
+    return {
+        "payload": payload,
+        "policy": policy,
+        "sim": sim,
+        "req_cols": req_cols,
+        # Rows of a pair only differ between payloads through these filters
+        "view": (start_date, end_date, min_daily_volume),
+        "conditions": [
+            ("entry_ok", entry_conditions, bool(entry_conditions)),
+            ("exit_ok", exit_conditions, payload.get("conditions_active", False) and bool(exit_conditions)),
+            ("safety_ok", safety_conditions, payload.get("safety_order_toggle", False) and bool(safety_conditions)),
+        ],
+        "price_cols": price_cols,
+        "base_gate": base_gate,
+        "has_data": False,
+        "done": False,
+    }
+
+
+def _scan_range(jobs):
+    """Date range covering every job; an open bound on any job leaves it open."""
+    starts = [job["view"][0] for job in jobs]
+    ends = [job["view"][1] for job in jobs]
+    start = None if any(pd.isnull(t) for t in starts) else min(starts)
+    end = None if any(pd.isnull(t) for t in ends) else max(ends)
+    return start, end
+
+
+def run_backtests(engine, payloads):
+    """
+    Backtest several payloads in one scan of the data. Each window is read
+    once for the union of the payloads' pairs, columns and dates; each
+    distinct condition list is evaluated once per pair and row filter (dates
+    and min_daily_volume), and every payload's pass 1 is fed its own pairs
+    from the shared masks. Returns one result per payload, as run_backtest()
+    would give for it alone.
+    """
+    results = [None] * len(payloads)
+    jobs = {}
+    for k, payload in enumerate(payloads):
+        payload = engine.get_user_payload(payload)
+        payload["pairs"] = sorted(payload.get("pairs", []))
+        if not payload["pairs"]:
+            results[k] = {"status": "error", "message": "No pairs selected."}
+            continue
+        try:
+            jobs[k] = _batch_job(engine, payload)
+        except Exception as e:
+            print("Exception in run_backtests:", e)
+            results[k] = {"status": "error", "message": str(e)}
+    if not jobs:
+        return results
+
+    pairs = sorted({p for job in jobs.values() for p in job["payload"]["pairs"]})
+    req_cols = list(dict.fromkeys(c for job in jobs.values() for c in job["req_cols"]))
+    start, end = _scan_range(list(jobs.values()))
+    compiled = {}
+    prev_rows = {}
+    try:
+        for dfs_map in engine.stream_parquets_in_parallel(pairs, req_cols, start, end):
+            frames = {}
+            masks = {}
+
+            def view_frame(view, sym):
+                if (view, sym) not in frames:
+                    frames[view, sym] = filter_pair_window(dfs_map[sym], *view)
+                return frames[view, sym]
+
+            def mask(view, sym, conditions):
+                key = json.dumps(conditions, sort_keys=True)
+                if (view, sym, key) not in masks:
+                    if key not in compiled:
+                        compiled[key] = backtest_conditions.compile_conditions(conditions, engine.BAR_CLOSE_COLUMNS)
+                    masks[view, sym, key] = compiled[key](view_frame(view, sym), prev_rows.get((view, sym)))
+                return masks[view, sym, key]
+
+            for job in jobs.values():
+                if job["done"]:
+                    continue
+                view = job["view"]
+                parts = []
+                for sym in job["payload"]["pairs"]:
+                    df = view_frame(view, sym)
+                    if df.empty:
+                        parts.append(df)
+                        continue
+                    data = {"timestamp": df["timestamp"].to_numpy()}
+                    for c in job["price_cols"]:
+                        data[c] = df[c].to_numpy()
+                    for col, conditions, active in job["conditions"]:
+                        data[col] = mask(view, sym, conditions) if active else np.zeros(len(df), dtype=bool)
+                    if job["base_gate"] is not None:
+                        keep = df[job["base_gate"]].to_numpy(dtype=bool)
+                        data = {c: v[keep] for c, v in data.items()}
+                    parts.append(pd.DataFrame(data))
+                if all(part.empty for part in parts):
+                    continue
+                job["has_data"] = True
+                sim_cols = job["price_cols"] + [col for col, _, _ in job["conditions"]]
+                if not job["sim"].feed(backtest_data.merge_pairs(parts, sim_cols)):
+                    job["done"] = True
+
+            for (view, sym), df in frames.items():
+                if len(df):
+                    prev_rows[view, sym] = df.tail(1).copy()
+            dfs_map.clear()
+            if all(job["done"] for job in jobs.values()):
+                break
+    except Exception as e:
+        print("Exception in run_backtests:", e)
+        for k in jobs:
+            results[k] = {"status": "error", "message": str(e)}
+        return results
+
+    for k, job in jobs.items():
+        try:
+            events, early_stop_reason = job["sim"].finish() if job["has_data"] else (None, None)
+            results[k] = _finish_backtest(engine, job["payload"], events, early_stop_reason, job["has_data"],
+                                          job["policy"])
+        except Exception as e:
+            print("Exception in run_backtests:", e)
+            results[k] = {"status": "error", "message": str(e)}
+    return results
@@ -0,0 +1,214 @@
+"""
+Early-stop policies for the crypto backtest engine.
+
+A policy names a few checkpoints of the date range for each pass ("signal"
+for pass 1, "replay" for pass 2) and decides at each of them, from the run's
+state at that time, whether the run is abandoned. A max drawdown
+(max_drawdown(stage)) is instead checked on every bar (pass 1) or ledger
+row (pass 2), and the run is cut at the one reaching it.
+
+The state handed to check() holds the checkpoint "time" and, from the pass's
+balances, "net_profit" and "total_profit" (fractions of the initial balance),
+"net_profit_usd" and "max_drawdown".
+
+from_payload() builds a policy from payload["early_stop"]:
+    "none" | "default"
+    {"type": "drawdown", "max_drawdown": 0.3}
+    {"type": "profit_gates", "max_drawdown": 0.3,
+     "gates": [{"at": 0.25, "min_net_profit": 0.0}, ...]}
+    {"signal": <spec>, "replay": <spec>}   (a different policy per pass)
+Callers may also pass an EarlyStopPolicy or a callable
+fn(stage, label, state) returning a reason (or True) to stop.
+"""
+import numpy as np
+import pandas as pd
+
+SIGNAL = "signal"
+REPLAY = "replay"
+
+# (label, fraction of the date range): quarter_time ... almost_time
+DEFAULT_CHECKPOINTS = (("25%", 1 / 4), ("33%", 1 / 3), ("halfway", 1 / 2), ("66%", 1 / 1.5), ("80%", 1 / 1.25))
+
+
+def _label(fraction):
+    for label, f in DEFAULT_CHECKPOINTS:
+        if np.isclose(f, fraction):
+            return label
+    return f"{fraction:.0%}"
+
+
+class EarlyStopPolicy:
+    """Never stops. Subclasses return checkpoints and override check()."""
+
+    def checkpoints(self, stage):
+        """[(label, fraction of the date range)] at which check() runs in stage."""
+        return []
+
+    def max_drawdown(self, stage):
+        """Max drawdown at which stage stops on the bar reaching it, or None."""
+        return None
+
+    def watches(self, stage):
+        return bool(self.checkpoints(stage)) or self.max_drawdown(stage) is not None
+
+    def check(self, stage, label, state):
+        """Reason to stop at checkpoint label, or None to go on."""
+        return None
+
+    def drawdown_reason(self, stage, time):
+        """Reason given when stage stops at time on max_drawdown(stage)."""
+        return f"Stopped early due to max drawdown ≥ {self.max_drawdown(stage):.0%} at {time}"
+
+
+class DrawdownStop(EarlyStopPolicy):
+    """Stops on the bar where the max drawdown reaches max_drawdown."""
+
+    def __init__(self, max_drawdown):
+        self.limit = max_drawdown
+
+    def max_drawdown(self, stage):
+        return self.limit
+
+
+class ProfitGates(EarlyStopPolicy):
+    """
+    Net profit floors at fixed points of the date range: gates is a list of
+    (label, fraction, min_net_profit, relative), the floor in USD unless
+    relative. An optional max_drawdown is checked on every bar.
+    """
+
+    def __init__(self, gates, max_drawdown=None):
+        self.gates = sorted(gates, key=lambda g: g[1])
+        self.limit = max_drawdown
+
+    def checkpoints(self, stage):
+        return [(label, fraction) for label, fraction, _, _ in self.gates]
+
+    def max_drawdown(self, stage):
+        return self.limit
+
+    def check(self, stage, label, state):
+        for gate_label, _, floor, relative in self.gates:
+            if gate_label == label:
+                net_profit = state["net_profit"] if relative else state["net_profit_usd"]
+                if net_profit < floor:
+                    return f"Stopped early due to negative net profit at {label} point ({state['time']})"
+        return None
+
+
+class CallableStop(EarlyStopPolicy):
+    """Wraps fn(stage, label, state), which returns a reason (or True) to stop."""
+
+    def __init__(self, fn, checkpoints=DEFAULT_CHECKPOINTS):
+        self.fn = fn
+        self._checkpoints = list(checkpoints)
+
+    def checkpoints(self, stage):
+        return list(self._checkpoints)
+
+    def check(self, stage, label, state):
+        reason = self.fn(stage, label, state)
+        if reason is True:
+            return f"Stopped early by policy at {label} point ({state['time']})"
+        return reason or None
+
+
+class PerPass(EarlyStopPolicy):
+    """A separate policy for pass 1 (signal) and pass 2 (replay)."""
+
+    def __init__(self, signal=None, replay=None):
+        self.policies = {SIGNAL: signal or EarlyStopPolicy(), REPLAY: replay or EarlyStopPolicy()}
+
+    def checkpoints(self, stage):
+        return self.policies[stage].checkpoints(stage)
+
+    def max_drawdown(self, stage):
+        return self.policies[stage].max_drawdown(stage)
+
+    def check(self, stage, label, state):
+        return self.policies[stage].check(stage, label, state)
+
+    def drawdown_reason(self, stage, time):
+        return self.policies[stage].drawdown_reason(stage, time)
+
+
+def from_payload(spec, default=None):
+    """Policy for payload["early_stop"]; None and "default" give default (or no policy)."""
+    default = default or EarlyStopPolicy()
+    if spec is None or spec == "default":
+        return default
+    if isinstance(spec, EarlyStopPolicy):
+        return spec
+    if callable(spec):
+        return CallableStop(spec)
+    if spec == "none":
+        return EarlyStopPolicy()
+    if isinstance(spec, dict):
+        if SIGNAL in spec or REPLAY in spec:
+            return PerPass(from_payload(spec.get(SIGNAL, "none")), from_payload(spec.get(REPLAY, "none")))
+        kind = spec.get("type")
+        if kind == "none":
+            return EarlyStopPolicy()
+        if kind == "drawdown":
+            return DrawdownStop(float(spec["max_drawdown"]))
+        if kind == "profit_gates":
+            gates = [(g.get("label") or _label(g["at"]), float(g["at"]), float(g.get("min_net_profit", 0.0)),
+                      bool(g.get("relative", True)))
+                     for g in spec.get("gates", [])]
+            max_drawdown = spec.get("max_drawdown")
+            return ProfitGates(gates, None if max_drawdown is None else float(max_drawdown))
+    raise ValueError(f"Unknown early_stop policy {spec!r}")
+
+
+def stop_times(policy, stage, start_date, end_date):
+    """[(label, ns)] of the policy's checkpoints for stage, in time order; none without both dates."""
+    if pd.isnull(start_date) or pd.isnull(end_date) or end_date <= start_date:
+        return []
+    span = (end_date - start_date).total_seconds()
+    times = [(label, (start_date + pd.Timedelta(seconds=span * fraction)).value)
+             for label, fraction in policy.checkpoints(stage)]
+    return sorted(times, key=lambda t: t[1])
+
+
+def truncate_replay(policy, times, df_out, equity, initial_balance):
+    """
+    Evaluate the replay checkpoints on the pass-2 ledger and equity curve and
+    cut both at the first one the policy stops at. Returns (df_out, equity,
+    early_stop_reason); df_out is None when nothing is left.
+    """
+    if df_out is None or not times:
+        return df_out, equity, None
+    ts = df_out["timestamp"].to_numpy().astype("datetime64[ns]").view("int64")
+    eq_ts = None
+    if equity is not None and len(equity):
+        eq_ts = equity["timestamp"].to_numpy().astype("datetime64[ns]").view("int64")
+    last = max(ts[-1], eq_ts[-1]) if eq_ts is not None else ts[-1]
+    for label, t in times:
+        if t > last:
+            break
+        # The rows at t itself count, as in pass 1
+        n = int(np.searchsorted(ts, t, side="right"))
+        m = int(np.searchsorted(eq_ts, t, side="right")) if eq_ts is not None else 0
+        real_balance = df_out["real_balance"].iloc[n - 1] if n else initial_balance
+        if m:
+            unrealized = equity["unrealized_balance"].iloc[m - 1]
+        else:
+            unrealized = df_out["unrealized_balance"].iloc[n - 1] if n else initial_balance
+        max_drawdown = df_out["max_drawdown"].iloc[n - 1] if n else 0.0
+        if m:
+            max_drawdown = max(max_drawdown, equity["drawdown"].iloc[:m].max())
+        state = {
+            "time": pd.Timestamp(t),
+            "net_profit": (real_balance - initial_balance) / initial_balance,
+            "net_profit_usd": real_balance - initial_balance,
+            "total_profit": (unrealized - initial_balance) / initial_balance,
+            "max_drawdown": max_drawdown,
+        }
+        reason = policy.check(REPLAY, label, state)
+        if reason:
+            print(reason)
+            df_out = df_out.iloc[:n].reset_index(drop=True) if n else None
+            if equity is not None:
+                equity = equity.iloc[:m].reset_index(drop=True)
+            return df_out, equity, reason
+    return df_out, equity, None
@@ -0,0 +1,515 @@
+"""
+Parameter sweeps for the crypto backtest engine.
+
+run_sweep() expands a base payload and a grid of parameter values into one
+payload per combination. The pairs are loaded and aligned once for the whole
+sweep, every distinct condition list is compiled into a mask once and shared
+by the variants using it, and the variants then run on a process pool.
+Variants whose pass 1 is the same (backtest_core.signal_key(), e.g. when only
+initial_balance, trading_fee, reinvest_profit or risk_reduction differ) share
+one pass-1 EventLog and each rerun only pass 2 and the metrics. Nothing is
+written to disk; the result is a table with one row per variant, ranked by
+one of the metric columns.
+
+run_halving() searches the same grids by successive halving: the variants
+run pass 1 side by side and at each checkpoint of the date range the worst
+share by an interim metric is dropped, so only the survivors pay for the full
+history, pass 2 and the metrics.
+
+run_walk_forward() optimizes the grid on rolling in-sample windows and runs
+the winner on the out-of-sample span after each, stitching the out-of-sample
+equity curves. All windows are slices of the same once-loaded arrays.
+
+Grid keys are payload keys ("target_profit") or dotted paths into nested
+conditions ("entry_conditions.0.subfields.Signal Value"). The keys that decide
+which rows are loaded (DATA_KEYS) are shared by the whole sweep.
+"""
+import copy
+import importlib
+import itertools
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+import backtest_conditions
+import backtest_core
+import backtest_data
+import backtest_metrics
+import backtest_passes
+import backtest_stops
+
+DATA_KEYS = ("pairs", "start_date", "end_date", "min_daily_volume")
+DEFAULT_RANK_BY = "net_profit"
+
+# Successive halving: the run_backtest checkpoints (quarter_time, third_time,
+# halfway_time, twothirds_time, almost_time) as fractions of the date range,
+# and the share of variants kept at each of them.
+CHECKPOINT_FRACTIONS = (1 / 4, 1 / 3, 1 / 2, 1 / 1.5, 1 / 1.25)
+DEFAULT_KEEP = 0.5
+# +1 where higher is better
+METRIC_SIGNS = {"net_profit": 1, "total_profit": 1, "max_drawdown": -1}
+CONDITION_KINDS = (
+    ("entry_ok", "entry_conditions", None),
+    ("exit_ok", "exit_conditions", "conditions_active"),
+    ("safety_ok", "safety_conditions", "safety_order_toggle"),
+)
+
+NO_DATA = {"status": "no_data", "message": "No data after filtering dates."}
+
+# Set in each worker process by _init_worker()
+_shared = None
+
+
+def _set_path(payload, path, value):
+    target = payload
+    keys = path.split(".")
+    try:
+        for key in keys[:-1]:
+            target = target[int(key)] if isinstance(target, list) else target[key]
+        if isinstance(target, list):
+            target[int(keys[-1])] = value
+        else:
+            target[keys[-1]] = value
+    except (KeyError, IndexError, ValueError, TypeError):
+        raise ValueError(f"Sweep parameter {path!r} does not match the base payload")
+
+
+def expand_grid(base_payload, grid):
+    """[(params, payload)] for every combination of the grid values, in grid order."""
+    names = list(grid)
+    for name in names:
+        if name.split(".")[0] in DATA_KEYS:
+            raise ValueError(f"{name!r} selects the data and cannot be swept")
+    variants = []
+    for values in itertools.product(*(list(grid[name]) for name in names)):
+        payload = copy.deepcopy(base_payload)
+        for name, value in zip(names, values):
+            _set_path(payload, name, value)
+        variants.append((dict(zip(names, values)), payload))
+    return variants
+
+
+def _active_conditions(payload, key, toggle):
+    conditions = payload.get(key, [])
+    if not conditions or (toggle is not None and not payload.get(toggle, False)):
+        return None
+    return conditions
+
+
+def _condition_key(conditions):
+    return json.dumps(conditions, sort_keys=True)
+
+
+def _base_gate(engine, payloads):
+    """
+    Bar-close column the rows can be thinned to for every payload: that of
+    the finest engine.base_timeframe() among them, None when one needs "1m".
+    The closes of a larger bar size are a subset of a smaller one's.
+    """
+    timeframes = {engine.base_timeframe(payload) for payload in payloads}
+    if "1m" in timeframes:
+        return None
+    return engine.BASE_GATE_COLUMNS[min(timeframes, key=lambda tf: engine.TIMEFRAME_TO_MINUTES.get(tf, 1))]
+
+
+def load_sweep_data(engine, payloads):
+    """
+    Load the pairs once for all payloads (already passed through the engine's
+    get_user_payload) and merge them into time-ordered arrays holding the
+    closes every variant needs plus one "mask:<n>" column per distinct
+    condition list. Returns (columns, mask_names) where mask_names maps each
+    condition list's key to its column, or None when no row is left.
+
+    The pairs are read a window at a time as in
+    backtest_passes.run_signal_pass(): the masks are evaluated on each
+    window's 1m rows, then only the rows on the variants' base timeframe
+    closes (see _base_gate) and the merged columns are kept.
+    """
+    base = payloads[0]
+    pairs = base["pairs"]
+    min_daily_volume = base.get("min_daily_volume", 0.0)
+    start_date = pd.to_datetime(base.get("start_date", ""), errors="coerce")
+    end_date = pd.to_datetime(base.get("end_date", ""), errors="coerce")
+
+    req_cols = set()
+    mask_names = {}
+    masks = {}
+    close_cols = {"close"}
+    for payload in payloads:
+        req_cols.update(engine.gather_required_columns(
+            payload.get("entry_conditions", []),
+            payload.get("safety_conditions", []),
+            payload.get("exit_conditions", [])
+        ))
+        for _, key, toggle in CONDITION_KINDS:
+            conditions = _active_conditions(payload, key, toggle)
+            if conditions is not None and _condition_key(conditions) not in mask_names:
+                name = f"mask:{len(mask_names)}"
+                mask_names[_condition_key(conditions)] = name
+                masks[name] = backtest_conditions.compile_conditions(conditions, engine.BAR_CLOSE_COLUMNS)
+        for tf in _timeframes(engine, payload):
+            if tf != "1m":
+                close_cols.add(f"close_{tf}")
+    if min_daily_volume > 0:
+        req_cols.add(backtest_core.DAILY_VOLUME_COLUMN)
+    base_gate = _base_gate(engine, payloads)
+    if base_gate is not None:
+        req_cols.add(base_gate)
+    merged_cols = sorted(close_cols) + sorted(masks)
+
+    parts = {p: [] for p in pairs}
+    prev_rows = {}
+    for dfs_map in engine.stream_parquets_in_parallel(pairs, sorted(req_cols), start_date, end_date):
+        for sym, df in dfs_map.items():
+            df = backtest_passes.filter_pair_window(df, start_date, end_date, min_daily_volume)
+            if df.empty:
+                continue
+            for name, mask in masks.items():
+                df[name] = mask(df, prev_rows.get(sym))
+            prev_rows[sym] = df.tail(1).copy()
+            if base_gate is not None:
+                df = df[df[base_gate].to_numpy(dtype=bool)]
+            parts[sym].append(df[[backtest_data.TIMESTAMP_COLUMN] + merged_cols])
+    if not any(parts.values()):
+        return None
+
+    frames = []
+    for p in pairs:
+        chunks = parts.pop(p)
+        frames.append(pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame())
+    columns = backtest_data.merge_pairs(frames, merged_cols)
+    return columns, mask_names
+
+
+def _timeframes(engine, payload):
+    entry_conditions = payload.get("entry_conditions", [])
+    safety_conditions = payload.get("safety_conditions", [])
+    entry_tf = engine.get_highest_timeframe(entry_conditions) if entry_conditions else "1m"
+    so_tf = engine.get_highest_timeframe(safety_conditions) if safety_conditions else "1m"
+    return entry_tf, so_tf
+
+
+def _stop_times(engine, payload, stage):
+    start_date = pd.to_datetime(payload.get("start_date", ""), errors="coerce")
+    end_date = pd.to_datetime(payload.get("end_date", ""), errors="coerce")
+    return backtest_stops.stop_times(engine.early_stop_policy(payload), stage, start_date, end_date)
+
+
+def _variant_columns(columns, mask_names, payload):
+    n = len(columns["timestamp"])
+    variant = dict(columns)
+    for col, key, toggle in CONDITION_KINDS:
+        conditions = _active_conditions(payload, key, toggle)
+        variant[col] = np.zeros(n, dtype=np.bool_) if conditions is None else columns[mask_names[_condition_key(conditions)]]
+    return variant
+
+
+def _simulator(engine, payload):
+    entry_tf, so_tf = _timeframes(engine, payload)
+    return backtest_core.SignalSimulator(payload["pairs"], payload, entry_tf=entry_tf, so_tf=so_tf,
+                                         stop_policy=engine.early_stop_policy(payload),
+                                         stop_times=_stop_times(engine, payload, backtest_stops.SIGNAL))
+
+
+def run_signals(engine, columns, mask_names, payload):
+    """Pass 1 of payload over the shared columns: (events, early_stop_reason)."""
+    sim = _simulator(engine, payload)
+    sim.feed(_variant_columns(columns, mask_names, payload))
+    return sim.finish()
+
+
+def _replay(engine, events, early_stop_reason, payload):
+    """(result, curve): the variant's result row and its (timestamp, unrealized_balance) curve."""
+    if events is None:
+        return {"status": "no_trades", "message": early_stop_reason}, None
+    initial_balance = payload.get("initial_balance", 10000.0)
+    policy = engine.early_stop_policy(payload)
+    df_out, equity, drawdown_stop_reason = backtest_core.replay_positions(events, payload, policy)
+    df_out, equity, replay_stop_reason = backtest_stops.truncate_replay(
+        policy, _stop_times(engine, payload, backtest_stops.REPLAY), df_out, equity, initial_balance
+    )
+    replay_stop_reason = replay_stop_reason or drawdown_stop_reason
+    if df_out is None:
+        return {"status": "no_trades", "message": replay_stop_reason or early_stop_reason}, None
+    metrics = backtest_metrics.ledger_metrics(df_out, initial_balance, equity)
+    curve = df_out if equity is None or equity.empty else equity
+    result = {"status": "success", "message": replay_stop_reason or early_stop_reason, **metrics}
+    return result, curve[["timestamp", "unrealized_balance"]]
+
+
+def replay_variant(engine, events, early_stop_reason, payload):
+    """Pass 2 and the metrics of payload over a pass-1 EventLog (None when pass 1 made no events)."""
+    return _replay(engine, events, early_stop_reason, payload)[0]
+
+
+def signal_groups(engine, payloads, balances=False):
+    """
+    Indices of payloads grouped by their pass-1 signal key, in first-seen
+    order. With balances the groups also agree on the pass-1 balances, i.e.
+    on backtest_core.REPLAY_ONLY_KEYS.
+    """
+    groups = {}
+    for k, payload in enumerate(payloads):
+        stops = balances or engine.early_stop_policy(payload).watches(backtest_stops.SIGNAL)
+        groups.setdefault(backtest_core.signal_key(payload, stops), []).append(k)
+    return list(groups.values())
+
+
+def _init_worker(shared):
+    global _shared
+    _shared = shared
+
+
+def _evaluate_group(engine, columns, mask_names, payloads, indices):
+    """Pass 1 once for a group of variants, then pass 2 for each of them."""
+    try:
+        events, early_stop_reason = run_signals(engine, columns, mask_names, payloads[indices[0]])
+    except Exception as e:
+        return [{"status": "error", "message": str(e)} for _ in indices]
+    results = []
+    for k in indices:
+        try:
+            results.append(replay_variant(engine, events, early_stop_reason, payloads[k]))
+        except Exception as e:
+            results.append({"status": "error", "message": str(e)})
+    return results
+
+
+def _run_group(indices):
+    engine_name, columns, mask_names, payloads = _shared
+    return _evaluate_group(importlib.import_module(engine_name), columns, mask_names, payloads, indices)
+
+
+def _map_shared(fn, tasks, shared, processes):
+    """[fn(task)] for tasks, on a process pool whose workers see shared as _shared."""
+    processes = min(processes or os.cpu_count() or 1, len(tasks))
+    if processes <= 1:
+        _init_worker(shared)
+        return [fn(task) for task in tasks]
+    # Forked workers share the merged arrays with this process instead of
+    # receiving a pickled copy each.
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context("fork" if "fork" in methods else None)
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context,
+                             initializer=_init_worker, initargs=(shared,)) as executor:
+        return list(executor.map(fn, tasks, chunksize=max(1, len(tasks) // (4 * processes))))
+
+
+def _prepare(engine, base_payload, grid):
+    variants = expand_grid(base_payload, grid)
+    payloads = [engine.get_user_payload(payload) for _, payload in variants]
+    for payload in payloads:
+        payload["pairs"].sort()
+    if not payloads or not payloads[0]["pairs"]:
+        raise ValueError("No pairs selected.")
+    return variants, payloads
+
+
+def _ranked_table(variants, results, rank_by):
+    table = pd.DataFrame([{**params, **result} for (params, _), result in zip(variants, results)])
+    if rank_by in table.columns:
+        ranked = pd.to_numeric(table[rank_by], errors="coerce")
+        table = table.loc[ranked.sort_values(ascending=False, na_position="last", kind="stable").index]
+    table = table.reset_index(drop=True)
+    table.insert(0, "rank", np.arange(1, len(table) + 1))
+    return table
+
+
+def run_sweep(engine_name, base_payload, grid, rank_by=DEFAULT_RANK_BY, processes=None):
+    """
+    Run every combination of grid over base_payload with the engine module
+    engine_name ("backtest" or "backtest2"). Returns a DataFrame with the swept
+    parameters, status, message and metrics of each variant, best rank_by
+    first.
+    """
+    engine = importlib.import_module(engine_name)
+    variants, payloads = _prepare(engine, base_payload, grid)
+    data = load_sweep_data(engine, payloads)
+    if data is None:
+        results = [dict(NO_DATA) for _ in payloads]
+    else:
+        groups = signal_groups(engine, payloads)
+        group_results = _map_shared(_run_group, groups, (engine_name, data[0], data[1], payloads), processes)
+        results = [None] * len(payloads)
+        for indices, group in zip(groups, group_results):
+            for k, result in zip(indices, group):
+                results[k] = result
+
+    return _ranked_table(variants, results, rank_by)
+
+
+def run_halving(engine_name, base_payload, grid, rank_by=DEFAULT_RANK_BY, rung_metric="net_profit",
+                keep=DEFAULT_KEEP, rungs=CHECKPOINT_FRACTIONS):
+    """
+    Successive halving over the grid: all variants run pass 1 in lockstep up
+    to each rung (a fraction of the date range), where only the best keep
+    share by rung_metric (a key of SignalSimulator.interim_metrics()) goes
+    on. Survivors finish the history and get pass 2 and the full metrics.
+    Variants with equal signal keys and REPLAY_ONLY_KEYS share one simulator,
+    as the rung scores come from its balances. Returns the table
+    run_sweep() does; dropped variants have status "eliminated", the rung and
+    their rung_metric value. A run whose own early stop fires finishes there.
+    """
+    if rung_metric not in METRIC_SIGNS:
+        raise ValueError(f"Unknown rung_metric {rung_metric!r}, expected one of {', '.join(METRIC_SIGNS)}")
+    engine = importlib.import_module(engine_name)
+    variants, payloads = _prepare(engine, base_payload, grid)
+    data = load_sweep_data(engine, payloads)
+    if data is None:
+        return _ranked_table(variants, [dict(NO_DATA) for _ in payloads], rank_by)
+    columns, mask_names = data
+    ts = columns["timestamp"]
+
+    start_date = pd.to_datetime(payloads[0].get("start_date", ""), errors="coerce")
+    end_date = pd.to_datetime(payloads[0].get("end_date", ""), errors="coerce")
+    first = ts[0] if pd.isnull(start_date) else start_date.value
+    last = ts[-1] if pd.isnull(end_date) else end_date.value
+    cuts = [int(np.searchsorted(ts, first + f * (last - first))) for f in sorted(rungs)] + [len(ts)]
+
+    groups = signal_groups(engine, payloads, balances=True)
+    sims = {g: _simulator(engine, payloads[indices[0]]) for g, indices in enumerate(groups)}
+    group_columns = {g: _variant_columns(columns, mask_names, payloads[indices[0]])
+                     for g, indices in enumerate(groups)}
+    results = [None] * len(payloads)
+
+    def finish(g, extra=None):
+        events, early_stop_reason = sims.pop(g).finish()
+        for k in groups[g]:
+            results[k] = {**replay_variant(engine, events, early_stop_reason, payloads[k]), **(extra or {})}
+
+    lo = 0
+    for r, cut in enumerate(cuts):
+        for g in list(sims):
+            # Cuts fall between timestamps, so no timestamp spans two feeds
+            if not sims[g].feed({c: v[lo:cut] for c, v in group_columns[g].items()}):
+                finish(g)
+        lo = cut
+        if r == len(cuts) - 1 or len(sims) <= 1:
+            continue
+        label = f"{sorted(rungs)[r]:.0%}"
+        scores = {g: METRIC_SIGNS[rung_metric] * sim.interim_metrics()[rung_metric] for g, sim in sims.items()}
+        order = sorted(scores, key=lambda g: -scores[g])
+        for g in order[max(1, int(np.ceil(len(order) * keep))):]:
+            sims.pop(g)
+            for k in groups[g]:
+                results[k] = {"status": "eliminated", "rung": label,
+                              rung_metric: METRIC_SIGNS[rung_metric] * scores[g]}
+    for g in list(sims):
+        finish(g)
+    return _ranked_table(variants, results, rank_by)
+
+
+def walk_forward_windows(start_date, end_date, in_sample, out_of_sample, step=None):
+    """
+    Rolling (in-sample start, in-sample end = out-of-sample start, out-of-sample
+    end) timestamps over [start_date, end_date]; lengths are pandas Timedelta
+    strings ("180D") and step defaults to out_of_sample. The last
+    out-of-sample window is cut at end_date.
+    """
+    start_date, end_date = pd.Timestamp(start_date), pd.Timestamp(end_date)
+    in_sample, out_of_sample = pd.Timedelta(in_sample), pd.Timedelta(out_of_sample)
+    step = pd.Timedelta(step) if step is not None else out_of_sample
+    if in_sample <= pd.Timedelta(0) or out_of_sample <= pd.Timedelta(0) or step <= pd.Timedelta(0):
+        raise ValueError("Walk-forward window lengths must be positive")
+    windows = []
+    is_start = start_date
+    while is_start + in_sample < end_date:
+        is_end = is_start + in_sample
+        windows.append((is_start, is_end, min(is_end + out_of_sample, end_date)))
+        is_start += step
+    return windows
+
+
+def _with_dates(payload, start, end):
+    payload = dict(payload)
+    payload["start_date"] = str(start)
+    payload["end_date"] = str(end)
+    return payload
+
+
+def _run_window(window):
+    """Optimize the variants on one in-sample window, then run the best out of sample."""
+    engine_name, columns, mask_names, payloads, rank_by = _shared
+    engine = importlib.import_module(engine_name)
+    is_start, is_end, oos_end = window
+    ts = columns["timestamp"]
+    # Spans are half-open except the last, which keeps the rows at end_date
+    last = oos_end >= pd.Timestamp(payloads[0]["end_date"])
+    lo, mid, hi = np.searchsorted(ts, [is_start.value, is_end.value, oos_end.value + int(last)])
+
+    # Slices of the merged arrays are views, so no window copies the data
+    in_sample = {c: v[lo:mid] for c, v in columns.items()}
+    window_payloads = [_with_dates(p, is_start, is_end) for p in payloads]
+    results = [None] * len(payloads)
+    for indices in signal_groups(engine, window_payloads):
+        for k, result in zip(indices, _evaluate_group(engine, in_sample, mask_names, window_payloads, indices)):
+            results[k] = result
+    scores = pd.to_numeric(pd.Series([r.get(rank_by) for r in results], dtype=object), errors="coerce")
+    if scores.isna().all():
+        return None, {"status": "no_trades", "message": "No variant traded in sample."}, None
+    best = int(scores.idxmax())
+
+    out_of_sample = {c: v[mid:hi] for c, v in columns.items()}
+    payload = _with_dates(payloads[best], is_end, oos_end)
+    try:
+        events, early_stop_reason = run_signals(engine, out_of_sample, mask_names, payload)
+        result, curve = _replay(engine, events, early_stop_reason, payload)
+    except Exception as e:
+        result, curve = {"status": "error", "message": str(e)}, None
+    result[f"in_sample_{rank_by}"] = scores[best]
+    return best, result, curve
+
+
+def run_walk_forward(engine_name, base_payload, grid, in_sample, out_of_sample, step=None,
+                     rank_by=DEFAULT_RANK_BY, processes=None):
+    """
+    Walk-forward analysis: for each rolling window (walk_forward_windows())
+    every grid variant runs in sample, the best by rank_by runs on the
+    following out-of-sample span, and the out-of-sample equity curves are
+    stitched with each segment starting from the previous one's final
+    balance. The pairs are loaded once for the whole range and the windows
+    run on a process pool.
+
+    Returns {"windows": DataFrame with one row per window (bounds, chosen
+    parameters, in-sample score, out-of-sample status and metrics),
+    "equity": stitched (timestamp, unrealized_balance) curve,
+    "net_profit": out-of-sample return of the stitched curve}.
+    """
+    engine = importlib.import_module(engine_name)
+    variants, payloads = _prepare(engine, base_payload, grid)
+    start_date = pd.to_datetime(payloads[0].get("start_date", ""), errors="coerce")
+    end_date = pd.to_datetime(payloads[0].get("end_date", ""), errors="coerce")
+    if pd.isnull(start_date) or pd.isnull(end_date):
+        raise ValueError("Walk-forward analysis needs start_date and end_date")
+    windows = walk_forward_windows(start_date, end_date, in_sample, out_of_sample, step)
+    if not windows:
+        raise ValueError("The date range is shorter than one in-sample window")
+
+    data = load_sweep_data(engine, payloads)
+    if data is None:
+        outcomes = [(None, dict(NO_DATA), None) for _ in windows]
+    else:
+        outcomes = _map_shared(_run_window, windows, (engine_name, data[0], data[1], payloads, rank_by), processes)
+
+    initial_balance = payloads[0].get("initial_balance", 10000.0)
+    capital = initial_balance
+    rows, segments = [], []
+    for (is_start, is_end, oos_end), (best, result, curve) in zip(windows, outcomes):
+        params = variants[best][0] if best is not None else {}
+        rows.append({"in_sample_start": is_start, "in_sample_end": is_end,
+                     "out_of_sample_start": is_end, "out_of_sample_end": oos_end, **params, **result})
+        if curve is not None and len(curve):
+            balance = curve["unrealized_balance"].to_numpy(dtype=np.float64) * (capital / initial_balance)
+            segments.append(pd.DataFrame({"timestamp": curve["timestamp"].to_numpy(), "unrealized_balance": balance}))
+            capital = balance[-1]
+    equity = (pd.concat(segments, ignore_index=True) if segments
+              else pd.DataFrame({"timestamp": pd.Series(dtype="datetime64[ns]"), "unrealized_balance": []}))
+    return {
+        "windows": pd.DataFrame(rows),
+        "equity": equity,
+        "net_profit": (capital - initial_balance) / initial_balance,
+    }
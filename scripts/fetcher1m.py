@@ -1,11 +1,14 @@
 import ccxt
 import pandas as pd
+import pyarrow.parquet as pq
 import numpy as np
 from datetime import datetime, timezone
 from ta import momentum, trend, volatility
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import sys
 
+import backtest_data
+
 # Force unbuffered output
 def log(msg):
     print(msg, flush=True)
@@ -445,11 +448,13 @@ def process_symbol(exchange, symbol, start_ts, end_ts, timeframes):
             cols_to_drop.append(f"{col}_{tf}")
 
     merged_df = merged_df.drop(columns=cols_to_drop, errors='ignore')
+    merged_df = backtest_data.add_daily_volume(merged_df)
 
     import os
     os.makedirs("static", exist_ok=True)
     file_name = f"static/{symbol.replace('/', '_')}_all_tf_merged.parquet"
-    merged_df.to_parquet(file_name, index=False, compression='snappy')
+    # Record the timestamp order so the backtester can skip re-sorting
+    merged_df.to_parquet(file_name, index=False, compression='snappy', sorting_columns=[pq.SortingColumn(0)])
     log(f"✓ [{symbol}] SAVED: {file_name} (shape: {merged_df.shape})")
 
 # ----- MAIN SCRIPT -----
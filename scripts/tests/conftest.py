@@ -0,0 +1,98 @@
+"""
+Fixtures for the backtest parity tests: small synthetic *_all_tf_merged
+parquet files in the layout the data writers produce, and the pre-refactor
+engine (legacy_backtest) the vectorized code is checked against.
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+TIMEFRAMES = ["5m", "15m", "1h", "4h", "1d"]
+
+# Indicator columns by base name, with the (center, spread) of the random walk
+# each one follows (a None center follows the close); every name also gets a
+# _{tf} column per timeframe.
+INDICATORS = {
+    "RSI_14": (50, 25), "SMA_14": (None, 2), "SMA_28": (None, 2), "EMA_14": (None, 2), "EMA_28": (None, 2),
+    "BB_%B_20_2": (0.5, 0.6), "MACD_12_26_9": (0, 1), "MACD_12_26_9_Signal": (0, 1),
+    "Stochastic_K_14_3": (50, 30), "Stochastic_D_14_3_3": (50, 30),
+    "PSAR_AF_0.02_Max_0.2": (None, 2), "HA_Close": (None, 2),
+}
+TV_LABELS = np.array(["Strong Sell", "Sell", "Neutral", "Buy", "Strong Buy"])
+
+
+def _wander(rng, center, spread):
+    n = len(center)
+    steps = rng.normal(0, spread / 20, n)
+    values = center + np.clip(np.cumsum(steps), -spread, spread)
+    values[rng.random(n) < 0.002] = np.nan
+    return values
+
+
+def market_frame(start, days, seed, price=100.0):
+    """1m rows of one pair over days, with bar-close flags, close_{tf} and indicators."""
+    rng = np.random.default_rng(seed)
+    n = days * 1440
+    ts = pd.date_range(start, periods=n, freq="min")
+    close = price * np.exp(np.cumsum(rng.normal(0, 0.002, n)))
+    df = pd.DataFrame({"timestamp": ts, "open": np.r_[price, close[:-1]], "close": close})
+    df["high"] = np.maximum(df["open"], df["close"]) * 1.0005
+    df["low"] = np.minimum(df["open"], df["close"]) * 0.9995
+    df["volume"] = rng.uniform(1, 100, n)
+    minute = ts.minute
+    hour = ts.hour
+    df["Bar_Close_1m"] = True
+    df["Bar_Close_5m"] = minute % 5 == 4
+    df["Bar_Close_15m"] = minute % 15 == 14
+    df["Bar_Close_1h"] = minute == 59
+    df["Bar_Close_4h"] = (hour % 4 == 3) & (minute == 59)
+    df["Bar_Close_1d"] = (hour == 23) & (minute == 59)
+    for tf in TIMEFRAMES:
+        df[f"close_{tf}"] = pd.Series(close).where(df[f"Bar_Close_{tf}"]).ffill().to_numpy()
+    for name, (center, spread) in INDICATORS.items():
+        center = close if center is None else np.full(n, float(center))
+        df[name] = _wander(rng, center, spread)
+        for tf in TIMEFRAMES:
+            df[f"{name}_{tf}"] = _wander(rng, center, spread)
+    df["tv_tech_label"] = TV_LABELS[rng.integers(0, len(TV_LABELS), n)]
+    for tf in TIMEFRAMES:
+        df[f"tv_tech_label_{tf}"] = TV_LABELS[rng.integers(0, len(TV_LABELS), n)]
+    day = df["timestamp"].dt.floor("D")
+    df["daily_vol_usdt"] = (df["volume"] * df["close"]).groupby(day).transform("sum")
+    return df
+
+
+def write_market(directory, pair, df, row_group_size=4096, sorted_meta=True):
+    """Write df where the engines look for pair; returns the path."""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{pair.replace('/', '_')}_all_tf_merged.parquet")
+    kwargs = {"sorting_columns": [pq.SortingColumn(0)]} if sorted_meta else {}
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path, row_group_size=row_group_size, **kwargs)
+    return path
+
+
+PAIRS = ["AAA/USDT", "BBB/USDT"]
+DAYS = 12
+
+
+@pytest.fixture(scope="session")
+def frames():
+    """{pair: frame} for PAIRS and the BTC/USDT benchmark."""
+    pairs = PAIRS + ["BTC/USDT"]
+    return {pair: market_frame("2024-01-01", DAYS, k, 100.0 + 50 * k) for k, pair in enumerate(pairs)}
+
+
+@pytest.fixture
+def market(tmp_path, monkeypatch, frames):
+    """A working directory whose static/ holds frames, as the engines expect."""
+    for pair, df in frames.items():
+        write_market(str(tmp_path / "static"), pair, df)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
@@ -0,0 +1,80 @@
+"""iter_windows() against a whole-file read for the parquet layouts the writers have produced."""
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+import backtest_data
+
+COLUMNS = ["timestamp", "close", "RSI_14"]
+
+
+def _write(path, df, **kwargs):
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), path, **kwargs)
+    return str(path)
+
+
+@pytest.fixture(scope="module")
+def frame(frames):
+    return frames["AAA/USDT"][COLUMNS]
+
+
+def _read_pair(path, start, end):
+    """Rows of the file with start <= timestamp <= end, read whole and sorted."""
+    df = pd.read_parquet(path, columns=COLUMNS)
+    if start is not None:
+        df = df[df["timestamp"] >= pd.Timestamp(start)]
+    if end is not None:
+        df = df[df["timestamp"] <= pd.Timestamp(end)]
+    return df.sort_values("timestamp").reset_index(drop=True)
+
+
+def _shuffled_groups(df, size):
+    """Row groups in time order, each shuffled inside."""
+    rng = np.random.default_rng(1)
+    parts = [df.iloc[i:i + size].sample(frac=1, random_state=rng) for i in range(0, len(df), size)]
+    return pd.concat(parts, ignore_index=True)
+
+
+LAYOUTS = {
+    "sorted_metadata": lambda p, df: _write(p, df, row_group_size=3000, sorting_columns=[pq.SortingColumn(0)]),
+    "sorted_no_metadata": lambda p, df: _write(p, df, row_group_size=3000),
+    "groups_shuffled_inside": lambda p, df: _write(p, _shuffled_groups(df, 3000), row_group_size=3000),
+    "groups_out_of_order": lambda p, df: _write(p, pd.concat([df.iloc[9000:], df.iloc[:9000]]), row_group_size=3000),
+    "no_statistics": lambda p, df: _write(p, _shuffled_groups(df, 3000), row_group_size=3000,
+                                          write_statistics=False),
+}
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+@pytest.mark.parametrize("start,end", [(None, None), ("2024-01-02 10:00", "2024-01-09 23:59")])
+def test_windows_match_whole_read(tmp_path, frame, layout, start, end):
+    path = LAYOUTS[layout](tmp_path / "pair.parquet", frame)
+    edges = [pd.Timestamp(start) if start else None, *pd.date_range("2024-01-03", "2024-01-09", freq="2D"),
+             pd.Timestamp(end) if end else None]
+    expected = _read_pair(path, start, end)
+    windows = list(backtest_data.iter_windows(path, COLUMNS, edges))
+    assert len(windows) == len(edges) - 1
+    pd.testing.assert_frame_equal(pd.concat(windows, ignore_index=True), expected)
+    for window, lo, hi in zip(windows, edges[:-1], edges[1:-1]):
+        if len(window):
+            assert window["timestamp"].iloc[-1] < hi
+            assert lo is None or window["timestamp"].iloc[0] >= lo
+
+
+def test_unsorted_file_is_read_a_group_at_a_time(tmp_path, frame, monkeypatch):
+    path = LAYOUTS["groups_shuffled_inside"](tmp_path / "pair.parquet", frame)
+    read = []
+    original = pq.ParquetFile.read_row_group
+
+    def read_row_group(self, i, *args, **kwargs):
+        read.append(i)
+        return original(self, i, *args, **kwargs)
+
+    monkeypatch.setattr(pq.ParquetFile, "read_row_group", read_row_group)
+    monkeypatch.setattr(pq.ParquetFile, "read", lambda *a, **k: pytest.fail("whole file read"))
+    edges = backtest_data.window_edges(pd.Timestamp("2024-01-05"), pd.Timestamp("2024-01-07"), freq="D")
+    list(backtest_data.iter_windows(path, COLUMNS, edges))
+    assert sorted(read) == sorted(set(read))
+    assert set(read) == {1, 2}
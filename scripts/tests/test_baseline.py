@@ -0,0 +1,21 @@
+"""The buy-and-hold baseline when the benchmark has no data file."""
+import json
+
+import backtest
+import backtest_baseline
+
+PAYLOAD = {
+    "strategy_name": "baseline", "pairs": ["AAA/USDT"], "initial_balance": 10000, "trading_fee": 0.1,
+    "base_order_size": 1000, "max_active_deals": 1, "benchmark_symbol": "ZZZ/USDT",
+    "entry_conditions": [{"indicator": "RSI", "subfields": {"Timeframe": "15m", "Condition": "Less Than", "Signal Value": 40}}],
+    "exit_conditions": [{"indicator": "RSI", "subfields": {"Timeframe": "15m", "Condition": "Greater Than", "Signal Value": 60}}],
+    "conditions_active": True, "target_profit": 1.5,
+}
+
+
+def test_missing_benchmark_skips_baseline(market):
+    assert backtest_baseline.load_benchmark("static", "ZZZ/USDT") is None
+    result = backtest.run_backtest(json.loads(json.dumps(PAYLOAD)))
+    assert result["status"] == "success", result
+    assert result["message"] == "Backtest completed successfully (ZZZ/USDT data empty in range)."
+    assert result["metrics"]
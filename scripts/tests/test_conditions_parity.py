@@ -0,0 +1,71 @@
+"""compile_conditions() against the row-by-row check_all_user_conditions() it replaced."""
+import numpy as np
+import pytest
+
+import backtest
+import backtest_conditions
+import legacy_backtest
+
+
+def _cond(indicator, tf="1m", **subfields):
+    return {"indicator": indicator, "subfields": {"Timeframe": tf, **subfields}}
+
+
+OPERATORS = ["Less Than", "Greater Than", "Crossing Up", "Crossing Down"]
+
+CONDITIONS = (
+    [[_cond("RSI", tf, **{"RSI Length": 14, "Condition": op, "Signal Value": 45})]
+     for tf in ("1m", "15m", "1h") for op in OPERATORS]
+    + [[_cond("MA", tf, **{"MA Type": ma, "Fast MA": 14, "Slow MA": 28, "Condition": op})]
+       for tf in ("1m", "5m") for ma in ("SMA", "EMA") for op in OPERATORS]
+    + [[_cond("BollingerBands", tf, **{"BB% Period": 20, "Deviation": 2, "Condition": op, "Signal Value": 0.4})]
+       for tf in ("1m", "4h") for op in OPERATORS]
+    + [[_cond("MACD", "15m", **{"MACD Preset": "12,26,9", "MACD Trigger": trigger, "Line Trigger": line})]
+       for trigger in ("Crossing Up", "Crossing Down", "") for line in ("Less Than 0", "Greater Than 0", "")]
+    + [[_cond("Stochastic", "5m", **{"Stochastic Preset": "14,3,3", "K Condition": k_cond, "K Signal Value": 40,
+                                      "Condition": main})]
+       for k_cond in OPERATORS + [""] for main in ("K Crossing Up D", "K Crossing Down D", "")]
+    + [[_cond("ParabolicSAR", tf, **{"PSAR Preset": "0.02,0.2", "Condition": op, "Signal Value": 100})]
+       for tf in ("1m", "1h") for op in ("Crossing (Long)", "Crossing (Short)", "Less Than", "Greater Than")]
+    + [[_cond("TradingView", tf, **{"Signal Value": label})]
+       for tf in ("1m", "15m") for label in ("Buy", "Strong Buy", "Sell", "Strong Sell", "Neutral")]
+    + [[_cond("HeikenAshi", "5m", **{"Condition": op, "Signal Value": 100})] for op in ("Greater Than", "Less Than")]
+    + [[_cond("Unknown", "1m")], [],
+       [_cond("RSI", "15m", **{"Condition": "Less Than", "Signal Value": 55}),
+        _cond("MA", "15m", **{"MA Type": "SMA", "Condition": "Greater Than"}),
+        _cond("TradingView", "1h", **{"Signal Value": "Buy"})]]
+)
+
+
+def _reference(rows, conditions):
+    out = np.zeros(len(rows), dtype=bool)
+    prev_row = None
+    for i, row in enumerate(rows):
+        out[i] = legacy_backtest.check_all_user_conditions(row, conditions, prev_row)
+        prev_row = row
+    return out
+
+
+@pytest.fixture(scope="module")
+def frame(frames):
+    return frames["AAA/USDT"].iloc[:3 * 1440].reset_index(drop=True)
+
+
+@pytest.fixture(scope="module")
+def rows(frame):
+    return frame.to_dict("records")
+
+
+@pytest.mark.parametrize("conditions", CONDITIONS, ids=lambda c: "+".join(
+    f"{x['indicator']}-{x['subfields']['Timeframe']}-{x['subfields'].get('Condition', '')}" for x in c) or "empty")
+def test_mask_matches_row_checker(frame, rows, conditions):
+    mask = backtest_conditions.compile_conditions(conditions, backtest.BAR_CLOSE_COLUMNS)(frame)
+    np.testing.assert_array_equal(mask, _reference(rows, conditions))
+
+
+def test_continued_frame_uses_previous_row(frame, rows):
+    conditions = [_cond("RSI", "1m", **{"Condition": "Crossing Up", "Signal Value": 50})]
+    mask = backtest_conditions.compile_conditions(conditions, backtest.BAR_CLOSE_COLUMNS)
+    split = 1000
+    joined = np.concatenate([mask(frame.iloc[:split]), mask(frame.iloc[split:], prev_row=frame.iloc[:split])])
+    np.testing.assert_array_equal(joined, _reference(rows, conditions))
@@ -0,0 +1,44 @@
+"""
+Metrics of the current engine, whose replay samples the equity curve apart
+from the ledger, against the old loop's, which took it from HOUR CHECK rows.
+With one deal slot the hourly marks land on the same rows as the checks did.
+"""
+import json
+import math
+
+import pytest
+
+import backtest
+import legacy_backtest
+
+BASE = {
+    "strategy_name": "equity", "pairs": ["AAA/USDT", "BBB/USDT"], "initial_balance": 10000, "trading_fee": 0.1,
+    "base_order_size": 2000, "max_active_deals": 1,
+    "entry_conditions": [{"indicator": "RSI", "subfields": {"Timeframe": "1h", "Condition": "Less Than", "Signal Value": 40}}],
+    "safety_order_toggle": True, "safety_order_size": 1000, "price_deviation": 1.5,
+    "max_safety_orders_count": 2, "safety_order_volume_scale": 1.0, "safety_order_step_scale": 1.0,
+}
+
+RUNS = {
+    "closed_deals": {"price_change_active": True, "target_profit": 1.0},
+    "open_deal_at_end": {"target_profit": 50.0},
+}
+
+
+def _metrics(engine, payload):
+    result = engine.run_backtest(json.loads(json.dumps(payload)))
+    assert result["status"] == "success", result
+    return result["metrics"]
+
+
+@pytest.mark.parametrize("name", RUNS)
+def test_sampled_curve_gives_hour_check_metrics(market, name):
+    payload = {**BASE, **RUNS[name]}
+    expected = _metrics(legacy_backtest, payload)
+    got = _metrics(backtest, payload)
+    for key in ("total_profit", "sharpe_ratio", "sortino_ratio", "var_95", "max_drawdown",
+                "exposure_time_frac", "average_daily_profit", "yearly_return"):
+        if isinstance(expected[key], float) and math.isnan(expected[key]):
+            assert math.isnan(got[key]), key
+        else:
+            assert got[key] == pytest.approx(expected[key], rel=1e-9), key
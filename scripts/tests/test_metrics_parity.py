@@ -0,0 +1,48 @@
+"""backtest_metrics.ledger_metrics() against the iterrows compute_metrics() of legacy_backtest on one ledger."""
+import json
+import math
+
+import pandas as pd
+import pytest
+
+import backtest_metrics
+import legacy_backtest
+
+BASE = {
+    "strategy_name": "metrics", "initial_balance": 10000, "trading_fee": 0.1, "base_order_size": 1000,
+    "max_active_deals": 1,
+    "entry_conditions": [{"indicator": "RSI", "subfields": {"Timeframe": "15m", "Condition": "Less Than", "Signal Value": 40}}],
+    "exit_conditions": [{"indicator": "RSI", "subfields": {"Timeframe": "15m", "Condition": "Greater Than", "Signal Value": 60}}],
+    "conditions_active": True, "safety_order_toggle": True, "safety_order_size": 500, "price_deviation": 1.0,
+    "max_safety_orders_count": 3, "safety_order_volume_scale": 1.5, "safety_order_step_scale": 1.0,
+}
+
+LEDGERS = {
+    "one_pair": {"pairs": ["AAA/USDT"], "target_profit": 1.5},
+    "losses": {"pairs": ["AAA/USDT", "BBB/USDT"], "stop_loss_toggle": True, "stop_loss_value": 1.0,
+               "target_profit": 0.5},
+    "open_deal_at_end": {"pairs": ["BBB/USDT"], "exit_conditions": [], "target_profit": 5.0},
+}
+
+
+def _same(got, expected):
+    if isinstance(expected, str) or isinstance(got, str):
+        return got == expected
+    if math.isnan(expected):
+        return math.isnan(got)
+    return got == pytest.approx(expected, rel=1e-9, abs=1e-12)
+
+
+@pytest.mark.parametrize("name", LEDGERS)
+def test_metrics_match_row_loops(market, name):
+    payload = {**BASE, **LEDGERS[name]}
+    legacy_backtest.run_backtest(json.loads(json.dumps(payload)))
+    df_out = pd.read_csv("static/backtest_results/metrics/all_trades_combined.csv", parse_dates=["timestamp"])
+    df_out = df_out.drop(columns=["bh_balance"])
+    assert len(df_out) > 1
+
+    expected = legacy_backtest.compute_metrics(df_out.copy(), 10000, payload, str(market), "static")["metrics"]
+    got = backtest_metrics.ledger_metrics(df_out, 10000)
+    assert set(expected) <= set(got)
+    mismatched = {k: (got[k], v) for k, v in expected.items() if not _same(got[k], v)}
+    assert not mismatched
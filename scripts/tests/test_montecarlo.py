@@ -0,0 +1,19 @@
+"""backtest_montecarlo.from_payload() on settings the analysis cannot run with."""
+import pandas as pd
+import pytest
+
+import backtest_montecarlo
+
+LEDGER = pd.DataFrame({"action": ["BUY", "Take Profit EXIT", "BUY", "Stop Loss EXIT"],
+                       "real_balance": [10000.0, 10100.0, 10100.0, 10050.0]})
+
+
+def test_runs_with_defaults():
+    result = backtest_montecarlo.from_payload({"paths": 100, "seed": 1}, LEDGER, 10000)
+    assert result["trades"] == 2 and set(result["final_balance"]) == {"p5", "p25", "p50", "p75", "p95"}
+
+
+@pytest.mark.parametrize("spec", [{"percentiles": [5, 150]}, {"paths": 0}, {"method": "walk"}, {"seed": -1}, "often"])
+def test_bad_setting_is_reported(spec):
+    result = backtest_montecarlo.from_payload(spec, LEDGER, 10000)
+    assert result["status"] == "error" and result["message"]
@@ -0,0 +1,66 @@
+"""backtest_passes.run_pair_signal_passes() on its process pool and in the calling process."""
+import json
+import threading
+import types
+
+import pandas as pd
+
+import backtest2
+import backtest_core
+import backtest_passes
+
+PAYLOAD = {
+    "strategy_name": "pairs", "pairs": ["AAA/USDT", "BBB/USDT"], "initial_balance": 10000, "trading_fee": 0.1,
+    "base_order_size": 1000, "max_active_deals": 2, "early_stop": "none",
+    "entry_conditions": [{"indicator": "RSI", "subfields": {"Timeframe": "15m", "Condition": "Less Than", "Signal Value": 40}}],
+    "exit_conditions": [{"indicator": "RSI", "subfields": {"Timeframe": "15m", "Condition": "Greater Than", "Signal Value": 60}}],
+    "conditions_active": True, "target_profit": 1.5,
+}
+
+
+def _ledger():
+    result = backtest2.run_backtest(json.loads(json.dumps(PAYLOAD)))
+    assert result["status"] == "success", result
+    return pd.read_csv(f"{backtest2.DATA_DIR}/backtest_results/pairs/all_trades_combined.csv")
+
+
+def test_pool_runs_beside_other_threads(market, monkeypatch, tmp_path):
+    assert backtest_core.slot_independent(backtest2.get_user_payload(dict(PAYLOAD)), 2)
+    # The workers must get DATA_DIR from the caller: it is not "static"
+    # relative to their working directory.
+    monkeypatch.setattr(backtest2, "DATA_DIR", str(market / "static"))
+    monkeypatch.chdir(tmp_path.parent)
+    monkeypatch.setattr(backtest_passes, "PAIR_PROCESSES", 1)
+    serial = _ledger()
+
+    pools = []
+
+    class Pool(backtest_passes.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            pools.append(kwargs["mp_context"].get_start_method())
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(backtest_passes, "ProcessPoolExecutor", Pool)
+    monkeypatch.setattr(backtest_passes, "PAIR_PROCESSES", 2)
+    # The job server calls run_backtest from a thread pool, next to its
+    # progress thread
+    release = threading.Event()
+    thread = threading.Thread(target=release.wait)
+    thread.start()
+    try:
+        pooled = _ledger()
+    finally:
+        release.set()
+        thread.join()
+    assert len(pools) == 1 and pools[0] != "fork"
+    assert serial["symbol"].nunique() == 2
+    pd.testing.assert_frame_equal(pooled, serial)
+
+
+def test_script_engine_is_imported_by_file_name():
+    # Run as a script, an engine is __main__; its workers import it by file
+    # name so that _init_pair_worker's DATA_DIR reaches its functions.
+    script = types.ModuleType("__main__")
+    script.__file__ = backtest2.__file__
+    assert backtest_passes._engine_name(script) == "backtest2"
+    assert backtest_passes._engine_name(backtest2) == "backtest2"
@@ -0,0 +1,137 @@
+"""
+The columnar pass 1 (backtest_core._signal_kernel) and replay against the
+iterrows loop of legacy_backtest, compared on the trade ledger either engine
+writes. The payloads carry no dates, which leaves out the profit gates; the
+legacy gates were checked on every row after their checkpoint while the
+policies check them once, at it. The max drawdown stops of both passes apply,
+and one run crosses a checkpoint the default gates stop at.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import backtest
+import backtest_core
+import backtest_passes
+import conftest
+import legacy_backtest
+
+LEDGER = "static/backtest_results/parity/all_trades_combined.csv"
+
+BASE = {
+    "strategy_name": "parity", "pairs": ["AAA/USDT"], "initial_balance": 10000, "trading_fee": 0.1,
+    "base_order_size": 1000, "max_active_deals": 1,
+    "entry_conditions": [{"indicator": "RSI", "subfields": {"Timeframe": "15m", "Condition": "Less Than", "Signal Value": 40}}],
+    "exit_conditions": [{"indicator": "RSI", "subfields": {"Timeframe": "15m", "Condition": "Greater Than", "Signal Value": 60}}],
+    "conditions_active": True, "target_profit": 1.5,
+    "safety_order_toggle": True, "safety_order_size": 500, "price_deviation": 1.0, "max_safety_orders_count": 3,
+    "safety_order_volume_scale": 1.5, "safety_order_step_scale": 1.0,
+}
+
+SCENARIOS = {
+    "conditions": {},
+    "stop_loss_cooldown": {"stop_loss_toggle": True, "stop_loss_value": 2.0, "cooldown_between_deals": 30,
+                           "target_profit": 1.0},
+    "volume_safety_timeouts": {
+        "pairs": ["BBB/USDT"], "min_daily_volume": 300000, "stop_loss_toggle": True, "stop_loss_value": 3.0,
+        "stop_loss_timeout": 60, "close_deal_after_timeout": 600,
+        "safety_conditions": [{"indicator": "RSI", "subfields": {"Timeframe": "5m", "Condition": "Less Than", "Signal Value": 35}}],
+    },
+    "price_change_reinvest": {"price_change_active": True, "target_profit": 0.8, "conditions_active": False,
+                              "reinvest_profit": 50, "risk_reduction": 20, "minprof_toggle": True, "minimal_profit": 0.3},
+    "drawdown_stop": {"pairs": ["AAA/USDT", "BBB/USDT"], "base_order_size": 6000, "safety_order_size": 4000,
+                      "max_safety_orders_count": 5, "safety_order_volume_scale": 2},
+}
+
+
+def _ledger_file():
+    df = pd.read_csv(LEDGER)
+    return df[df["action"] != "HOUR CHECK"].reset_index(drop=True)
+
+
+def _ledger(engine, payload):
+    result = engine.run_backtest(json.loads(json.dumps(payload)))
+    assert result["status"] == "success", result
+    return _ledger_file()
+
+
+@pytest.mark.parametrize("name", SCENARIOS)
+def test_ledger_matches_row_loop(market, name):
+    payload = {**BASE, **SCENARIOS[name]}
+    expected = _ledger(legacy_backtest, payload)
+    got = _ledger(backtest, payload)
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(got[expected.columns], expected, check_dtype=False)
+
+
+def test_pairs_share_deal_slots(market):
+    # Rows of several pairs at one timestamp were in arbitrary order in the
+    # old loop, and order sizes follow the balance at each entry, so only the
+    # trades and the final balance are compared.
+    payload = {**BASE, "pairs": ["AAA/USDT", "BBB/USDT"], "price_change_active": True, "target_profit": 0.5,
+               "conditions_active": False, "stop_loss_toggle": True, "stop_loss_value": 1.5}
+    expected = _ledger(legacy_backtest, payload)
+    got = _ledger(backtest, payload)
+    trades = ["timestamp", "symbol", "action", "price", "trade_id"]
+    key = ["timestamp", "trade_id", "action"]
+    pd.testing.assert_frame_equal(got[trades].sort_values(key).reset_index(drop=True),
+                                  expected[trades].sort_values(key).reset_index(drop=True), check_dtype=False)
+    assert got["real_balance"].iloc[-1] == pytest.approx(expected["real_balance"].iloc[-1], abs=1.0)
+    assert got["symbol"].nunique() == 2
+
+
+def test_checkpoint_stop_keeps_waiting_entries(tmp_path, monkeypatch, capsys, frames):
+    # The default policy stops both engines at the 25% point (2024-01-04
+    # 06:00, nothing has been gained); the entry signalled on the bar before
+    # it is still opened, one on the checkpoint bar itself is not.
+    static = str(tmp_path / "static")
+    for pair, df in frames.items():
+        df = df.copy()
+        if pair != "BTC/USDT":
+            signal = df["timestamp"] == ("2024-01-04 05:59" if pair == "AAA/USDT" else "2024-01-04 06:00")
+            df["RSI_14_1h"] = np.where(signal, 20.0, 50.0)
+            df["Bar_Close_1h"] |= signal
+        conftest.write_market(static, pair, df)
+    monkeypatch.chdir(tmp_path)
+    payload = {**BASE, "pairs": ["AAA/USDT", "BBB/USDT"], "max_active_deals": 2, "start_date": "2024-01-02",
+               "end_date": "2024-01-11", "safety_order_toggle": False,
+               "entry_conditions": [{"indicator": "RSI", "subfields": {"Timeframe": "1h", "Condition": "Less Than", "Signal Value": 40}}]}
+    stop = "Stopped early due to negative net profit at 25% point (2024-01-04 06:00:00)"
+    ledgers = []
+    for engine in (legacy_backtest, backtest):
+        result = engine.run_backtest(json.loads(json.dumps(payload)))
+        assert stop in capsys.readouterr().out
+        assert "metrics" in result, result
+        ledgers.append(_ledger_file())
+    expected, got = ledgers
+    assert list(expected["symbol"] + " " + expected["action"]) == ["AAA/USDT BUY"]
+    pd.testing.assert_frame_equal(got[expected.columns], expected, check_dtype=False)
+
+
+def test_ties_keep_emission_order(market, monkeypatch):
+    # The old replay sorted the ledger on timestamp alone, which left the
+    # events of one timestamp in arbitrary order. An exit now comes before
+    # the entry it was emitted before, which is sized from the balance after
+    # it, whether the pairs run jointly or one by one.
+    payload = {**BASE, "pairs": ["AAA/USDT", "BBB/USDT"], "max_active_deals": 2, "price_change_active": True,
+               "target_profit": 0.5, "conditions_active": False, "stop_loss_toggle": True, "stop_loss_value": 1.5,
+               "reinvest_profit": 50, "early_stop": "none"}
+    monkeypatch.setattr(backtest_passes, "PAIR_PROCESSES", 1)
+    merged = _ledger(backtest, payload)
+    monkeypatch.setattr(backtest_core, "slot_independent", lambda *args: False)
+    joint = _ledger(backtest, payload)
+    pd.testing.assert_frame_equal(merged, joint)
+    is_buy = joint["action"] == "BUY"
+    tied = joint[joint["timestamp"].duplicated(keep=False)]
+    assert (tied.groupby("timestamp")["action"].agg(lambda a: list(a == "BUY") == sorted(a == "BUY"))).all()
+    # BBB's exit before AAA's entry: the order by symbol name would swap them
+    previous = joint.shift()
+    after_exit = joint.index[is_buy & (joint["symbol"] == "AAA/USDT") & (previous["timestamp"] == joint["timestamp"])
+                             & previous["action"].str.contains("EXIT", na=False)]
+    assert len(after_exit)
+    exits = joint.loc[after_exit - 1]
+    assert (exits["symbol"] == "BBB/USDT").all()
+    sizes = joint.loc[after_exit, "order_size"].to_numpy()
+    np.testing.assert_allclose(sizes, exits["real_balance"].to_numpy() / 10, atol=0.01)
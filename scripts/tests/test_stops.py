@@ -0,0 +1,18 @@
+"""backtest_stops.truncate_replay() at a checkpoint that falls on a ledger row."""
+import pandas as pd
+
+import backtest_stops
+
+
+def test_replay_keeps_rows_at_checkpoint():
+    # Like the old loop, which looked at the gates after the first row at or
+    # past the checkpoint, the rows at the checkpoint itself are kept.
+    ts = pd.to_datetime(["2024-01-01 05:59", "2024-01-01 06:00", "2024-01-01 06:00", "2024-01-01 06:01"])
+    df_out = pd.DataFrame({"timestamp": ts, "real_balance": [10000.0, 10000.0, 9900.0, 9950.0],
+                           "unrealized_balance": 10000.0, "max_drawdown": 0.0})
+    policy = backtest_stops.ProfitGates([("25%", 1 / 4, 0.0, True)])
+    times = backtest_stops.stop_times(policy, backtest_stops.REPLAY, pd.Timestamp("2024-01-01"),
+                                      pd.Timestamp("2024-01-02"))
+    kept, _, reason = backtest_stops.truncate_replay(policy, times, df_out, None, 10000.0)
+    assert reason == "Stopped early due to negative net profit at 25% point (2024-01-01 06:00:00)"
+    assert list(kept["real_balance"]) == [10000.0, 10000.0, 9900.0]
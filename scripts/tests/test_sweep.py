@@ -0,0 +1,42 @@
+"""run_sweep() variants against run_backtest() of the same payload."""
+import json
+
+import pytest
+
+import backtest
+import backtest_sweep
+
+BASE = {
+    "strategy_name": "sweep", "pairs": ["AAA/USDT", "BBB/USDT"], "initial_balance": 10000, "trading_fee": 0.1,
+    "base_order_size": 1000, "max_active_deals": 2,
+    "entry_conditions": [{"indicator": "RSI", "subfields": {"Timeframe": "15m", "Condition": "Crossing Up", "Signal Value": 40}}],
+    "exit_conditions": [{"indicator": "RSI", "subfields": {"Timeframe": "15m", "Condition": "Greater Than", "Signal Value": 60}}],
+    "conditions_active": True, "safety_order_toggle": True, "safety_order_size": 500, "price_deviation": 1.0,
+    "max_safety_orders_count": 3, "safety_order_volume_scale": 1.5, "safety_order_step_scale": 1.0,
+    "safety_conditions": [{"indicator": "RSI", "subfields": {"Timeframe": "15m", "Condition": "Less Than", "Signal Value": 35}}],
+}
+GRID = {"target_profit": [1.0, 2.5]}
+METRICS = ["net_profit", "total_trades", "max_drawdown"]
+
+
+@pytest.mark.parametrize("early_stop,base_tf", [("none", "15m"), (None, "1m")])
+def test_variants_match_single_runs(market, early_stop, base_tf):
+    base = {**BASE, "early_stop": early_stop}
+    variants, payloads = backtest_sweep._prepare(backtest, base, GRID)
+    assert {backtest.base_timeframe(payload) for payload in payloads} == {base_tf}
+
+    table = backtest_sweep.run_sweep("backtest", base, GRID, processes=1)
+    assert len(table) == len(variants)
+    for _, row in table.iterrows():
+        result = backtest.run_backtest(json.loads(json.dumps({**base, "target_profit": row["target_profit"]})))
+        assert row["status"] == result["status"] == "success"
+        assert row["total_trades"] > 0
+        for name in METRICS:
+            assert row[name] == pytest.approx(result["metrics"][name], rel=1e-9), name
+
+
+def test_halving_scores_replay_only_keys_apart(market):
+    base = {**BASE, "early_stop": "none"}
+    table = backtest_sweep.run_halving("backtest", base, {"trading_fee": [0.1, 2.0]}, keep=0.5)
+    status = dict(zip(table["trading_fee"], table["status"]))
+    assert status == {0.1: "success", 2.0: "eliminated"}
@@ -7,6 +7,7 @@ Run via cron or scheduler every hour.
 
 import ccxt
 import pandas as pd
+import pyarrow.parquet as pq
 import numpy as np
 from datetime import datetime, timezone, timedelta
 from ta import momentum, trend, volatility
@@ -14,6 +15,8 @@ from concurrent.futures import ThreadPoolExecutor, as_completed
 import os
 import sys
 
+import backtest_data
+
 # Force unbuffered output
 def log(msg):
     print(f"[{datetime.now().strftime('%H:%M:%S')}] {msg}", flush=True)
@@ -199,9 +202,11 @@ def update_symbol(exchange, symbol, timeframes):
         
         merged_df.sort_index(inplace=True)
         merged_df.reset_index(inplace=True)
+        merged_df = backtest_data.add_daily_volume(merged_df)
         
         # Save updated data
-        merged_df.to_parquet(file_path, index=False, compression='snappy')
+        # Record the timestamp order so the backtester can skip re-sorting
+        merged_df.to_parquet(file_path, index=False, compression='snappy', sorting_columns=[pq.SortingColumn(0)])
         log(f"  {symbol}: ✓ Updated ({len(merged_df)} total candles)")
         
         return True
@@ -1,13 +1,42 @@
 import {
   IsString,
   IsNumber,
+  IsInt,
+  Min,
+  Max,
   IsArray,
   IsOptional,
   ValidateNested,
   IsBoolean,
+  IsIn,
+  ValidateBy,
+  ValidationOptions,
+  buildMessage,
+  isObject,
+  IsObject,
+  ValidateIf,
 } from 'class-validator';
 import { Type } from 'class-transformer';
 
+// payload["early_stop"]: one of these names or a policy object (see backtest_stops.from_payload)
+const EARLY_STOP_NAMES = ['none', 'default'];
+
+export function IsEarlyStop(validationOptions?: ValidationOptions) {
+  return ValidateBy(
+    {
+      name: 'isEarlyStop',
+      validator: {
+        validate: (value) => EARLY_STOP_NAMES.includes(value) || isObject(value),
+        defaultMessage: buildMessage(
+          (eachPrefix) => `${eachPrefix}$property must be one of ${EARLY_STOP_NAMES.join(', ')} or a policy object`,
+          validationOptions,
+        ),
+      },
+    },
+    validationOptions,
+  );
+}
+
 export class ConditionSubfields {
   @IsOptional()
   @IsString()
@@ -93,6 +122,31 @@ export class StrategyCondition {
   subfields: ConditionSubfields;
 }
 
+// payload["monte_carlo"] as an object (see backtest_montecarlo.from_payload)
+export class MonteCarloOptions {
+  @IsOptional()
+  @IsInt()
+  @Min(1)
+  @Max(100000)
+  paths?: number;
+
+  @IsOptional()
+  @IsIn(['bootstrap', 'shuffle'])
+  method?: string;
+
+  @IsOptional()
+  @IsInt()
+  @Min(0)
+  seed?: number;
+
+  @IsOptional()
+  @IsArray()
+  @IsNumber({}, { each: true })
+  @Min(0, { each: true })
+  @Max(100, { each: true })
+  percentiles?: number[];
+}
+
 export class RunBacktestDto {
   @IsString()
   strategy_name: string;
@@ -268,6 +322,29 @@ export class RunBacktestDto {
   @IsNumber()
   close_deal_after_timeout?: number;
 
+  @IsOptional()
+  @IsString()
+  benchmark_symbol?: string;
+
+  // How often an open deal is marked to market (backtest_core.EQUITY_SAMPLING)
+  @IsOptional()
+  @IsIn(['none', 'trades', '1h', '4h', '1d'])
+  equity_sampling?: string;
+
+  // "none", "default" or a policy object, e.g.
+  // { type: 'profit_gates', max_drawdown: 0.3, gates: [{ at: 0.5, min_net_profit: 0 }] }
+  @IsOptional()
+  @IsEarlyStop()
+  early_stop?: string | Record<string, unknown>;
+
+  // true, or { paths: 10000, method: 'bootstrap' | 'shuffle', seed: 1, percentiles: [5, 50, 95] }
+  @IsOptional()
+  @ValidateIf((o) => typeof o.monte_carlo !== 'boolean')
+  @IsObject()
+  @ValidateNested()
+  @Type(() => MonteCarloOptions)
+  monte_carlo?: boolean | MonteCarloOptions;
+
   // Legacy fields
   @IsOptional()
   trailing_stop?: boolean;